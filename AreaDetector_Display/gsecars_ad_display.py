@@ -7,9 +7,9 @@ import sys
 
 # use -d option for debug mode
 if (len(sys.argv) > 1 and sys.argv[1].startswith('-d')):
-    from lib import AD_Display
+    from lib import AD_Display, TiledDisplay
 else:
-    from epicsapps.ad_display import AD_Display
+    from epicsapps.ad_display import AD_Display, TiledDisplay
 
 cameras = {'Sample Microscope': '13IDEPS1',
            'IDB Viewscreen': '13IDBPS1',
@@ -21,7 +21,11 @@ if __name__ == '__main__':
         prefix = sys.argv[1]
     
     app = wx.App()
-    frame = AD_Display(prefix=prefix, app=app,
-                       known_cameras=cameras)
+    # use --tiles option to show all cameras at once
+    if '--tiles' in sys.argv:
+        frame = TiledDisplay(cameras, app=app)
+    else:
+        frame = AD_Display(prefix=prefix, app=app,
+                           known_cameras=cameras)
     frame.Show()
     app.MainLoop()
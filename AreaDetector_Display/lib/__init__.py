@@ -1 +1,2 @@
 from ad_display import AD_Display
+from tiledisplay import TiledDisplay
@@ -18,7 +18,6 @@ from wxmplot.colors import hexcolor
 
 ICON_FILE = '/Users/epics/bin/camera.ico'
 
-from debugtime import debugtime
 os.environ['EPICS_CA_MAX_ARRAY_BYTES'] = '16777216'
 
 class Empty:
@@ -28,7 +27,7 @@ import epics
 from epics.wx import (DelayedEpicsCallback, EpicsFunction, Closure,
                       PVEnumChoice, PVFloatCtrl, PVTextCtrl)
 
-from epics.wx.utils import add_menu
+from epics.wx.utils import add_menu, pack, FloatCtrl, SimpleText
 
 HAS_OVERLAY_DEVICE = False
 try:
@@ -38,13 +37,79 @@ except ImportError:
     pass
 
 from imageview import ImageView
+from renderer import (FrameRenderer, DECIMATIONS, fit_size,
+                      get_orientation, oriented_size)
+from colormap import COLORTABLE_NAMES, TRANSFERS, AUTOSCALES
+from lineprofile import line_profile
+from roistats import ROIStats
+from frameproc import FrameProcessor
+from histogram import HistogramPanel
+from recorder import FrameRecorder, RecordingReader, ReplayPlayer
+from framefetch import FrameFetcher, IMG_ATTRS
+from codec import CodecFetcher, CODEC_IMG_ATTRS
+from governor import FrameGovernor
+from simulator import SimulatedSource, SIM_DTYPES, SIM_COLORMODES
+from tiledisplay import TiledDisplay
+
+class SimulatorDialog(wx.Dialog):
+    """Select frame size, data type, color mode and rate for a
+    simulated camera"""
+    def __init__(self, parent, width=1024, height=1024, dtype='uint16',
+                 colormode=0, rate=10.0, **kws):
+        wx.Dialog.__init__(self, parent, wx.ID_ANY, title='Simulated Camera')
+        panel = wx.Panel(self)
+        sizer = wx.GridBagSizer(10, 3)
+        labstyle  = wx.ALIGN_LEFT|wx.ALIGN_CENTER_VERTICAL|wx.ALL
+
+        colornames = sorted(SIM_COLORMODES.keys())
+        colorname = colornames[0]
+        for name, val in SIM_COLORMODES.items():
+            if val == colormode:
+                colorname = name
+        self.width  = FloatCtrl(panel, value=width, precision=0, minval=8,
+                                maxval=16384, size=(100, -1))
+        self.height = FloatCtrl(panel, value=height, precision=0, minval=8,
+                                maxval=16384, size=(100, -1))
+        self.rate   = FloatCtrl(panel, value=rate, precision=1, minval=0,
+                                size=(100, -1))
+        self.dtype  = wx.Choice(panel, -1, choices=SIM_DTYPES, size=(100, -1))
+        self.color  = wx.Choice(panel, -1, choices=colornames, size=(100, -1))
+        self.dtype.SetStringSelection(dtype)
+        self.color.SetStringSelection(colorname)
+
+        labels = ('Width:', 'Height:', 'Data Type:', 'Color Mode:',
+                  'Frames/sec (0 = max):')
+        ctrls = (self.width, self.height, self.dtype, self.color, self.rate)
+        for irow, (label, ctrl) in enumerate(zip(labels, ctrls)):
+            sizer.Add(SimpleText(panel, label), (irow, 0), (1, 1), labstyle, 1)
+            sizer.Add(ctrl, (irow, 1), (1, 1), labstyle, 1)
+
+        btnsizer = wx.StdDialogButtonSizer()
+        btn = wx.Button(panel, wx.ID_OK)
+        btn.SetDefault()
+        btnsizer.AddButton(btn)
+        btnsizer.AddButton(wx.Button(panel, wx.ID_CANCEL))
+        btnsizer.Realize()
+        sizer.Add(btnsizer, (len(labels), 0), (1, 2),
+                  wx.ALIGN_CENTER_VERTICAL|wx.ALL, 1)
+        pack(panel, sizer)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(panel, 0, 0, 0)
+        pack(self, sizer)
+
+    def GetResponse(self):
+        "return dict of simulator options"
+        return dict(width=int(self.width.GetValue()),
+                    height=int(self.height.GetValue()),
+                    dtype=self.dtype.GetStringSelection(),
+                    colormode=SIM_COLORMODES[self.color.GetStringSelection()],
+                    rate=float(self.rate.GetValue()))
 
 
 class AD_Display(wx.Frame):
     """AreaDetector Display """
-    img_attrs = ('ArrayData', 'UniqueId_RBV', 'NDimensions_RBV',
-                 'ArraySize0_RBV', 'ArraySize1_RBV', 'ArraySize2_RBV',
-                 'ColorMode_RBV')
+    img_attrs = IMG_ATTRS
 
     cam_attrs = ('Acquire', 'ArrayCounter', 'ArrayCounter_RBV',
                  'DetectorState_RBV',  'NumImages', 'ColorMode',
@@ -56,37 +121,56 @@ class AD_Display(wx.Frame):
     # plugins to enable
     enabled_plugins = ('image1', 'Over1', 'ROI1', 'JPEG1', 'TIFF1')
 
-    stat_msg = 'Read %.1f%% of images: rate=%.1f frames/sec'
+    # codec plugin and image plugin for compressed arrays
+    codec_plugins = ('Codec1', 'image2')
+
+    stat_msg = ('Shown %i of %i frames, skipped %i (%.1f fps, load %.0f%%): '
+                'fetch %.1f ms, render %.1f ms')
 
     def __init__(self, prefix=None, app=None, scale=1.0, approx_height=1200,
-                 known_cameras=None):
+                 known_cameras=None, simulate=None):
         self.app = app
         self.ad_img = None
         self.ad_cam = None
-        self.imgcount = 0
+        self.fetcher = None
+        self.ad_cimg = None
+        self.use_codec = False
+        self.recorder = None
+        self.player = None
         self.prefix = prefix
         self.fname = 'AD_Image.tiff'
         self.scale  = scale
         self.known_cameras = known_cameras
         self.arrsize  = [0,0,0]
-        self.imbuff = None
+        self.renderer = FrameRenderer()
+        self.governor = FrameGovernor()
+        self.auto_decimate = True
         self.d_size = None
+        self.data = None
         self.im_size = None
         self.colormode = 0
-        self.last_update = 0.0
-        self.n_img   = 0
-        self.imgcount_start = 0
         self.n_drawn = 0
-        self.img_id = 0
+        self.render_time = 0.0
         self.starttime = time.time()
-        self.drawing = False
         self.lineplotter = None
+        self.prof_line = None
+        self.prof_width = 1
+        self.prof_mode = 'nearest'
+        self.prof_live = False
+        self.img_uid = 0
+        self.roistats = ROIStats()
+        self.processor = FrameProcessor()
+        self.raw_data = None
+        self.roiplotter = None
+        self.roiplot_time = 0.0
         self.zoom_lims = []
 
         wx.Frame.__init__(self, None, -1, "Epics Area Detector Display",
                           style=wx.DEFAULT_FRAME_STYLE)
 
-        if known_cameras is not None:
+        if simulate is not None:
+            wx.CallAfter(self.connect_simulator, **simulate)
+        elif known_cameras is not None:
             self.ConnectToCamera(name=self.prefix)
         else:
             self.ConnectToPV(name=self.prefix)
@@ -94,6 +178,7 @@ class AD_Display(wx.Frame):
         self.img_w = 0
         self.img_h = 0
         self.wximage = wx.EmptyImage(1024, 1360) # 1360, 1024) # approx_height, 1.5*approx_height)
+        self.wxbuffer = None
         self.buildMenus()
         self.buildFrame()
 
@@ -119,6 +204,23 @@ class AD_Display(wx.Frame):
             wx.CallAfter(self.connect_pvs)
         dlg.Destroy()
 
+    def ShowTiledCameras(self, event=None):
+        "select several pre-defined cameras and show them in tiles"
+        if self.known_cameras is None:
+            return
+        cam_names = self.known_cameras.keys()
+        cam_names.sort()
+        dlg = wx.MultiChoiceDialog(self, 'Select Cameras',
+                                   'Show Cameras in Tiles', cam_names)
+        selected = []
+        if dlg.ShowModal() == wx.ID_OK:
+            selected = [cam_names[i] for i in dlg.GetSelections()]
+        dlg.Destroy()
+        if len(selected) > 0:
+            cameras = [(name, self.known_cameras[name]) for name in selected]
+            tiles = TiledDisplay(cameras, app=self.app)
+            tiles.Show()
+
     def ConnectToPV(self, event=None, name=None):
         print 'Connect To PV ', name , event
         if name is None:
@@ -141,6 +243,49 @@ class AD_Display(wx.Frame):
         wx.TheClipboard.Close()
         wx.TheClipboard.Flush()
 
+    def onSimulate(self, event=None):
+        "prompt for options and show simulated images"
+        opts = {}
+        sim = getattr(self.fetcher, 'sim', None)
+        if sim is not None:
+            opts = dict(width=sim.width, height=sim.height, dtype=sim.dtype.name,
+                        colormode=sim.colormode, rate=self.fetcher.rate)
+        dlg = SimulatorDialog(self, **opts)
+        opts = None
+        if dlg.ShowModal() == wx.ID_OK:
+            opts = dlg.GetResponse()
+        dlg.Destroy()
+        if opts is not None:
+            self.connect_simulator(**opts)
+
+    @EpicsFunction
+    def connect_simulator(self, width=1024, height=1024, dtype='uint16',
+                          colormode=0, rate=10.0):
+        """disconnect from any camera, and show simulated images,
+        made at rate frames per second"""
+        if self.fetcher is not None:
+            self.fetcher.stop()
+            self.fetcher = None
+        if self.ad_img is not None:
+            self.CameraOff()
+            self.ad_img.remove_callbacks('ArrayCounter_RBV')
+        if self.ad_cimg is not None:
+            self.ad_cimg.remove_callbacks('ArrayCounter_RBV')
+        self.ad_img = self.ad_cam = self.ad_cimg = None
+        self.prefix = 'Simulated Camera'
+        self.SetTitle("Epics Image Display: %s" % self.prefix)
+        self.fetcher = SimulatedSource(self.onFrameReady, width=width,
+                                       height=height, dtype=dtype,
+                                       colormode=colormode, rate=rate,
+                                       onnew=self.onNewImage)
+        self.fetcher.governor = self.governor
+        self.governor.reset()
+        self.reset_counters()
+        self.fetcher.start()
+        self.messag('Simulated %s %s images, %i x %i' %
+                    (dtype, 'RGB' if colormode == 2 else 'mono',
+                     width, height))
+
     @EpicsFunction
     def CameraOff(self):
         try:
@@ -153,7 +298,10 @@ class AD_Display(wx.Frame):
     def onSaveImage(self, event=None):
         "prompts for and save image to file"
         defdir = os.getcwd()
-        self.fname = "Image_%i.tiff"  % self.ad_cam.ArrayCounter_RBV
+        counter = self.img_uid
+        if self.ad_cam is not None:
+            counter = self.ad_cam.ArrayCounter_RBV
+        self.fname = "Image_%i.tiff"  % counter
         dlg = wx.FileDialog(None, message='Save Image as',
                             defaultDir=os.getcwd(),
                             defaultFile=self.fname,
@@ -164,7 +312,14 @@ class AD_Display(wx.Frame):
 
         dlg.Destroy()
         if path is not None and self.data is not None:
-            Image.frombuffer(self.im_mode, self.im_size, self.data.flatten(),
+            data = self.data.flatten()
+            if self.im_mode == 'I':
+                data = data.astype(np.uint32)
+            elif self.im_mode == 'F':
+                data = data.astype(np.float32)
+            elif data.dtype != np.uint8:
+                data = np.clip(data, 0, 255).astype(np.uint8)
+            Image.frombuffer(self.im_mode, self.im_size, data,
                              'raw', self.im_mode, 0, 1).save(path)
 
     def onExit(self, event=None):
@@ -172,9 +327,105 @@ class AD_Display(wx.Frame):
             wx.Yield()
         except:
             pass
+        if self.fetcher is not None:
+            self.fetcher.stop()
+        self.onRecordStop()
+        self.onReplayStop()
         self.CameraOff()
         self.Destroy()
 
+    def onRecordStart(self, event=None):
+        "prompt for file and start recording every fetched image"
+        if self.fetcher is None:
+            self.messag('Cannot record: not connected to a camera')
+            return
+        dlg = wx.FileDialog(None, message='Record Images to',
+                            defaultDir=os.getcwd(),
+                            defaultFile='AD_Recording.adr',
+                            wildcard='AD Recordings (*.adr)|*.adr|All files (*.*)|*.*',
+                            style=wx.SAVE)
+        path = None
+        if dlg.ShowModal() == wx.ID_OK:
+            path = os.path.abspath(dlg.GetPath())
+        dlg.Destroy()
+        if path is None:
+            return
+        self.onRecordStop()
+        self.recorder = FrameRecorder(path)
+        self.recorder.start()
+        self.fetcher.recorder = self.recorder
+
+    def onRecordStop(self, event=None):
+        "stop recording, writing any queued images"
+        recorder = self.recorder
+        if recorder is None:
+            return
+        if self.fetcher is not None:
+            self.fetcher.recorder = None
+        self.recorder = None
+        recorder.stop()
+        recorder.join(5.0)
+        self.messag('Recorded %i images (%i dropped) to %s' %
+                    (recorder.n_written, recorder.n_dropped, recorder.fname))
+
+    def onReplay(self, event=None):
+        "prompt for recording and replay speed, and replay recording"
+        dlg = wx.FileDialog(None, message='Replay Recording',
+                            defaultDir=os.getcwd(),
+                            wildcard='AD Recordings (*.adr)|*.adr|All files (*.*)|*.*',
+                            style=wx.OPEN)
+        path = None
+        if dlg.ShowModal() == wx.ID_OK:
+            path = os.path.abspath(dlg.GetPath())
+        dlg.Destroy()
+        if path is None:
+            return
+        try:
+            reader = RecordingReader(path)
+        except (IOError, ValueError, KeyError):
+            self.messag('Could not read recording %s' % path)
+            return
+        speeds = ('0.25', '0.5', '1', '2', '4', 'as fast as possible')
+        dlg = wx.SingleChoiceDialog(self, 'Replay speed (relative to recorded rate)',
+                                    caption='Replay Speed', choices=speeds)
+        dlg.SetSelection(2)
+        speed = None
+        if dlg.ShowModal() == wx.ID_OK:
+            speed = dlg.GetStringSelection()
+        dlg.Destroy()
+        if speed is None:
+            return
+        try:
+            speed = float(speed)
+        except ValueError:
+            speed = 0
+        self.onReplayStop()
+        self.player = ReplayPlayer(reader, self.onReplayFrame,
+                                   ondone=self.onReplayDone, speed=speed)
+        self.reset_counters()
+        self.player.start()
+
+    def onReplayFrame(self):
+        "replay thread has a new frame: show the newest one"
+        if self.player is None:
+            return
+        frame = self.player.ring.take()
+        if frame is not None:
+            self.RefreshImage(frame=frame)
+
+    def onReplayStop(self, event=None):
+        if self.player is not None:
+            self.player.stop()
+
+    def onReplayDone(self, player=None):
+        "replay finished or stopped: return to live images"
+        if player is not self.player:
+            # an earlier replay, stopped for the current one
+            return
+        self.player = None
+        self.reset_counters()
+        self.messag('Replay finished')
+
     def onAbout(self, event=None):
         msg =  """Epics Image Display version 0.2
 
@@ -191,14 +442,23 @@ Matt Newville <newville@cars.uchicago.edu>"""
         fmenu = wx.Menu()
         add_menu(self, fmenu, "&Connect to Pre-defiend Camera", "Connect to PV", self.ConnectToCamera)
         add_menu(self, fmenu, "&Connect to AreaDetector PV\tCtrl+O", "Connect to PV", self.ConnectToPV)
+        if self.known_cameras is not None:
+            add_menu(self, fmenu, "Show Cameras in Tiles ...", "Show several cameras at once", self.ShowTiledCameras)
+        add_menu(self, fmenu, "Simulated Camera ...", "Show simulated images, without a camera", self.onSimulate)
         add_menu(self, fmenu, "&Save\tCtrl+S", "Save Image", self.onSaveImage)
         add_menu(self, fmenu, "&Copy\tCtrl+C", "Copy Image to Clipboard", self.onCopyImage)
         fmenu.AppendSeparator()
+        add_menu(self, fmenu, "Start Recording ...", "Record all fetched images to file", self.onRecordStart)
+        add_menu(self, fmenu, "Stop Recording", "Stop recording images", self.onRecordStop)
+        add_menu(self, fmenu, "Replay Recording ...", "Replay recorded images", self.onReplay)
+        add_menu(self, fmenu, "Stop Replay", "Stop replay, return to live images", self.onReplayStop)
+        fmenu.AppendSeparator()
         add_menu(self, fmenu, "E&xit\tCtrl+Q",  "Exit Program", self.onExit)
 
         omenu = wx.Menu()
         add_menu(self, omenu, "&Zoom out\tCtrl+Z", "Zoom Out", self.unZoom)
         add_menu(self, omenu, "Reset Image Counter", "Set Image Counter to 0", self.onResetImageCounter)
+        add_menu(self, omenu, "Show Render Timing", "Write render stage timing to stdout", self.onRenderTiming)
         omenu.AppendSeparator()
         add_menu(self, omenu,  "&Rotate Clockwise\tCtrl+R", "Rotate Clockwise", self.onRotCW)
         add_menu(self, omenu,  "Rotate CounterClockwise", "Rotate Counter Clockwise", self.onRotCCW)
@@ -209,15 +469,71 @@ Matt Newville <newville@cars.uchicago.edu>"""
         self.CM_ZOOM = wx.NewId()
         self.CM_SHOW = wx.NewId()
         self.CM_PROF = wx.NewId()
+        self.CM_ROI  = wx.NewId()
         omenu.Append(self.CM_ZOOM, "Cursor Mode: Zoom to Box\tCtrl+B" ,
                      "Zoom to box by clicking and dragging", wx.ITEM_RADIO)
         omenu.Append(self.CM_SHOW, "Cursor Mode: Show X,Y\tCtrl+X",
                      "Show X,Y, Intensity Values",  wx.ITEM_RADIO)
         omenu.Append(self.CM_PROF, "Cursor Mode: Line Profile\tCtrl+L",
                      "Show Line Profile",  wx.ITEM_RADIO)
+        omenu.Append(self.CM_ROI, "Cursor Mode: Define ROI\tCtrl+I",
+                     "Define ROI by clicking and dragging",  wx.ITEM_RADIO)
         self.Bind(wx.EVT_MENU, self.onCursorMode,  id=self.CM_ZOOM)
         self.Bind(wx.EVT_MENU, self.onCursorMode,  id=self.CM_PROF)
         self.Bind(wx.EVT_MENU, self.onCursorMode,  id=self.CM_SHOW)
+        self.Bind(wx.EVT_MENU, self.onCursorMode,  id=self.CM_ROI)
+        omenu.AppendSeparator()
+
+        self.MENU_PROF_INTERP = wx.NewId()
+        self.MENU_PROF_LIVE = wx.NewId()
+        add_menu(self, omenu, "Line Profile Width ...",
+                 "Set pixels averaged across profile line", self.onProfileWidth)
+        omenu.Append(self.MENU_PROF_INTERP, "Interpolate Line Profile",
+                     "Use bilinear interpolation along profile line", wx.ITEM_CHECK)
+        omenu.Append(self.MENU_PROF_LIVE, "Update Line Profile with each Image",
+                     "Redraw line profile for each new image", wx.ITEM_CHECK)
+        self.Bind(wx.EVT_MENU, self.onProfileOptions, id=self.MENU_PROF_INTERP)
+        self.Bind(wx.EVT_MENU, self.onProfileOptions, id=self.MENU_PROF_LIVE)
+        self.profile_menu = omenu
+        omenu.AppendSeparator()
+
+        self.MENU_CODEC = wx.NewId()
+        omenu.Append(self.MENU_CODEC, "Use Compressed Arrays (%s)" % self.codec_plugins[0],
+                     "Fetch compressed arrays from codec plugin, if available", wx.ITEM_CHECK)
+        self.Bind(wx.EVT_MENU, self.onUseCodec, id=self.MENU_CODEC)
+
+        rmenu = wx.Menu()
+        add_menu(self, rmenu, "Plot ROI Statistics", "Plot ROI sums with time",
+                 self.onROIPlot)
+        add_menu(self, rmenu, "Save ROI Statistics ...",
+                 "Save ROI statistics to text file", self.onROISave)
+        add_menu(self, rmenu, "Clear ROIs", "Remove all ROIs", self.onROIClear)
+
+        pmenu = wx.Menu()
+        self.proc_modes = {}
+        for mode, label in (('none',    "No Averaging"),
+                            ('mean',    "Running Mean of Frames"),
+                            ('ema',     "Exponential Average of Frames"),
+                            ('maxhold', "Maximum of Frames (Max Hold)")):
+            wid = wx.NewId()
+            self.proc_modes[wid] = mode
+            pmenu.Append(wid, label, "Frame averaging: %s" % label, wx.ITEM_RADIO)
+            self.Bind(wx.EVT_MENU, self.onProcessMode, id=wid)
+        add_menu(self, pmenu, "Frames to Average ...",
+                 "Set number of frames averaged", self.onProcessFrames)
+        add_menu(self, pmenu, "Restart Average", "Restart frame average",
+                 self.onProcessReset)
+        pmenu.AppendSeparator()
+        add_menu(self, pmenu, "Capture Dark Frame",
+                 "Use current (averaged) image as dark frame", self.onCaptureDark)
+        add_menu(self, pmenu, "Clear Dark Frame", "Remove dark frame",
+                 self.onClearDark)
+        self.MENU_DARK = wx.NewId()
+        pmenu.Append(self.MENU_DARK, "Subtract Dark Frame",
+                     "Subtract dark frame from each image", wx.ITEM_CHECK)
+        pmenu.Check(self.MENU_DARK, self.processor.subtract_dark)
+        self.Bind(wx.EVT_MENU, self.onSubtractDark, id=self.MENU_DARK)
+        self.process_menu = pmenu
 
         hmenu = wx.Menu()
         add_menu(self, hmenu, "About", "About Epics AreadDetector Display", self.onAbout)
@@ -225,6 +541,8 @@ Matt Newville <newville@cars.uchicago.edu>"""
         mbar = wx.MenuBar()
         mbar.Append(fmenu, "File")
         mbar.Append(omenu, "Options")
+        mbar.Append(rmenu, "ROIs")
+        mbar.Append(pmenu, "Processing")
         mbar.Append(hmenu, "&Help")
         self.SetMenuBar(mbar)
 
@@ -235,26 +553,29 @@ Matt Newville <newville@cars.uchicago.edu>"""
             self.image.cursor_mode = 'profile'
         elif event.Id == self.CM_SHOW:
             self.image.cursor_mode = 'show'
+        elif event.Id == self.CM_ROI:
+            self.image.cursor_mode = 'roi'
 
     @DelayedEpicsCallback
     def onResetImageCounter(self, event=None):
-        self.ad_cam.ArrayCounter = 0
+        if self.ad_cam is not None:
+            self.ad_cam.ArrayCounter = 0
 
     def onRotCW(self, event):
         self.image.rot90 = (self.image.rot90 + 1) % 4
-        self.image.Refresh()
+        self.RedrawImage()
 
     def onRotCCW(self, event):
         self.image.rot90 = (self.image.rot90 - 1) % 4
-        self.image.Refresh()
+        self.RedrawImage()
 
     def onFlipV(self, event):
         self.image.flipv= not self.image.flipv
-        self.image.Refresh()
+        self.RedrawImage()
 
     def onFlipH(self, event):
         self.image.fliph = not self.image.fliph
-        self.image.Refresh()
+        self.RedrawImage()
 
     def buildFrame(self):
         sbar = self.CreateStatusBar(3, wx.CAPTION|wx.THICK_FRAME)
@@ -312,6 +633,39 @@ Matt Newville <newville@cars.uchicago.edu>"""
         for key in ('start', 'stop'):
             self.wids[key].Bind(wx.EVT_BUTTON, Closure(self.onEntry, key=key))
 
+        dmap = self.renderer.dmap
+        self.wids['colortable'] = wx.Choice(panel, -1, choices=COLORTABLE_NAMES,
+                                            size=(100, -1))
+        self.wids['transfer']   = wx.Choice(panel, -1, choices=TRANSFERS,
+                                            size=(100, -1))
+        self.wids['autoscale']  = wx.Choice(panel, -1, choices=AUTOSCALES,
+                                            size=(100, -1))
+        self.wids['colortable'].SetStringSelection(dmap.colortable)
+        self.wids['transfer'].SetStringSelection(dmap.transfer)
+        self.wids['autoscale'].SetStringSelection(dmap.autoscale)
+        self.wids['decimate']   = wx.Choice(panel, -1, choices=('auto',)+DECIMATIONS,
+                                            size=(100, -1))
+        self.wids['decimate'].SetStringSelection('auto')
+        for key in ('colortable', 'transfer', 'autoscale', 'decimate'):
+            self.wids[key].Bind(wx.EVT_CHOICE, self.onDisplayMap)
+
+        self.wids['gamma']  = FloatCtrl(panel, value=dmap.gamma, precision=2,
+                                        minval=0.05, maxval=20, size=(50, -1),
+                                        action=self.onDisplayMap)
+        self.wids['minval'] = FloatCtrl(panel, value=dmap.limits[0], precision=1,
+                                        size=(50, -1), action=self.onDisplayLimits)
+        self.wids['maxval'] = FloatCtrl(panel, value=dmap.limits[1], precision=1,
+                                        size=(50, -1), action=self.onDisplayLimits)
+        self.wids['maxfps'] = FloatCtrl(panel, value=self.governor.target_fps,
+                                        precision=1, minval=0.1, maxval=500,
+                                        size=(50, -1), action=self.onDisplayRate)
+        self.wids['maxload'] = FloatCtrl(panel, value=100*self.governor.max_load,
+                                         precision=0, minval=1, maxval=100,
+                                         size=(50, -1), action=self.onDisplayRate)
+
+        self.histogram = HistogramPanel(panel, size=(250, 80),
+                                        onlimits=self.onHistogramLimits)
+
         self.wids['zoomsize']= wx.StaticText(panel, -1,  size=(250,-1), style=txtstyle)
         self.wids['fullsize']= wx.StaticText(panel, -1,  size=(250,-1), style=txtstyle)
 
@@ -353,8 +707,28 @@ Matt Newville <newville@cars.uchicago.edu>"""
 
         sizer.Add(lin(75),                 (15, 0), (1, 3), labstyle)
 
+        sizer.Add(txt('Color Table '),      (16, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['colortable'],  (16, 1), (1, 2), ctrlstyle)
+        sizer.Add(txt('Intensity Scale '),  (17, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['transfer'],    (17, 1), (1, 2), ctrlstyle)
+        sizer.Add(txt('Gamma '),            (18, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['gamma'],       (18, 1), (1, 1), ctrlstyle)
+        sizer.Add(txt('Contrast '),         (19, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['autoscale'],   (19, 1), (1, 2), ctrlstyle)
+        sizer.Add(txt('Limits '),           (20, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['minval'],      (20, 1), (1, 1), ctrlstyle)
+        sizer.Add(self.wids['maxval'],      (20, 2), (1, 1), ctrlstyle)
+        sizer.Add(txt('Decimation '),       (21, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['decimate'],    (21, 1), (1, 2), ctrlstyle)
+        sizer.Add(txt('Max Rate (fps) '),   (22, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['maxfps'],      (22, 1), (1, 1), ctrlstyle)
+        sizer.Add(txt('Max CPU Load (%) '), (23, 0), (1, 1), labstyle)
+        sizer.Add(self.wids['maxload'],     (23, 1), (1, 1), ctrlstyle)
+        sizer.Add(self.histogram,           (24, 0), (1, 3), labstyle)
+        sizer.Add(lin(75),                  (25, 0), (1, 3), labstyle)
+
         if HAS_OVERLAY_DEVICE:
-            ir = 16
+            ir = 26
             sizer.Add(txt('Overlay 1:'),        (ir+0, 0), (1, 1), labstyle)
             sizer.Add(self.wids['o1use'],       (ir+0, 1), (1, 2), ctrlstyle)
             sizer.Add(txt('Shape:'),            (ir+1, 0), (1, 1), labstyle)
@@ -391,7 +765,8 @@ Matt Newville <newville@cars.uchicago.edu>"""
             sizer.Add(lin(75),                  (ir+6, 0), (1, 3), labstyle)
 
         self.image = ImageView(self, size=(1360, 1024), onzoom=self.onZoom,
-                               onprofile=self.onProfile, onshow=self.onShowXY)
+                               onprofile=self.onProfile, onshow=self.onShowXY,
+                               onresize=self.onImageResize, onroi=self.onROI)
 
         panel.SetSizer(sizer)
         sizer.Fit(panel)
@@ -417,8 +792,14 @@ Matt Newville <newville@cars.uchicago.edu>"""
         wx.CallAfter(Closure(self.SetStatusText, text=s, number=panel))
         # self.SetStatusText(s, panel)
 
+    def onFetchError(self, msg):
+        "report error fetching a frame (called from the fetch thread)"
+        self.messag('Could not fetch frame: %s' % msg)
+
     @EpicsFunction
     def unZoom(self, event=None, full=False):
+        if self.ad_cam is None:
+            return
         if self.zoom_lims is None or full:
             self.zoom_lims = []
 
@@ -451,14 +832,10 @@ Matt Newville <newville@cars.uchicago.edu>"""
             self.img_w = width
             self.img_h = height
             try:
-                if self.colormode == 2:
-                    self.data.shape = [self.im_size[1], self.im_size[0], 3]
-                    zdata = self.data[ymin:ymin+height, xmin:xmin+width,:]
-                else:
-                    self.data.shape = self.im_size[1], self.im_size[0]
-                    zdata = self.data[ymin:ymin+height,xmin:xmin+width]
+                # a reshaped view: self.data may be a shared frame buffer
+                zdata = self.get_frame()[ymin:ymin+height, xmin:xmin+width]
             except ValueError:
-                pass
+                zdata = self.data
             self.data = zdata #self.data.flatten()
             self.im_size = (width, height)
             # print zdata.shape, width, height, self.im_mode
@@ -486,6 +863,8 @@ Matt Newville <newville@cars.uchicago.edu>"""
 
     @EpicsFunction
     def onZoom(self, x0, y0, x1, y1):
+        if self.ad_cam is None:
+            return
         width  = self.ad_cam.SizeX
         height = self.ad_cam.SizeY
         xmin   = max(0, int(self.ad_cam.MinX  + x0 * width))
@@ -509,80 +888,163 @@ Matt Newville <newville@cars.uchicago.edu>"""
         if self.ad_cam.Acquire == 0:
             self.img_w = width
             self.img_h = height
-            if self.colormode == 2:
-                self.data.shape = [self.im_size[1], self.im_size[0], 3]
-                zdata = self.data[ymin:ymin+height, xmin:xmin+width,:]
-            else:
-                self.data.shape = self.im_size[1], self.im_size[0]
-                zdata = self.data[ymin:ymin+height,xmin:xmin+width]
+            zdata = self.get_frame()[ymin:ymin+height, xmin:xmin+width]
             self.data = zdata #. flatten()
             self.im_size = (width, height)
             self.DatatoImage()
         self.image.Refresh()
 
-    def DatatoImage(self):  #,  data, size, mode):
-        """convert raw data to image"""
-        #x = debugtime()
-
-        width, height = self.im_size
-        d_size = (int(width*self.scale), int(height*self.scale))
-        data = self.data.flatten()
-        #x.add('flatten')
-        if self.imbuff is None or d_size != self.d_size or self.im_mode == 'L':
-            try:
-                self.imbuff =  Image.frombuffer(self.im_mode, self.im_size, data,
-                                                'raw',  self.im_mode, 0, 1)
-                #x.add('made image')
-            except:
-                return
-        self.d_size = d_size = (int(width*self.scale), int(height*self.scale))
-        if self.imbuff.size != d_size:
-            self.imbuff = self.imbuff.resize(d_size)
-            #x.add('resized imbuff')
-
-        if self.wximage.GetSize() != self.imbuff.size:
-            self.wximage = wx.EmptyImage(d_size[0], d_size[1])
-        #x.add('created wximage %s  ' % (repr(self.wximage.GetSize())))
-        if self.im_mode == 'L':
-            self.wximage.SetData(self.imbuff.convert('RGB').tostring())
-        elif self.im_mode == 'RGB':
-            data.shape = (3, width, height)
-            self.wximage = wx.ImageFromData(width, height, data)
-        #x.add('set wx image wximage : %i, %i ' % d_size)
+    def DatatoImage(self):
+        """convert raw data to image, writing into the shared RGB buffer"""
+        timer = self.renderer.timer
+        timer.start('data to image')
+        img = self.image
+        orientation = get_orientation(img.flipv, img.fliph, img.rot90)
+        self.renderer.orientation = orientation
+        self.d_size = d_size = fit_size(oriented_size(self.im_size, orientation),
+                                        img.GetClientSize(), scale=self.scale)
+        try:
+            rgb = self.renderer.render(self.data, self.im_size,
+                                       self.colormode, d_size)
+        except ValueError:
+            return
+        if self.wximage.GetSize() != d_size or self.wxbuffer is not rgb:
+            self.wximage = wx.ImageFromBuffer(d_size[0], d_size[1], rgb)
+            self.wxbuffer = rgb
+        timer.add('set wx image')
         self.image.SetValue(self.wximage)
-        #x.add('set image value')
-        #x.show()
+        timer.add('set image value')
+        timer.finish()
 
+    def RedrawImage(self):
+        "re-render the current frame, as for new display settings"
+        if self.data is not None and self.im_size is not None:
+            self.DatatoImage()
 
-    def onProfile(self, x0, y0, x1, y1):
-        width  = self.ad_cam.SizeX
-        height = self.ad_cam.SizeY
+    def ReprocessImage(self):
+        "re-process and re-render the current frame, for new processing"
+        if self.raw_data is None or self.im_size is None:
+            return
+        self.data = self.processor.refresh(self.raw_data)
+        self.set_im_mode()
+        self.DatatoImage()
+        self.histogram.update(self.get_frame(), limits=self.renderer.dmap.current)
 
-        x0, y0 = int(x0 * width), int(y0 * height)
-        x1, y1 = int(x1 * width), int(y1 * height)
-        dx, dy = abs(x1 - x0), abs(y1 - y0)
+    def set_im_mode(self):
+        "set image mode from color mode and (processed) data type"
+        im_mode = 'L'
+        if self.colormode == 2:
+            im_mode = 'RGB'
+        elif self.data is not self.raw_data:
+            im_mode = 'F'
+        elif self.raw_data.dtype != np.uint8:
+            im_mode = 'I'
+        self.im_mode = im_mode
 
-        if dx < 2 and dy < 2:
-            return
-        outdat = []
+    def onImageResize(self, size=None):
+        "render current frame at the new window size"
+        self.RedrawImage()
+
+    def onDisplayRate(self, event=None, **kws):
+        "set maximum display rate and CPU load"
+        self.governor.set(target_fps=self.wids['maxfps'].GetValue(),
+                          max_load=self.wids['maxload'].GetValue()/100.0)
+
+    def onDisplayMap(self, event=None, **kws):
+        "set color table, intensity scale and contrast mode, and redraw"
+        wids = self.wids
+        decimation = wids['decimate'].GetStringSelection()
+        self.auto_decimate = (decimation == 'auto')
+        if not self.auto_decimate:
+            self.renderer.decimation = decimation
+        dmap = self.renderer.dmap
+        autoscale = wids['autoscale'].GetStringSelection()
+        # current autoscale limits, which dmap.set() clears
+        current = None
+        if autoscale == 'fixed' and dmap.autoscale != 'fixed':
+            current = dmap.current
+        dmap.set(colortable=wids['colortable'].GetStringSelection(),
+                 transfer=wids['transfer'].GetStringSelection(),
+                 gamma=wids['gamma'].GetValue(),
+                 autoscale=autoscale)
+        if current is not None:
+            # start fixed limits from the last autoscale limits
+            lo, hi = dmap.limits = current
+            wids['minval'].SetValue(lo)
+            wids['maxval'].SetValue(hi)
+        self.RedrawImage()
+
+    def onDisplayLimits(self, event=None, **kws):
+        "set fixed intensity limits, and redraw"
+        dmap = self.renderer.dmap
+        dmap.set(limits=(self.wids['minval'].GetValue(),
+                         self.wids['maxval'].GetValue()))
+        if dmap.autoscale == 'fixed':
+            self.histogram.set_limits(dmap.limits)
+            self.RedrawImage()
+
+    def onHistogramLimits(self, lo, hi):
+        "set fixed intensity limits from a click on the histogram"
+        self.wids['autoscale'].SetStringSelection('fixed')
+        self.wids['minval'].SetValue(lo)
+        self.wids['maxval'].SetValue(hi)
+        self.renderer.dmap.set(autoscale='fixed', limits=(lo, hi))
+        self.RedrawImage()
+
+    def onRenderTiming(self, event=None):
+        "write per-stage timing of the render path to stdout, and reset"
+        timer = self.renderer.timer
+        sys.stdout.write('%s\n' % timer.get_stage_report())
+        timer.reset()
+
+    def get_frame(self):
+        "return current frame data as 2d (mono) or 3d (RGB) array"
+        width, height = self.im_size
         if self.colormode == 2:
-            self.data.shape = (self.im_size[1], self.im_size[0], 3)
-        else:
-            self.data.shape = self.im_size[1], self.im_size[0]
+            return self.data.reshape((height, width, 3))
+        return self.data.reshape((height, width))
 
-        if dy  > dx:
-            _y0 = min(int(y0), int(y1+0.5))
-            _y1 = max(int(y0), int(y1+0.5))
+    def onProfile(self, x0, y0, x1, y1):
+        "new profile line, in fractional coordinates of the frame"
+        if self.data is None or self.im_size is None:
+            return
+        width, height = self.im_size
+        if abs(x1 - x0)*width < 2 and abs(y1 - y0)*height < 2:
+            return
+        self.prof_line = (x0, y0, x1, y1)
+        self.ShowProfile(new=True)
 
-            for iy in range(_y0, _y1):
-                ix = int(x0 + (iy-int(y0))*(x1-x0)/(y1-y0))
-                outdat.append((ix, iy))
-        else:
-            _x0 = min(int(x0), int(x1+0.5))
-            _x1 = max(int(x0), int(x1+0.5))
-            for ix in range(_x0, _x1):
-                iy = int(y0 + (ix-int(x0))*(y1-y0)/(x1-x0))
-                outdat.append((ix, iy))
+    def ShowProfile(self, new=False):
+        """plot line profile of current frame for self.prof_line, with a
+        new plot or (for live updates) by updating the plotted traces"""
+        if self.prof_line is None or self.data is None:
+            return
+        width, height = self.im_size
+        x0, y0, x1, y1 = self.prof_line
+        x0, x1 = x0*(width-1), x1*(width-1)
+        y0, y1 = y0*(height-1), y1*(height-1)
+        xpix, ypix, vals = line_profile(self.get_frame(), x0, y0, x1, y1,
+                                        width=self.prof_width,
+                                        mode=self.prof_mode)
+        x, xlabel = xpix, 'Pixel (x)'
+        if abs(y1-y0) > abs(x1-x0):
+            x, xlabel = ypix, 'Pixel (y)'
+
+        if not new:
+            try:
+                if self.colormode == 2:
+                    for i in range(3):
+                        self.lineplotter.update_line(i, x, vals[:, i],
+                                                     draw=(i==2))
+                else:
+                    self.lineplotter.update_line(0, x, vals, draw=True)
+                return
+            except PyDeadObjectError:
+                # profile window was closed: stop live updates
+                self.lineplotter = None
+                return
+            except (AttributeError, IndexError):
+                pass
 
         if self.lineplotter is None:
             self.lineplotter = PlotFrame(self, title='Image Profile')
@@ -592,51 +1054,170 @@ Matt Newville <newville@cars.uchicago.edu>"""
             except PyDeadObjectError:
                 self.lineplotter = PlotFrame(self, title='Image Profile')
 
+        title = 'Image %i' % self.img_uid
         if self.colormode == 2:
-            x, y, r, g, b = [], [], [], [], []
-            for ix, iy in outdat:
-                x.append(ix)
-                y.append(iy)
-                r.append(self.data[iy,ix,0])
-                g.append(self.data[iy,ix,1])
-                b.append(self.data[iy,ix,2])
-            xlabel = 'Pixel (x)'
-            if dy > dx:
-                x = y
-                xlabel = 'Pixel (y)'
-            self.lineplotter.plot(x,  r, color='red', label='red',
+            self.lineplotter.plot(x, vals[:, 0], color='red', label='red',
                                   xlabel=xlabel, ylabel='Intensity',
-                                  title='Image %i' % self.ad_cam.ArrayCounter_RBV)
-            self.lineplotter.oplot(x, g, color='green', label='green')
-            self.lineplotter.oplot(x, b, color='blue', label='blue')
-
+                                  title=title)
+            self.lineplotter.oplot(x, vals[:, 1], color='green', label='green')
+            self.lineplotter.oplot(x, vals[:, 2], color='blue', label='blue')
         else:
-            x, y, z = [], [], []
-            for ix, iy in outdat:
-                x.append(ix)
-                y.append(iy)
-                z.append(self.data[iy,ix])
-            xlabel = 'Pixel (x)'
-            if dy > dx:
-                x = y
-            xlabel = 'Pixel (y)'
-            self.lineplotter.plot(x, z, color='k',
+            self.lineplotter.plot(x, vals, color='k',
                                   xlabel=xlabel, ylabel='Intensity',
-                                  title='Image %i' % self.ad_cam.ArrayCounter_RBV)
+                                  title=title)
         self.lineplotter.Show()
         self.lineplotter.Raise()
 
+    def onProfileWidth(self, event=None):
+        "set number of pixels averaged perpendicular to the profile line"
+        val = wx.GetNumberFromUser('Pixels averaged across profile line',
+                                   'Width:', 'Line Profile Width',
+                                   self.prof_width, 1, 501, self)
+        if val > 0:
+            self.prof_width = val
+            self.ShowProfile(new=True)
+
+    def onProcessMode(self, event=None):
+        "set frame averaging mode"
+        self.processor.set(mode=self.proc_modes[event.GetId()])
+        self.ReprocessImage()
+
+    def onProcessFrames(self, event=None):
+        "set number of frames averaged"
+        val = wx.GetNumberFromUser('Number of frames to average',
+                                   'Frames:', 'Frames to Average',
+                                   self.processor.navg, 1, 1000, self)
+        if val > 0:
+            self.processor.set(navg=val)
+            self.ReprocessImage()
+
+    def onProcessReset(self, event=None):
+        self.processor.reset()
+        self.ReprocessImage()
+
+    def onCaptureDark(self, event=None):
+        "capture dark frame from current average or image"
+        if self.processor.capture_dark(self.raw_data):
+            self.messag('Captured dark frame')
+        self.ReprocessImage()
+
+    def onClearDark(self, event=None):
+        self.processor.clear_dark()
+        self.ReprocessImage()
+
+    def onSubtractDark(self, event=None):
+        self.processor.subtract_dark = self.process_menu.IsChecked(self.MENU_DARK)
+        self.ReprocessImage()
+
+    def onUseCodec(self, event=None):
+        "switch between compressed and uncompressed arrays, and reconnect"
+        self.use_codec = self.profile_menu.IsChecked(self.MENU_CODEC)
+        if self.ad_img is not None:
+            self.connect_pvs()
+
+    def onProfileOptions(self, event=None):
+        "set profile interpolation and live update from menu"
+        self.prof_mode = 'nearest'
+        if self.profile_menu.IsChecked(self.MENU_PROF_INTERP):
+            self.prof_mode = 'bilinear'
+        self.prof_live = self.profile_menu.IsChecked(self.MENU_PROF_LIVE)
+        self.ShowProfile(new=True)
+
+    def onROI(self, x0, y0, xw, yw):
+        "new ROI, in fractional coordinates of the frame"
+        if self.im_size is None:
+            return
+        width, height = self.im_size
+        x0, xw = int(x0*width), int(xw*width)
+        y0, yw = int(y0*height), int(yw*height)
+        if xw < 1 or yw < 1:
+            return
+        name = self.roistats.add_roi(x0, y0, x0+xw, y0+yw)
+        self.messag('%s: %i x %i pixels at (%i, %i)' % (name, xw, yw, x0, y0))
+        if self.data is not None:
+            self.roistats.update(self.get_frame())
+
+    def ShowROIStats(self):
+        "show statistics of first ROI in status bar, and update ROI plot"
+        stats = self.roistats.get_latest(0)
+        if stats is None:
+            return
+        self.messag('%s: mean=%.4g max=%.4g cen=(%.1f, %.1f)' %
+                    (self.roistats.rois[0][0], stats['mean'], stats['max'],
+                     stats['cen_x'], stats['cen_y']), panel=1)
+        if self.roiplotter is not None and time.time() > self.roiplot_time + 1.0:
+            self.onROIPlot(new=False)
+
+    def onROIPlot(self, event=None, new=True):
+        "plot ROI sums as a function of time"
+        rois = self.roistats
+        if len(rois.rois) < 1 or rois.count < 1:
+            return
+        self.roiplot_time = time.time()
+        tnow = time.time()
+        if not new:
+            try:
+                for i in range(len(rois.rois)):
+                    t, y = rois.get_series(i, 'sum')
+                    self.roiplotter.update_line(i, t-tnow, y,
+                                                draw=(i==len(rois.rois)-1))
+                return
+            except PyDeadObjectError:
+                self.roiplotter = None
+                return
+            except (AttributeError, IndexError):
+                pass
+        if self.roiplotter is None:
+            self.roiplotter = PlotFrame(self, title='ROI Statistics')
+        else:
+            try:
+                self.roiplotter.Raise()
+            except PyDeadObjectError:
+                self.roiplotter = PlotFrame(self, title='ROI Statistics')
+        for i, roi in enumerate(rois.rois):
+            t, y = rois.get_series(i, 'sum')
+            plot = self.roiplotter.oplot
+            if i == 0:
+                plot = self.roiplotter.plot
+            plot(t-tnow, y, label=roi[0], xlabel='Time (s)',
+                 ylabel='ROI Sum', show_legend=True)
+        self.roiplotter.Show()
+        self.roiplotter.Raise()
+
+    def onROISave(self, event=None):
+        "save ROI statistics to file"
+        dlg = wx.FileDialog(None, message='Save ROI Statistics as',
+                            defaultDir=os.getcwd(),
+                            defaultFile='AD_ROIStats.dat',
+                            style=wx.SAVE)
+        path = None
+        if dlg.ShowModal() == wx.ID_OK:
+            path = os.path.abspath(dlg.GetPath())
+        dlg.Destroy()
+        if path is not None:
+            self.roistats.save(path)
+            self.messag('Saved ROI statistics to %s' % path)
+
+    def onROIClear(self, event=None):
+        self.roistats.clear()
+        self.messag('', panel=1)
+
     def onShowXY(self, xval, yval):
-        ix  = max(0, int( xval * self.ad_cam.SizeX))
-        iy  = max(0, int( yval * self.ad_cam.SizeY))
+        if self.im_size is None:
+            return
+        if self.ad_cam is None:
+            sizex, sizey = self.im_size
+        else:
+            sizex, sizey = self.ad_cam.SizeX, self.ad_cam.SizeY
+        ix  = max(0, int( xval * sizex))
+        iy  = max(0, int( yval * sizey))
 
+        frame = self.get_frame()
         if self.colormode == 2:
-            self.data.shape = (self.im_size[1], self.im_size[0], 3)
-            ival = tuple(self.data[iy, ix, :])
+            ival = tuple(frame[iy, ix, :])
             smsg  = 'Pixel %i, %i, (R, G, B) = %s' % (ix, iy, repr(ival))
         else:
-            self.data.shape = self.im_size[1], self.im_size[0]
-            ival = self.data[iy, ix]
+            ival = frame[iy, ix]
             smsg  = 'Pixel %i, %i, Intensity = %i' % (ix, iy, ival)
 
         self.messag(smsg, panel=1)
@@ -657,11 +1238,12 @@ Matt Newville <newville@cars.uchicago.edu>"""
     def onEntry(self, evt=None, key='name', **kw):
         if evt is None:
             return
-        if key == 'start':
-            self.n_img   = 0
-            self.n_drawn = 0
-            self.starttime = time.time()
-            self.imgcount_start = self.ad_cam.ArrayCounter_RBV
+        if key in ('start', 'stop') and self.ad_cam is None:
+            if self.fetcher is not None and hasattr(self.fetcher, 'acquiring'):
+                self.reset_counters()
+                self.fetcher.acquiring = (key == 'start')
+        elif key == 'start':
+            self.reset_counters()
             self.ad_cam.Acquire = 1
         elif key == 'stop':
             self.ad_cam.Acquire = 0
@@ -689,6 +1271,9 @@ Matt Newville <newville@cars.uchicago.edu>"""
 
         if verbose:
             self.messag('Connecting to AD %s' % self.prefix)
+        if self.fetcher is not None:
+            self.fetcher.stop()
+            self.fetcher = None
         self.ad_img = epics.Device(self.prefix + ':image1:', delim='',
                                    attrs=self.img_attrs)
         self.ad_cam = epics.Device(self.prefix + ':cam1:', delim='',
@@ -761,6 +1346,27 @@ Matt Newville <newville@cars.uchicago.edu>"""
         self.wids['fullsize'].SetLabel(sizelabel)
         self.showZoomsize()
 
+        if self.ad_cimg is not None:
+            self.ad_cimg.remove_callbacks('ArrayCounter_RBV')
+            self.ad_cimg = None
+        if self.use_codec:
+            codec, cimage = self.codec_plugins
+            for p in self.codec_plugins:
+                epics.caput("%s:%s:EnableCallbacks" % (self.prefix, p), 1)
+            epics.caput("%s:%s:NDArrayPort" % (self.prefix, codec), "OVER1")
+            epics.caput("%s:%s:NDArrayPort" % (self.prefix, cimage), codec.upper())
+            self.ad_cimg = epics.Device('%s:%s:' % (self.prefix, cimage),
+                                        delim='', attrs=CODEC_IMG_ATTRS)
+            self.fetcher = CodecFetcher(self.ad_img, self.ad_cimg,
+                                        self.onFrameReady)
+            self.ad_cimg.add_callback('ArrayCounter_RBV', self.onNewImage)
+        else:
+            self.fetcher = FrameFetcher(self.ad_img, self.onFrameReady)
+        self.fetcher.governor = self.governor
+        self.fetcher.onerror = self.onFetchError
+        self.governor.reset()
+        self.fetcher.start()
+        self.reset_counters()
         self.ad_img.add_callback('ArrayCounter_RBV',   self.onNewImage)
         self.ad_img.add_callback('ArraySize0_RBV', self.onProperty, dim=0)
         self.ad_img.add_callback('ArraySize1_RBV', self.onProperty, dim=1)
@@ -808,109 +1414,90 @@ Matt Newville <newville@cars.uchicago.edu>"""
         else:
             self.arrsize[dim] = value
 
-    @DelayedEpicsCallback
     def onNewImage(self, pvname=None, value=None, **kw):
-        if value != self.img_id:
-            self.img_id = value
-            if not self.drawing:
-                self.drawing = True
-                self.RefreshImage()
+        "new image callback: wake the fetch thread (runs in CA thread)"
+        if self.fetcher is not None:
+            self.fetcher.trigger()
 
-    @EpicsFunction
-    def RefreshImage(self, pvname=None, **kws):
-        try:
-            wx.Yield()
-        except:
-            pass
-        d = debugtime()
-
-        if self.ad_img is None or self.ad_cam is None:
+    def onFrameReady(self):
+        "fetch thread has a new frame: show the newest one"
+        if self.fetcher is None:
             return
-        imgdim = self.ad_img.NDimensions_RBV
-        imgcount = self.ad_cam.ArrayCounter_RBV
-        now = time.time()
-        if (imgcount == self.imgcount or abs(now - self.last_update) < 0.025):
-            self.drawing = False
+        frame = self.fetcher.ring.take()
+        if self.player is not None:
+            # live frames are not shown during a replay
             return
-        d.add('refresh img start')
-        self.imgcount = imgcount
-        self.drawing = True
-        self.n_drawn += 1
-        self.n_img = imgcount - self.imgcount_start
-        #print 'ImgCount, n_drawn: ', imgcount, self.n_img, self.n_drawn
+        if frame is not None:
+            self.RefreshImage(frame=frame)
 
-        self.last_update = time.time()
-        self.image.can_resize = False
-
-        xmin = self.ad_cam.MinX
-        ymin = self.ad_cam.MinY
-        width = self.ad_cam.SizeX
-        height = self.ad_cam.SizeY
-
-        arraysize = self.arrsize[0] * self.arrsize[1]
-        if imgdim == 3:
-            arraysize = arraysize * self.arrsize[2]
-        if not self.ad_img.PV('ArrayData').connected:
-            self.drawing = False
+    def reset_counters(self):
+        self.n_drawn = 0
+        self.render_time = 0.0
+        self.starttime = time.time()
+        if self.fetcher is not None:
+            self.fetcher.reset_counters()
+
+    def RefreshImage(self, frame=None, **kws):
+        """show a fetched frame, or with no frame, request a new one
+        from the fetch thread"""
+        if frame is None:
+            if self.fetcher is not None:
+                self.fetcher.trigger()
             return
+        t0 = time.time()
+        self.image.can_resize = False
 
-        d.add('refresh img before raw get %i' % arraysize)
-        rawdata = self.ad_img.PV('ArrayData').get(count=arraysize)
-        d.add('refresh img after raw get')
-        im_mode = 'L'
-        im_size = (self.arrsize[0], self.arrsize[1])
-
-        if self.colormode == 2:
-            im_mode = 'RGB'
-            im_size = [self.arrsize[1], self.arrsize[2]]
-        if (self.colormode == 0 and isinstance(rawdata, np.ndarray) and
-            rawdata.dtype != np.uint8):
-            im_mode = 'I'
-            rawdata = rawdata.astype(np.uint32)
-
-        d.add('refresh img before msg')
-        self.messag(' Image # %i ' % self.ad_cam.ArrayCounter_RBV, panel=2)
-        d.add('refresh img before get image size')
-        self.GetImageSize()
-
-        self.im_size = im_size
-        self.im_mode = im_mode
-        self.data = rawdata
-        d.add('refresh img before data to image')
+        self.arrsize = frame.arrsize
+        self.colormode = frame.colormode
+        self.im_size = frame.im_size
+        self.img_w, self.img_h = frame.im_size[1], frame.im_size[0]
+        self.raw_data = frame.data
+        self.data = self.processor.process(frame.data)
+        self.set_im_mode()
+        self.img_uid = frame.uid
+        if self.auto_decimate:
+            self.renderer.decimation = self.governor.choose_decimation()
         self.DatatoImage()
-        d.add('refresh img after data to image')
         self.image.can_resize = True
-        nmissed = max(0, self.n_img-self.n_drawn)
-
-        delt = time.time()-self.starttime
-        percent_drawn = self.n_drawn * 100 / (self.n_drawn+nmissed)
-        smsg = self.stat_msg % (percent_drawn, self.n_drawn/delt)
-        self.messag(smsg, panel=0)
-
-        self.drawing = False
-        d.add('refresh img done')
-        #d.show()
-
-#         imbuff =  Image.frombuffer(im_mode, im_size, rawdata,
-#                                    'raw', im_mode, 0, 1)
-#         # d.add('refresh after Image.frombuffer')
-#
-#         self.GetImageSize()
-#
-#         if self.img_h < 1 or self.img_w < 1:
-#             return
-#         display_size = (int(self.img_h*self.scale), int(self.img_w*self.scale))
-#
-#         imbuff = imbuff.resize(display_size)
-#         if self.wximage.GetSize() != imbuff.size:
-#             self.wximage = wx.EmptyImage(display_size[0], display_size[1])
-#         # d.add('refresh after sizing')
-#         self.imbuff = imbuff
-#         self.wximage.SetData(imbuff.convert('RGB').tostring())
-#         # d.add('refresh set wximage.tostring')
-#         self.image.SetValue(self.wximage)
-
-        # d.show()
+        self.histogram.update(self.get_frame(), limits=self.renderer.dmap.current)
+        self.messag(' Image # %i ' % frame.uid, panel=2)
+        if self.prof_live and self.lineplotter is not None:
+            self.ShowProfile()
+        if len(self.roistats.rois) > 0:
+            self.roistats.update(self.get_frame(), frame.timestamp)
+            self.ShowROIStats()
+
+        render_time = time.time() - t0
+        self.governor.add_render(render_time, self.renderer.decimation)
+        self.n_drawn += 1
+        self.render_time += render_time
+        fetcher = self.fetcher
+        if self.player is not None:
+            fetcher = self.player
+        if fetcher is not None:
+            delt = max(1.e-3, time.time() - self.starttime)
+            n_total = max(fetcher.n_total, self.n_drawn)
+            smsg = self.stat_msg % (self.n_drawn, n_total,
+                                    n_total - self.n_drawn,
+                                    self.n_drawn/delt,
+                                    100*self.governor.load,
+                                    1000*fetcher.mean_fetch_time,
+                                    1000*self.render_time/self.n_drawn)
+            if self.player is None and isinstance(fetcher, CodecFetcher):
+                if fetcher.fallback is not None:
+                    smsg = '%s, uncompressed (%s)' % (smsg, fetcher.fallback)
+                elif fetcher.n_decoded > 0:
+                    smsg = '%s, %s %.1f kB/frame, decode %.0f MB/s' % (
+                        smsg, fetcher.codec, fetcher.mean_nbytes/1024.0,
+                        fetcher.decode_rate/1.e6)
+            if fetcher.n_errors > 0:
+                smsg = '%s, %i fetch errors (%s)' % (smsg, fetcher.n_errors,
+                                                     fetcher.last_error)
+            if self.player is not None:
+                smsg = 'Replay: %s' % smsg
+            if self.recorder is not None:
+                smsg = '%s, recorded %i' % (smsg, self.recorder.n_written)
+            self.messag(smsg, panel=0)
 
 if __name__ == '__main__':
     import sys
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+Headless benchmark of the AreaDetector Display render path
+
+Simulated frames of several data types and sizes are sent through the
+same steps as for a displayed frame (shape and orient, autoscale,
+decimate, color lookup) and a line profile, reporting per-stage latency
+percentiles, frames per second and peak memory as JSON.
+
+   python benchmark.py -o run1.json
+   python benchmark.py -o run2.json -c run1.json   # compare to earlier run
+"""
+import sys
+import time
+import json
+import platform
+from optparse import OptionParser
+import numpy as np
+
+try:
+    import resource
+    HAS_RESOURCE = True
+except ImportError:
+    HAS_RESOURCE = False
+
+from renderer import (FrameRenderer, DECIMATIONS, fit_size,
+                      get_orientation, oriented_size)
+from lineprofile import line_profile, PROFILE_MODES
+from simulator import FrameSimulator
+
+SIZES = ('640x480', '1024x1024', '2048x2048', '4096x4096')
+FRAME_TYPES = ('uint8', 'uint16', 'uint32', 'rgb')
+PERCENTS = (50, 90, 99)
+
+def peak_memory():
+    "peak resident memory of this process in MB, or None if unknown"
+    if not HAS_RESOURCE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024.0*1024.0)
+    return peak / 1024.0
+
+def time_stats(samples):
+    "dict of mean, max and percentile times in ms for a list of times in s"
+    samples = 1000*np.asarray(samples)
+    out = {'mean_ms': float(samples.mean()), 'max_ms': float(samples.max())}
+    for pct, val in zip(PERCENTS, np.percentile(samples, PERCENTS)):
+        out['p%i_ms' % pct] = float(val)
+    return out
+
+def run_case(width, height, frame_type, nframes=50, display=(800, 800),
+             decimation='stride', rot90=0, flipv=False, fliph=False,
+             profile_width=1, profile_mode='nearest'):
+    """benchmark nframes simulated frames of one size and type,
+    returning dict of results"""
+    colormode, dtype = 0, frame_type
+    if frame_type == 'rgb':
+        colormode, dtype = 2, 'uint8'
+    sim = FrameSimulator(width=width, height=height, dtype=dtype,
+                         colormode=colormode)
+    data = np.empty(sim.count, dtype=sim.dtype)
+    im_size = (sim.width, sim.height)
+
+    renderer = FrameRenderer()
+    renderer.decimation = decimation
+    renderer.orientation = get_orientation(flipv, fliph, rot90)
+    dsize = fit_size(oriented_size(im_size, renderer.orientation), display)
+    timer = renderer.timer
+    timer.keep_samples = True
+    x0, y0, x1, y1 = width/8, height/8, 7*width/8, 7*height/8
+
+    frame_times = []
+    t0 = time.time()
+    for uid in range(1, nframes+1):
+        tframe = time.time()
+        timer.start('frame')
+        sim.fill(data, uid)
+        timer.add('make frame')
+        renderer.render(data, im_size, colormode, dsize)
+        line_profile(data.reshape(sim.shape), x0, y0, x1, y1,
+                     width=profile_width, mode=profile_mode)
+        timer.add('line profile')
+        timer.finish()
+        frame_times.append(time.time() - tframe)
+    elapsed = time.time() - t0
+
+    stages = {}
+    for stage in timer.stages:
+        stages[stage] = time_stats(timer.samples[stage])
+    render_stages = [s for s in timer.stages if s not in ('make frame',
+                                                          'line profile')]
+    render_times = np.sum([timer.samples[s] for s in render_stages], axis=0)
+    return {'name': '%s_%ix%i' % (frame_type, width, height),
+            'frame_type': frame_type, 'dtype': sim.dtype.name,
+            'colormode': colormode, 'width': width, 'height': height,
+            'display_size': list(dsize), 'nframes': nframes,
+            'fps': nframes/max(elapsed, 1.e-9),
+            'render_fps': 1.0/max(render_times.mean(), 1.e-9),
+            'frame': time_stats(frame_times),
+            'render': time_stats(render_times),
+            'stages': stages,
+            'peak_memory_mb': peak_memory()}
+
+def run_benchmark(sizes=SIZES, frame_types=FRAME_TYPES, nframes=50,
+                  verbose=True, **kws):
+    """run benchmark for all sizes and frame types, smallest frames first
+    (peak memory only increases), returning dict of results"""
+    cases = []
+    sizes = [[int(w) for w in size.lower().split('x')] for size in sizes]
+    sizes.sort(key=lambda s: s[0]*s[1])
+    for width, height in sizes:
+        for frame_type in frame_types:
+            case = run_case(width, height, frame_type, nframes=nframes, **kws)
+            cases.append(case)
+            if verbose:
+                sys.stdout.write('%-20s %8.1f fps  render p50 %8.2f ms, p99 %8.2f ms\n' %
+                                 (case['name'], case['fps'],
+                                  case['render']['p50_ms'],
+                                  case['render']['p99_ms']))
+    options = dict(nframes=nframes)
+    options.update(kws)
+    return {'created': time.ctime(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'options': options,
+            'cases': cases}
+
+def compare_results(old, new, tolerance=0.10, writer=None):
+    """write comparison of two benchmark results (as from run_benchmark),
+    returning list of names of cases whose render p50 time is more
+    than tolerance slower in new than in old"""
+    if writer is None:
+        writer = sys.stdout.write
+    oldcases = dict([(c['name'], c) for c in old['cases']])
+    slower = []
+    writer('# %-20s %10s %10s %10s\n' % ('case', 'old p50', 'new p50', 'change'))
+    for case in new['cases']:
+        name = case['name']
+        if name not in oldcases:
+            continue
+        t_old = oldcases[name]['render']['p50_ms']
+        t_new = case['render']['p50_ms']
+        change = (t_new - t_old)/max(t_old, 1.e-9)
+        flag = ''
+        if change > tolerance:
+            slower.append(name)
+            flag = '  SLOWER'
+        writer('  %-20s %10.3f %10.3f %+9.1f%%%s\n' % (name, t_old, t_new,
+                                                      100*change, flag))
+    return slower
+
+def main():
+    usage = 'usage: %prog [options]'
+    parser = OptionParser(usage=usage, prog='benchmark')
+    parser.add_option('-n', '--nframes', type='int', default=50,
+                      help='number of frames per case [50]')
+    parser.add_option('-s', '--sizes', default=','.join(SIZES),
+                      help='comma-separated frame sizes [%default]')
+    parser.add_option('-t', '--types', default=','.join(FRAME_TYPES),
+                      help='comma-separated frame types [%default]')
+    parser.add_option('-d', '--display', default='800x800',
+                      help='display (window) size [%default]')
+    parser.add_option('--decimate', default='stride', choices=DECIMATIONS,
+                      help='decimation: stride or bin [%default]')
+    parser.add_option('--rotate', type='int', default=0,
+                      help='number of clockwise quarter turns [0]')
+    parser.add_option('--flipv', action='store_true', default=False,
+                      help='flip up/down')
+    parser.add_option('--fliph', action='store_true', default=False,
+                      help='flip left/right')
+    parser.add_option('--profile-width', type='int', default=1,
+                      help='line profile width in pixels [1]')
+    parser.add_option('--profile-mode', default='nearest', choices=PROFILE_MODES,
+                      help='line profile sampling: nearest or bilinear [%default]')
+    parser.add_option('-o', '--output', default=None,
+                      help='write JSON results to file (default: stdout)')
+    parser.add_option('-c', '--compare', default=None,
+                      help='JSON results of an earlier run to compare to')
+    (opts, args) = parser.parse_args()
+
+    display = tuple([int(w) for w in opts.display.lower().split('x')])
+    result = run_benchmark(sizes=opts.sizes.split(','),
+                           frame_types=opts.types.split(','),
+                           nframes=opts.nframes, verbose=opts.output is not None,
+                           display=display, decimation=opts.decimate,
+                           rot90=opts.rotate, flipv=opts.flipv,
+                           fliph=opts.fliph, profile_width=opts.profile_width,
+                           profile_mode=opts.profile_mode)
+    text = json.dumps(result, indent=1, sort_keys=True)
+    if opts.output is None:
+        sys.stdout.write('%s\n' % text)
+    else:
+        fout = open(opts.output, 'w')
+        fout.write(text)
+        fout.close()
+    if opts.compare is not None:
+        fin = open(opts.compare, 'r')
+        old = json.load(fin)
+        fin.close()
+        slower = compare_results(old, result)
+        if len(slower) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Fetching compressed AreaDetector arrays (from NDPluginCodec)
+
+With an NDPluginCodec plugin (Codec1) compressing frames and an image
+plugin (image2) fed from it, ArrayData holds CompressedSize_RBV bytes
+of compressed data, with Codec_RBV naming the compression and
+DataType_RBV giving the data type of the uncompressed frame.
+
+Decompression needs the optional modules 'lz4', 'blosc', 'bitshuffle'
+(for 'bslz4') and PIL (for 'jpeg').  Codecs whose module is missing
+are not decoded, and frames are fetched uncompressed instead.
+"""
+import time
+import threading
+import Queue
+from cStringIO import StringIO
+import numpy as np
+
+from framefetch import Frame, FrameFetcher, IMG_ATTRS
+
+HAS_LZ4 = False
+try:
+    import lz4.block
+    HAS_LZ4 = True
+except ImportError:
+    pass
+
+HAS_BLOSC = False
+try:
+    import blosc
+    HAS_BLOSC = True
+except ImportError:
+    pass
+
+HAS_BITSHUFFLE = False
+try:
+    import bitshuffle
+    HAS_BITSHUFFLE = True
+except ImportError:
+    pass
+
+HAS_JPEG = False
+try:
+    import Image
+    HAS_JPEG = True
+except ImportError:
+    pass
+
+# attributes of the image plugin for compressed arrays
+CODEC_IMG_ATTRS = IMG_ATTRS + ('Codec_RBV', 'CompressedSize_RBV',
+                               'DataType_RBV')
+
+# seconds before trying compressed arrays again after falling back
+CODEC_RETRY = 10.0
+
+# numpy dtypes for AreaDetector DataType names
+AD_DTYPES = {'Int8': 'i1', 'UInt8': 'u1', 'Int16': '<i2', 'UInt16': '<u2',
+             'Int32': '<i4', 'UInt32': '<u4', 'Int64': '<i8',
+             'UInt64': '<u8', 'Float32': '<f4', 'Float64': '<f8'}
+
+def decode_lz4(raw, out):
+    out[:] = np.frombuffer(lz4.block.decompress(raw.tostring(),
+                                                uncompressed_size=out.nbytes),
+                           dtype=out.dtype)
+
+def decode_blosc(raw, out):
+    # blosc writes straight into the frame buffer
+    blosc.decompress_ptr(raw.tostring(), out.__array_interface__['data'][0])
+
+def decode_bslz4(raw, out):
+    out[:] = bitshuffle.decompress_lz4(raw, out.shape, out.dtype)
+
+def decode_jpeg(raw, out):
+    out[:] = np.asarray(Image.open(StringIO(raw.tostring()))).ravel()
+
+DECODERS = {}
+if HAS_LZ4:
+    DECODERS['lz4'] = decode_lz4
+if HAS_BLOSC:
+    DECODERS['blosc'] = decode_blosc
+if HAS_BITSHUFFLE:
+    DECODERS['bslz4'] = decode_bslz4
+if HAS_JPEG:
+    DECODERS['jpeg'] = decode_jpeg
+
+def decompress(codec, raw, out):
+    """decompress array of bytes raw compressed with codec into out,
+    a flat array of the uncompressed size and data type"""
+    DECODERS[codec](raw.view(np.uint8), out)
+    return out
+
+class CodecFetcher(FrameFetcher):
+    """fetch compressed arrays from image plugin ad_cimg, fed from an
+    NDPluginCodec plugin, decompressing them in a separate thread, so
+    that fetching the next frame overlaps decoding this one.
+
+    If the codec plugin is not connected, the arrays are not compressed,
+    or the codec cannot be decoded, this falls back to fetching
+    uncompressed frames from ad_img, with the reason in self.fallback,
+    and tries compressed arrays again after retry_time seconds.
+
+    Only the newest fetched frame waits to be decoded: a frame replaced
+    before being decoded has been fetched, and is counted in n_replaced
+    (and n_dropped), as for frames replaced in the ring.
+    """
+    def __init__(self, ad_img, ad_cimg, onframe, nbuffers=3, pool=None):
+        FrameFetcher.__init__(self, ad_img, onframe, nbuffers=nbuffers,
+                              pool=pool)
+        self.ad_cimg = ad_cimg
+        self.codec = None
+        self.fallback = None
+        self.retry_time = CODEC_RETRY
+        self.retry_at = 0.0
+        self.queue = Queue.Queue(maxsize=1)
+        self.decoder = threading.Thread(target=self.run_decoder)
+        self.decoder.daemon = True
+
+    def reset_counters(self):
+        FrameFetcher.reset_counters(self)
+        self.n_decoded = 0
+        self.decode_time = 0.0
+        self.nbytes_read = 0
+        self.nbytes_decoded = 0
+        self.n_replaced = 0
+
+    @property
+    def n_dropped(self):
+        "frames not fetched, or fetched and replaced before being shown"
+        return FrameFetcher.n_dropped.fget(self) + self.n_replaced
+
+    @property
+    def mean_nbytes(self):
+        "mean number of bytes read per frame"
+        return self.nbytes_read / max(1.0, self.n_fetched)
+
+    @property
+    def decode_rate(self):
+        "decoded bytes per second of decoding time"
+        return self.nbytes_decoded / max(1.e-9, self.decode_time)
+
+    def start(self):
+        FrameFetcher.start(self)
+        self.decoder.start()
+
+    def set_fallback(self, reason):
+        """fall back to fetching uncompressed frames, until retry_time
+        seconds from now"""
+        if self.fallback is None:
+            self.fallback = reason
+        self.retry_at = time.time() + self.retry_time
+
+    def fetch(self):
+        "read the current frame, queueing it for decoding"
+        cimg = self.ad_cimg
+        codec = dtype = None
+        if self.fallback is not None and time.time() > self.retry_at:
+            # try compressed arrays again
+            self.fallback = None
+        if self.fallback is None:
+            codec = cimg.get('Codec_RBV', as_string=True)
+            dtype = AD_DTYPES.get(cimg.get('DataType_RBV', as_string=True))
+            if not cimg.PV('ArrayData').connected:
+                self.set_fallback('codec plugin not connected')
+            elif codec in ('', None):
+                self.set_fallback('arrays not compressed')
+            elif codec not in DECODERS:
+                self.set_fallback('cannot decode %s' % codec)
+            elif dtype is None:
+                self.set_fallback('unknown data type')
+        if self.fallback is None:
+            self.codec = codec
+            out = self.read_array(cimg, nread=cimg.CompressedSize_RBV)
+        else:
+            codec = dtype = self.codec = None
+            out = self.read_array(self.ad_img)
+        if out is None:
+            return None
+        rawdata, arrsize, colormode, count, uid, fetch_time = out
+        self.count_uid(uid, fetch_time)
+        item = (codec, dtype, rawdata, arrsize, colormode, count, uid,
+                fetch_time)
+        try:
+            self.queue.put_nowait(item)
+        except Queue.Full:
+            try:
+                self.queue.get_nowait()
+                self.n_replaced += 1
+            except Queue.Empty:
+                pass
+            self.queue.put_nowait(item)
+        return None
+
+    def run_decoder(self):
+        while self.running:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except Queue.Empty:
+                continue
+            codec, dtype, rawdata, arrsize, colormode, count, uid, fetch_time = item
+            t0 = time.time()
+            decode_time = 0.0
+            if codec is None:
+                slot, buff = self.ring.get_buffer(count, rawdata.dtype)
+                buff[:] = rawdata
+            else:
+                slot, buff = self.ring.get_buffer(count, dtype)
+                try:
+                    decompress(codec, rawdata, buff)
+                except Exception, e:
+                    # the frame is not shown.  Ring slots are only held
+                    # once published, so slot needs no release
+                    self.set_fallback('could not decode %s: %s' % (codec, e))
+                    continue
+                decode_time = time.time() - t0
+                self.n_decoded += 1
+                self.decode_time += decode_time
+                self.nbytes_decoded += buff.nbytes
+            self.nbytes_read += rawdata.nbytes
+            self.publish(slot, Frame(data=buff, arrsize=arrsize,
+                                     colormode=colormode, uid=uid,
+                                     fetch_time=fetch_time,
+                                     nbytes=rawdata.nbytes,
+                                     decode_time=decode_time))
@@ -0,0 +1,147 @@
+"""
+Intensity scaling and color tables for the AreaDetector Display
+"""
+import numpy as np
+
+# color tables as (fraction, red, green, blue) anchor points
+COLORTABLES = {'gray':    ((0, 0, 0, 0), (1, 1, 1, 1)),
+               'gray_r':  ((0, 1, 1, 1), (1, 0, 0, 0)),
+               'hot':     ((0, 0, 0, 0), (0.375, 1, 0, 0),
+                           (0.75, 1, 1, 0), (1, 1, 1, 1)),
+               'jet':     ((0, 0, 0, 0.5), (0.125, 0, 0, 1),
+                           (0.375, 0, 1, 1), (0.625, 1, 1, 0),
+                           (0.875, 1, 0, 0), (1, 0.5, 0, 0)),
+               'cool':    ((0, 0, 1, 1), (1, 1, 0, 1)),
+               'viridis': ((0, 0.267, 0.005, 0.329), (0.25, 0.229, 0.322, 0.546),
+                           (0.5, 0.128, 0.567, 0.551), (0.75, 0.369, 0.789, 0.383),
+                           (1, 0.993, 0.906, 0.144))}
+
+COLORTABLE_NAMES = ('gray', 'gray_r', 'hot', 'jet', 'cool', 'viridis')
+TRANSFERS = ('linear', 'log', 'gamma')
+AUTOSCALES = ('minmax', 'percentile', 'fixed')
+
+# number of pixels to use for autoscaling
+NSAMPLE = 65536
+
+def make_colortable(name='gray', ncolors=256):
+    "return (ncolors, 3) uint8 array for named color table"
+    anchors = np.array(COLORTABLES.get(name, COLORTABLES['gray']), dtype='f8')
+    x = np.linspace(0, 1, ncolors)
+    out = np.empty((ncolors, 3), dtype=np.uint8)
+    for i in range(3):
+        out[:, i] = (255*np.interp(x, anchors[:, 0], anchors[:, i+1]) + 0.5)
+    return out
+
+def subsample(data, npts=NSAMPLE):
+    "return a strided view of a 2d (or 3d) frame with about npts pixels"
+    step = max(1, int(np.sqrt(data.shape[0]*data.shape[1]*1.0/npts)))
+    return data[::step, ::step]
+
+class DisplayMap(object):
+    """map frame intensities to RGB through a lookup table
+
+    autoscale  'minmax', 'percentile' (using percentiles), or 'fixed'
+               (using limits).  Autoscale limits are computed on a
+               strided subsample of the frame.
+    transfer   'linear', 'log', or 'gamma' (using gamma)
+    colortable name of color table for mono frames
+
+    uint8 and (u)int16 frames are mapped with a single np.take from a
+    256 or 65536 entry table; other types are first scaled to 16 bit
+    indices.  The table is rebuilt only when the parameters change.
+    """
+    def __init__(self, colortable='gray', transfer='linear', gamma=1.0,
+                 autoscale='minmax', percentiles=(1.0, 99.0),
+                 limits=(0, 255)):
+        self.colortable = colortable
+        self.transfer = transfer
+        self.gamma = gamma
+        self.autoscale = autoscale
+        self.percentiles = percentiles
+        self.limits = limits
+        self.current = None
+        self.lut = None
+        self.lut_key = None
+
+    def set(self, **kws):
+        "set display mapping parameters"
+        for key, val in kws.items():
+            if key not in ('colortable', 'transfer', 'gamma', 'autoscale',
+                           'percentiles', 'limits'):
+                raise KeyError("unknown display map parameter '%s'" % key)
+            setattr(self, key, val)
+        self.current = None
+
+    def get_limits(self, frame):
+        "return (low, high) intensity limits for frame"
+        if self.autoscale == 'fixed':
+            lo, hi = self.limits
+        else:
+            sample = subsample(frame)
+            if self.autoscale == 'percentile':
+                lo, hi = np.percentile(sample, self.percentiles)
+            else:
+                lo, hi = sample.min(), sample.max()
+            lo, hi = float(lo), float(hi)
+            # keep previous limits for small changes, so that the
+            # lookup table is not rebuilt for every frame
+            if self.current is not None:
+                clo, chi = self.current
+                tol = 0.01*(chi - clo)
+                if abs(lo-clo) <= tol and abs(hi-chi) <= tol:
+                    lo, hi = clo, chi
+        if hi <= lo:
+            hi = lo + 1.0
+        self.current = (lo, hi)
+        return lo, hi
+
+    def transfer_curve(self, x):
+        "apply transfer function to x in [0, 1]"
+        if self.transfer == 'log':
+            return np.log10(1.0 + 1000.0*x) / np.log10(1001.0)
+        elif self.transfer == 'gamma' and self.gamma > 0:
+            return x**self.gamma
+        return x
+
+    def get_lut(self, nlut, signed, lo, hi, mono=True):
+        """return lookup table with nlut entries for intensities lo to hi.
+        For signed tables, entries past nlut/2 are for negative values,
+        to be used with np.take(..., mode='wrap')"""
+        key = (nlut, signed, lo, hi, mono, self.colortable,
+               self.transfer, self.gamma)
+        if self.lut is None or self.lut_key != key:
+            vals = np.arange(nlut, dtype='f8')
+            if signed:
+                vals[nlut//2:] -= nlut
+            x = np.clip((vals - lo)/(hi - lo), 0, 1)
+            index = (255*self.transfer_curve(x) + 0.5).astype(np.uint8)
+            if mono:
+                self.lut = make_colortable(self.colortable)[index]
+            else:
+                self.lut = index
+            self.lut_key = key
+        return self.lut
+
+    def apply(self, frame, out, limits=None):
+        """map 2d mono frame (or 3d RGB frame) into uint8 RGB array out,
+        using limits, or the autoscale limits of frame if not given."""
+        if limits is None:
+            limits = self.get_limits(frame)
+        lo, hi = limits
+        mono = frame.ndim == 2
+        dtype = frame.dtype
+        mode = 'clip'
+        if dtype in (np.uint8, np.int8, np.uint16, np.int16):
+            nlut = 256 if dtype.itemsize == 1 else 65536
+            signed = dtype.kind == 'i'
+            if signed:
+                mode = 'wrap'
+            index = frame
+        else:
+            nlut, signed = 65536, False
+            index = (frame - lo) * ((nlut-1)/(hi-lo))
+            np.clip(index, 0, nlut-1, out=index)
+            index = index.astype(np.uint16)
+            lo, hi = 0, nlut-1
+        lut = self.get_lut(nlut, signed, lo, hi, mono=mono)
+        return np.take(lut, index, axis=0, out=out, mode=mode)
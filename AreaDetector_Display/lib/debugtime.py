@@ -22,6 +22,15 @@ class debugtime(object):
             self.clear()
             
 
+    def get_deltas(self):
+        "return list of (message, delta time) for each step after the first"
+        out = []
+        tlast = self.times[0][1]
+        for m, t in self.times[1:]:
+            out.append((m, t-tlast))
+            tlast = t
+        return out
+
     def get_report(self):
         m0, t0 = self.times[0]
         tlast= t0
@@ -42,3 +51,62 @@ class debugtime(object):
             out.append(" %s   %10.4f    %10.4f" % (m,dt, tt))
             tlast = t
         return '\n'.join(out)
+
+class stagetimer(debugtime):
+    """debugtime that accumulates the time spent in each named stage
+    over many passes, for per-stage reports of a repeated pipeline.
+
+    use start() at the top of each pass, add(stage) after each stage,
+    and finish() at the end of the pass.
+
+    with keep_samples=True, the time of every pass of each stage is
+    also kept, in self.samples."""
+    def __init__(self, keep_samples=False):
+        self.keep_samples = keep_samples
+        self.reset()
+        debugtime.__init__(self)
+
+    def reset(self):
+        self.stages = []
+        self.totals = {}
+        self.counts = {}
+        self.maxima = {}
+        self.samples = {}
+        self.npass  = 0
+
+    def start(self, msg='start'):
+        self.clear()
+        self.add(msg)
+
+    def finish(self):
+        "accumulate stage times for the current pass"
+        if len(self.times) < 2:
+            return
+        self.npass += 1
+        for m, dt in self.get_deltas():
+            if m not in self.totals:
+                self.stages.append(m)
+                self.totals[m] = 0.0
+                self.counts[m] = 0
+                self.maxima[m] = 0.0
+                self.samples[m] = []
+            self.totals[m] += dt
+            self.counts[m] += 1
+            self.maxima[m] = max(dt, self.maxima[m])
+            if self.keep_samples:
+                self.samples[m].append(dt)
+        self.clear()
+
+    def get_stage_report(self):
+        lmsg = max([len(m) for m in self.stages] + [12])
+        m = '# Stage' + ' '*(lmsg-6)
+        out = ["# Stage times for %i passes" % self.npass,
+               "#--------------------" + '-'*lmsg,
+               '%s  Count   Mean(ms)    Max(ms)   Total(s)' % m]
+        for m in self.stages:
+            count = max(1, self.counts[m])
+            out.append(" %s  %6i  %9.3f  %9.3f  %9.3f" %
+                       (m + ' '*(lmsg-len(m)), self.counts[m],
+                        1000*self.totals[m]/count, 1000*self.maxima[m],
+                        self.totals[m]))
+        return '\n'.join(out)
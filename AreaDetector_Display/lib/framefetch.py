@@ -0,0 +1,422 @@
+"""
+Background fetching of AreaDetector frames for the AreaDetector Display
+
+wx and epics are imported only where used, so that frames and frame
+sources (as for simulator.FrameSimulator in benchmark.py) can be used
+without them.
+"""
+import sys
+import time
+import heapq
+import threading
+import traceback
+import numpy as np
+
+# attributes of the AreaDetector image plugin used to fetch frames
+IMG_ATTRS = ('ArrayData', 'UniqueId_RBV', 'NDimensions_RBV',
+             'ArraySize0_RBV', 'ArraySize1_RBV', 'ArraySize2_RBV',
+             'ColorMode_RBV')
+
+class Frame(object):
+    """a fetched frame: data and the array properties read with it.
+    nbytes is the number of bytes read (compressed size for compressed
+    arrays), and decode_time the time taken to decompress the array.
+    For a replayed frame, timestamp is the recorded time, and
+    replay_time the time it was replayed."""
+    def __init__(self, data=None, arrsize=None, colormode=0, uid=0,
+                 timestamp=None, fetch_time=0.0, nbytes=None,
+                 decode_time=0.0, replay_time=None):
+        if arrsize is None:
+            arrsize = [0, 0, 0]
+        if timestamp is None:
+            timestamp = time.time()
+        self.data = data
+        self.arrsize = list(arrsize)
+        self.colormode = colormode
+        self.uid = uid
+        self.timestamp = timestamp
+        self.fetch_time = fetch_time
+        self.nbytes = nbytes
+        self.decode_time = decode_time
+        self.replay_time = replay_time
+        if nbytes is None and data is not None:
+            self.nbytes = data.nbytes
+
+    @property
+    def im_size(self):
+        "(width, height) of frame"
+        if self.colormode == 2:
+            return (self.arrsize[1], self.arrsize[2])
+        return (self.arrsize[0], self.arrsize[1])
+
+class FrameRing(object):
+    """small ring of preallocated frame buffers, handing frames from one
+    producer thread to the GUI with 'latest frame wins':
+
+    the producer fills a buffer from get_buffer() and calls publish(),
+    the consumer calls take() to get the newest published frame.  A
+    published frame that is replaced before it is taken is dropped and
+    counted in n_overwritten.  The buffer of the last taken frame is not
+    re-used until the next take(), so the GUI can keep using it.
+    """
+    def __init__(self, nbuffers=3):
+        self.lock = threading.Lock()
+        self.nbuffers = max(3, nbuffers)
+        self.buffers = [None]*self.nbuffers
+        self.frames  = [None]*self.nbuffers
+        self.latest = None
+        self.inuse = None
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.n_published = 0
+        self.n_taken = 0
+        self.n_overwritten = 0
+
+    def get_buffer(self, size, dtype):
+        """return (slot, buffer) for the producer to fill, as a flat
+        array, re-allocating that slot's buffer only if size or dtype
+        have changed"""
+        self.lock.acquire()
+        try:
+            for slot in range(self.nbuffers):
+                if slot not in (self.latest, self.inuse):
+                    break
+        finally:
+            self.lock.release()
+        buff = self.buffers[slot]
+        if buff is None or buff.size != size or buff.dtype != dtype:
+            buff = self.buffers[slot] = np.empty(size, dtype=dtype)
+        elif buff.shape != (size,):
+            # reshaped in place by a user of the frame
+            buff = self.buffers[slot] = buff.reshape(size)
+        return slot, buff
+
+    def publish(self, slot, frame):
+        """make frame in slot the latest frame.  Returns True if the
+        consumer needs to be notified (no frame was already waiting)"""
+        self.lock.acquire()
+        try:
+            notify = self.latest is None
+            if not notify:
+                self.n_overwritten += 1
+            self.frames[slot] = frame
+            self.latest = slot
+            self.n_published += 1
+        finally:
+            self.lock.release()
+        return notify
+
+    def take(self):
+        "return newest published frame, or None if there is no new frame"
+        self.lock.acquire()
+        try:
+            if self.latest is None:
+                return None
+            self.inuse, self.latest = self.latest, None
+            self.n_taken += 1
+            return self.frames[self.inuse]
+        finally:
+            self.lock.release()
+
+class FrameSource(threading.Thread):
+    """base class for sources of frames, each running in a background
+    thread.  Each call to trigger() wakes the thread to get the current
+    frame with fetch(), which is put in a FrameRing.  When a frame is
+    ready and none is already waiting, onframe() is called on the GUI
+    thread with wx.CallAfter, and should get the frame with ring.take().
+
+    Derived classes must provide fetch(), returning (slot, frame) for a
+    frame put in a buffer from self.ring.get_buffer(), or None if there
+    is no new frame.  Frames not fetched should be counted in n_skipped.
+
+    Fetches are at least min_interval seconds apart or, if governor is
+    set (to a governor.FrameGovernor), governor.interval seconds apart,
+    and the governor is given the cost of each fetch.
+
+    If recorder is set (to a recorder.FrameRecorder), every fetched
+    frame is also passed to recorder.add().
+
+    If pool is given (a FetchPool), frames are fetched by the pool's
+    worker threads, and the source does not start a thread of its own.
+
+    Errors from fetch() are counted in n_errors, with the message in
+    last_error, and passed to onerror(message) if set.  Only errors of
+    the types in fetch_errors are expected: for other errors, the
+    traceback is also written to stderr.  Fetching goes on either way.
+    """
+    min_interval = 0.025
+    fetch_errors = ()
+    def __init__(self, onframe, nbuffers=3, pool=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.onframe = onframe
+        self.ring = FrameRing(nbuffers=nbuffers)
+        self.event = threading.Event()
+        self.running = True
+        self.last_fetch = 0.0
+        self.governor = None
+        self.recorder = None
+        self.onerror = None
+        self.pool = pool
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.n_fetched = 0
+        self.n_skipped = 0
+        self.n_errors = 0
+        self.last_error = None
+        self.fetch_time = 0.0
+        self.ring.reset_counters()
+
+    @property
+    def n_dropped(self):
+        "frames not fetched, or fetched and replaced before being shown"
+        return self.n_skipped + self.ring.n_overwritten
+
+    @property
+    def n_total(self):
+        "frames made by the source, whether fetched or not"
+        return self.n_fetched + self.n_skipped
+
+    @property
+    def mean_fetch_time(self):
+        return self.fetch_time / max(1, self.n_fetched)
+
+    def trigger(self):
+        "request a fetch of the current frame"
+        if self.pool is not None:
+            self.pool.request(self)
+        else:
+            self.event.set()
+
+    def start(self):
+        if self.pool is None:
+            threading.Thread.start(self)
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+
+    def next_fetch_time(self):
+        "earliest time for the next fetch"
+        interval = self.min_interval
+        if self.governor is not None:
+            interval = self.governor.interval
+        return self.last_fetch + interval
+
+    def run(self):
+        while self.running:
+            if not self.event.wait(0.5):
+                continue
+            self.event.clear()
+            if not self.running:
+                break
+            wait = self.next_fetch_time() - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.fetch_and_publish()
+
+    def fetch_and_publish(self):
+        "fetch a frame and hand it to the GUI"
+        self.last_fetch = time.time()
+        try:
+            out = self.fetch()
+        except self.fetch_errors, exc:
+            self.fetch_error(exc)
+            return
+        except Exception, exc:
+            sys.stderr.write('Unexpected error fetching frame:\n')
+            traceback.print_exc()
+            self.fetch_error(exc)
+            return
+        if out is not None:
+            self.publish(*out)
+
+    def fetch_error(self, exc):
+        "count and report an error from fetch()"
+        self.n_errors += 1
+        self.last_error = '%s: %s' % (exc.__class__.__name__, exc)
+        if self.onerror is not None:
+            self.onerror(self.last_error)
+
+    def publish(self, slot, frame):
+        "hand frame in ring buffer slot to the GUI"
+        if self.governor is not None:
+            self.governor.add_fetch(frame.fetch_time + frame.decode_time)
+        if self.recorder is not None:
+            self.recorder.add(frame)
+        if self.ring.publish(slot, frame):
+            import wx
+            wx.CallAfter(self.onframe)
+
+    def fetch(self):
+        raise NotImplementedError
+
+class FrameFetcher(FrameSource):
+    """fetch ArrayData from an AreaDetector image plugin in a background
+    thread, typically triggered from the ArrayCounter_RBV callback.
+    Gaps in UniqueId_RBV are counted as skipped frames."""
+    def __init__(self, ad_img, onframe, nbuffers=3, pool=None):
+        FrameSource.__init__(self, onframe, nbuffers=nbuffers, pool=pool)
+        import epics
+        self.fetch_errors = (epics.ca.ChannelAccessException,
+                             epics.ca.CASeverityException)
+        self.ad_img = ad_img
+        self.last_uid = None
+
+    def run(self):
+        import epics
+        epics.ca.use_initial_context()
+        FrameSource.run(self)
+
+    def read_array(self, ad_img, nread=None):
+        """read current ArrayData of an image plugin, returning
+        (rawdata, arrsize, colormode, count, uid, fetch_time), or None
+        if there is no new array.  count is the number of values of
+        the frame, and nread (default count) the number of values read,
+        for compressed arrays."""
+        pv = ad_img.PV('ArrayData')
+        if not pv.connected:
+            return None
+        uid = ad_img.UniqueId_RBV
+        if uid == self.last_uid:
+            return None
+        arrsize = [ad_img.ArraySize0_RBV, ad_img.ArraySize1_RBV,
+                   ad_img.ArraySize2_RBV]
+        colormode = ad_img.ColorMode_RBV
+        if None in arrsize or uid is None or colormode is None:
+            # array properties not connected
+            return None
+        count = arrsize[0] * arrsize[1]
+        if ad_img.NDimensions_RBV == 3:
+            count = count * arrsize[2]
+        if nread is None:
+            nread = count
+        if count < 1 or nread < 1:
+            return None
+
+        t0 = time.time()
+        rawdata = pv.get(count=nread)
+        fetch_time = time.time() - t0
+        if not isinstance(rawdata, np.ndarray) or rawdata.size < nread:
+            return None
+        return rawdata[:nread], arrsize, colormode, count, uid, fetch_time
+
+    def count_uid(self, uid, fetch_time):
+        "update counters for a fetched array"
+        # UniqueId gaps are frames that were never fetched,
+        # but a decreasing UniqueId is a reset, not dropped frames
+        if self.last_uid is not None and uid > self.last_uid + 1:
+            self.n_skipped += uid - self.last_uid - 1
+        self.last_uid = uid
+        self.n_fetched += 1
+        self.fetch_time += fetch_time
+
+    def fetch(self):
+        """get the current frame into a ring buffer,
+        returning (slot, frame) or None if there is no new frame"""
+        out = self.read_array(self.ad_img)
+        if out is None:
+            return None
+        rawdata, arrsize, colormode, count, uid, fetch_time = out
+        slot, buff = self.ring.get_buffer(count, rawdata.dtype)
+        buff[:] = rawdata
+        self.count_uid(uid, fetch_time)
+        return slot, Frame(data=buff, arrsize=arrsize, colormode=colormode,
+                           uid=uid, fetch_time=fetch_time)
+
+class FetchPool(object):
+    """a few worker threads shared by many FrameSources (for example,
+    one per camera of a tiled display), in place of a thread per source.
+
+    A source with pool=self puts itself in a queue ordered by its
+    next_fetch_time() when triggered, and is fetched by the first free
+    worker once that time has come.  A source is only fetched by one
+    worker at a time: a trigger while it is being fetched queues it
+    again when the fetch is done.
+    """
+    def __init__(self, nworkers=2):
+        self.cond = threading.Condition()
+        self.queue = []
+        self.queued = set()
+        self.busy = set()
+        self.again = set()
+        self.count = 0
+        self.running = True
+        self.workers = []
+        for i in range(nworkers):
+            worker = threading.Thread(target=self.run_worker)
+            worker.daemon = True
+            self.workers.append(worker)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        self.cond.acquire()
+        try:
+            self.running = False
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def request(self, source):
+        "queue source for a fetch"
+        self.cond.acquire()
+        try:
+            if source in self.busy:
+                self.again.add(source)
+            elif source not in self.queued:
+                self._queue(source)
+        finally:
+            self.cond.release()
+
+    def _queue(self, source):
+        "queue source, with cond acquired"
+        self.count += 1
+        heapq.heappush(self.queue, (source.next_fetch_time(),
+                                    self.count, source))
+        self.queued.add(source)
+        self.cond.notify()
+
+    def next_source(self):
+        "wait for the next source that is due, returning None on stop"
+        self.cond.acquire()
+        try:
+            while self.running:
+                wait = 0.5
+                if len(self.queue) > 0:
+                    wait = self.queue[0][0] - time.time()
+                    if wait <= 0:
+                        tfetch, count, source = heapq.heappop(self.queue)
+                        self.queued.discard(source)
+                        if not source.running:
+                            continue
+                        self.busy.add(source)
+                        return source
+                self.cond.wait(min(wait, 0.5))
+            return None
+        finally:
+            self.cond.release()
+
+    def run_worker(self):
+        import epics
+        epics.ca.use_initial_context()
+        while self.running:
+            source = self.next_source()
+            if source is None:
+                break
+            try:
+                source.fetch_and_publish()
+            finally:
+                self.cond.acquire()
+                try:
+                    self.busy.discard(source)
+                    if source in self.again:
+                        self.again.discard(source)
+                        if source.running:
+                            self._queue(source)
+                finally:
+                    self.cond.release()
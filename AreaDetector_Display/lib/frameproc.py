@@ -0,0 +1,178 @@
+"""
+Dark-frame subtraction and running averages of AreaDetector frames
+"""
+import numpy as np
+
+PROC_MODES = ('none', 'mean', 'ema', 'maxhold')
+
+# largest size in bytes of the frame history kept for 'mean'
+MAX_HISTORY = 512*1024*1024
+
+class FrameProcessor(object):
+    """average frames and subtract a dark frame, with float32 buffers
+    that are allocated when the frame size changes and are otherwise
+    updated in place, so that processing a frame allocates nothing.
+
+    mode is one of
+       'none'     no averaging
+       'mean'     running mean of the last navg frames (fewer for
+                  large frames, so the history fits in max_history
+                  bytes: see nmean)
+       'ema'      exponential moving average, with weight 2/(navg+1)
+                  for each new frame
+       'maxhold'  maximum of each pixel since reset()
+
+    With subtract_dark True and a dark frame captured (capture_dark()),
+    the dark frame is subtracted from the averaged frame.
+
+    Frames can be of any shape (flat frames as read from ArrayData are
+    fine), but must have the same number of values as the dark frame.
+    """
+    # re-sum the running mean every resync passes through the
+    # history, so that float32 rounding errors do not build up
+    resync = 16
+
+    def __init__(self, mode='none', navg=10, max_history=MAX_HISTORY):
+        self.mode = mode
+        self.navg = navg
+        self.nmean = navg
+        self.max_history = max_history
+        self.subtract_dark = True
+        self.dark = None
+        self.shape = None
+        self.reset()
+
+    def reset(self):
+        "restart averaging"
+        self.acc = None
+        self.out = None
+        self.history = None
+        self.count = 0
+        self.index = 0
+        self.npass = 0
+
+    def set(self, mode=None, navg=None):
+        "set averaging mode and/or number of frames, restarting averages"
+        if mode is not None:
+            if mode not in PROC_MODES:
+                raise ValueError("unknown processing mode '%s'" % mode)
+            self.mode = mode
+        if navg is not None:
+            self.navg = max(1, int(navg))
+        self.reset()
+
+    @property
+    def active(self):
+        "whether frames are changed by process()"
+        return self.mode != 'none' or self.use_dark
+
+    @property
+    def use_dark(self):
+        return self.subtract_dark and self.dark is not None
+
+    def get_buffers(self, frame):
+        "allocate buffers for frame shape, if needed"
+        if self.dark is not None and self.dark.shape != frame.shape:
+            if self.dark.size == frame.size:
+                self.dark.shape = frame.shape
+            else:
+                self.dark = None
+        if self.out is not None and self.out.shape != self.shape:
+            # reshaped in place by a user of the returned frame
+            self.out = self.out.reshape(self.shape)
+        if self.shape != frame.shape or self.out is None:
+            self.shape = frame.shape
+            self.acc = np.zeros(frame.shape, dtype=np.float32)
+            self.out = np.zeros(frame.shape, dtype=np.float32)
+            self.history = None
+            if self.mode == 'mean':
+                self.nmean = min(self.navg,
+                                 max(1, self.max_history // (4*frame.size)))
+                self.history = np.zeros((self.nmean,) + frame.shape,
+                                        dtype=np.float32)
+            self.count = 0
+            self.index = 0
+
+    def process(self, frame):
+        """return processed frame, as a float32 array (re-used for each
+        frame), or frame itself if no processing is done"""
+        if not self.active:
+            return frame
+        self.get_buffers(frame)
+        acc, out = self.acc, self.out
+        if self.mode == 'none':
+            out[:] = frame
+        elif self.mode == 'maxhold':
+            if self.count == 0:
+                acc[:] = frame
+            else:
+                np.maximum(acc, frame, out=acc)
+            out[:] = acc
+        elif self.mode == 'ema':
+            if self.count == 0:
+                acc[:] = frame
+            else:
+                # acc += alpha*(frame - acc), using out as scratch
+                np.subtract(frame, acc, out=out)
+                out *= 2.0/(self.navg + 1)
+                acc += out
+            out[:] = acc
+        elif self.mode == 'mean':
+            slot = self.history[self.index]
+            if self.count >= self.nmean:
+                acc -= slot
+            slot[:] = frame
+            acc += slot
+            self.count = min(self.count + 1, self.nmean)
+            self.index = (self.index + 1) % self.nmean
+            if self.index == 0:
+                self.npass += 1
+                if self.npass % self.resync == 0:
+                    np.sum(self.history, axis=0, out=acc)
+            np.multiply(acc, 1.0/self.count, out=out)
+        if self.mode != 'mean':
+            self.count += 1
+        if self.use_dark:
+            out -= self.dark
+        return out
+
+    def refresh(self, frame):
+        """return processed frame after the settings change, as
+        process(), but without adding frame to the averages again
+        (unless they were restarted)"""
+        if not self.active:
+            return frame
+        if (self.mode == 'none' or self.count == 0 or
+            self.shape != frame.shape):
+            return self.process(frame)
+        self.get_buffers(frame)
+        if self.mode == 'mean':
+            np.multiply(self.acc, 1.0/self.count, out=self.out)
+        else:
+            self.out[:] = self.acc
+        if self.use_dark:
+            self.out -= self.dark
+        return self.out
+
+    def averaged(self):
+        "current averaged frame (before dark subtraction), or None"
+        if self.mode == 'none' or self.acc is None or self.count == 0:
+            return None
+        if self.mode == 'mean':
+            return self.acc * (1.0/self.count)
+        return self.acc.copy()
+
+    def capture_dark(self, frame=None):
+        """capture the dark frame: the current average if averaging,
+        or else frame (the current raw frame)"""
+        dark = None
+        if self.mode != 'none':
+            dark = self.averaged()
+        if dark is None and frame is not None:
+            dark = np.asarray(frame, dtype=np.float32).copy()
+        if dark is not None:
+            self.dark = dark
+        return self.dark is not None
+
+    def clear_dark(self):
+        self.dark = None
@@ -0,0 +1,89 @@
+"""
+Adaptive display rate for the AreaDetector Display
+"""
+
+class FrameGovernor(object):
+    """choose how often to fetch and show frames, and how to decimate
+    them, from the measured cost of fetching and rendering frames.
+
+    target_fps  highest display rate wanted (frames per second)
+    max_load    largest fraction of time (0 to 1) to spend fetching and
+                rendering frames, to keep the GUI responsive
+
+    Costs are kept as exponential moving averages (weight smoothing for
+    each new frame).  The fetch thread waits at least self.interval
+    seconds between fetches: 1/target_fps, or longer when fetch plus
+    render cost would take more than max_load of the time.
+
+    choose_decimation() returns 'bin' (better looking, more costly) when
+    its render cost fits in the time budget for a frame, and 'stride'
+    otherwise, trying 'bin' again every probe_every frames.
+    """
+    def __init__(self, target_fps=20.0, max_load=0.5, smoothing=0.1,
+                 probe_every=100):
+        self.target_fps = target_fps
+        self.max_load = max_load
+        self.smoothing = smoothing
+        self.probe_every = probe_every
+        self.reset()
+
+    def reset(self):
+        self.fetch_cost = None
+        self.render_cost = {}
+        self.nframes = 0
+        self.decimation = 'bin'
+        self.interval = 1.0/max(self.target_fps, 0.01)
+
+    def set(self, target_fps=None, max_load=None):
+        "set target display rate and/or maximum load"
+        if target_fps is not None:
+            self.target_fps = max(0.1, target_fps)
+        if max_load is not None:
+            self.max_load = min(1.0, max(0.01, max_load))
+        self.update_interval()
+
+    def average(self, old, new):
+        if old is None:
+            return new
+        return old + self.smoothing*(new - old)
+
+    def add_fetch(self, dt):
+        "add cost (s) of fetching a frame (called from fetch thread)"
+        self.fetch_cost = self.average(self.fetch_cost, dt)
+        self.update_interval()
+
+    def add_render(self, dt, decimation):
+        "add cost (s) of rendering a frame with decimation"
+        self.nframes += 1
+        self.decimation = decimation
+        self.render_cost[decimation] = self.average(
+            self.render_cost.get(decimation), dt)
+        self.update_interval()
+
+    @property
+    def cost(self):
+        "estimated cost (s) of fetching and showing one frame"
+        return ((self.fetch_cost or 0.0) +
+                (self.render_cost.get(self.decimation) or 0.0))
+
+    @property
+    def load(self):
+        "estimated fraction of time spent fetching and showing frames"
+        return self.cost / self.interval
+
+    def update_interval(self):
+        self.interval = max(1.0/self.target_fps, self.cost/self.max_load)
+
+    def choose_decimation(self):
+        "return decimation ('bin' or 'stride') to use for the next frame"
+        budget = self.max_load/self.target_fps - (self.fetch_cost or 0.0)
+        bin_cost = self.render_cost.get('bin')
+        if bin_cost is None or bin_cost <= budget:
+            self.decimation = 'bin'
+        elif self.probe_every > 0 and self.nframes % self.probe_every == 0:
+            # re-measure cost of binning from scratch
+            self.render_cost['bin'] = None
+            self.decimation = 'bin'
+        else:
+            self.decimation = 'stride'
+        return self.decimation
@@ -0,0 +1,133 @@
+"""
+Intensity histogram of AreaDetector frames, for judging saturation
+and setting display limits
+"""
+import time
+import numpy as np
+import wx
+
+from colormap import subsample
+
+# number of pixels to histogram: a strided subsample of the frame
+NSAMPLE = 16384
+
+def frame_histogram(frame, nbins=128, npts=NSAMPLE):
+    """return (counts, lo, hi) histogram of a strided subsample of a 2d
+    (or 3d, with colors pooled) frame, with nbins equal bins from the
+    sample minimum (lo) to maximum (hi).
+
+    Integer frames spanning fewer than nbins values get one bin per
+    value.  Bins are found with a single scale and np.bincount, which
+    is several times faster than np.histogram."""
+    sample = subsample(frame, npts=npts)
+    lo, hi = float(sample.min()), float(sample.max())
+    if sample.dtype.kind in 'iub':
+        nbins = max(1, min(nbins, int(hi - lo) + 1))
+        hi = max(hi, lo + nbins - 1)
+    if hi <= lo:
+        hi = lo + 1.0
+    scale = nbins/(hi - lo)
+    index = ((sample - lo)*scale).astype(np.intp).ravel()
+    # the maximum lands one past the last bin
+    np.minimum(index, nbins-1, out=index)
+    return np.bincount(index, minlength=nbins), lo, hi
+
+class HistogramPanel(wx.Panel):
+    """bar chart of the histogram of displayed frames, updated at most
+    every interval seconds, with the display limits drawn as lines.
+
+    Left-click sets the low limit and right-click sets the high limit,
+    calling onlimits(lo, hi).
+    """
+    def __init__(self, parent, size=(250, 80), interval=0.25, nbins=128,
+                 logscale=True, onlimits=None, **kws):
+        wx.Panel.__init__(self, parent, -1, size=size, **kws)
+        self.interval = interval
+        self.nbins = nbins
+        self.logscale = logscale
+        self.onlimits = onlimits
+        self.counts = None
+        self.lo, self.hi = 0.0, 1.0
+        self.limits = None
+        self.last_update = 0.0
+        self.SetBackgroundColour('#FFFFFF')
+        self.SetToolTip(wx.ToolTip('Left-click: set low limit, '
+                                   'Right-click: set high limit'))
+        self.Bind(wx.EVT_PAINT, self.onPaint)
+        self.Bind(wx.EVT_SIZE, self.onSize)
+        self.Bind(wx.EVT_LEFT_DOWN, self.onLeftDown)
+        self.Bind(wx.EVT_RIGHT_DOWN, self.onRightDown)
+
+    def update(self, frame, limits=None, force=False):
+        """recompute histogram of frame and redraw, unless the last
+        update was less than interval seconds ago"""
+        now = time.time()
+        if not force and now < self.last_update + self.interval:
+            return
+        self.last_update = now
+        self.counts, self.lo, self.hi = frame_histogram(frame,
+                                                        nbins=self.nbins)
+        self.limits = limits
+        self.Refresh(False)
+
+    def set_limits(self, limits):
+        "set display limits to draw"
+        self.limits = limits
+        self.Refresh(False)
+
+    def x_to_value(self, x):
+        width = max(1, self.GetClientSize()[0])
+        return self.lo + (self.hi - self.lo)*x/float(width)
+
+    def value_to_x(self, value):
+        width = self.GetClientSize()[0]
+        return int(width*(value - self.lo)/(self.hi - self.lo))
+
+    def onLeftDown(self, event=None):
+        self.set_limit(event.GetX(), 0)
+
+    def onRightDown(self, event=None):
+        self.set_limit(event.GetX(), 1)
+
+    def set_limit(self, x, index):
+        "set low (index 0) or high (index 1) limit from x position"
+        if self.counts is None:
+            return
+        lo, hi = self.limits or (self.lo, self.hi)
+        limits = [lo, hi]
+        limits[index] = self.x_to_value(x)
+        if limits[1] <= limits[0]:
+            return
+        self.set_limits(tuple(limits))
+        if hasattr(self.onlimits, '__call__'):
+            self.onlimits(limits[0], limits[1])
+
+    def onSize(self, event=None):
+        self.Refresh(False)
+        event.Skip()
+
+    def onPaint(self, event=None):
+        dc = wx.BufferedPaintDC(self)
+        dc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        dc.Clear()
+        if self.counts is None:
+            return
+        width, height = self.GetClientSize()
+        counts = self.counts.astype('f8')
+        if self.logscale:
+            counts = np.log10(1.0 + counts)
+        counts = (height - 2)*counts/max(1.0, counts.max())
+        nbins = len(counts)
+        xbins = (width*np.arange(nbins + 1))//nbins
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        dc.SetBrush(wx.Brush('#4060A0'))
+        for i in np.nonzero(counts)[0]:
+            hbar = max(1, int(counts[i]))
+            dc.DrawRectangle(xbins[i], height - hbar,
+                             max(1, xbins[i+1] - xbins[i]), hbar)
+        if self.limits is not None:
+            dc.SetPen(wx.Pen('#D02020', 1))
+            for val in self.limits:
+                x = self.value_to_x(val)
+                if 0 <= x <= width:
+                    dc.DrawLine(x, 0, x, height)
@@ -6,7 +6,7 @@ import wx
 class ImageView(wx.Window):
     def __init__(self, parent, id=-1, pos=wx.DefaultPosition,
                  size=wx.DefaultSize, onzoom=None, onshow=None,
-                 onprofile=None, **kw):
+                 onprofile=None, onresize=None, onroi=None, **kw):
         wx.Window.__init__(self, parent, id, pos, size, **kw)
 
         self.image = None
@@ -23,6 +23,8 @@ class ImageView(wx.Window):
         self.onzoom = onzoom
         self.onshow = onshow
         self.onprofile = onprofile
+        self.onresize = onresize
+        self.onroi = onroi
         self.flipv = False
         self.fliph = False
         self.rot90 = 0
@@ -30,72 +32,57 @@ class ImageView(wx.Window):
         self.prof_line = None
         self.xy_init = None
         self.win_size = 1, 1
+        self.img_size = 1, 1
         
+    def display_to_frame(self, x, y):
+        """convert window pixel (x, y) to fractional (x, y) position in
+        the frame, undoing rotations and then flips"""
+        xoff = (self.win_size[0] - self.img_size[0])/2.0
+        yoff = (self.win_size[1] - self.img_size[1])/2.0
+        fx = (x - xoff) / (1.0*self.img_size[0])
+        fy = (y - yoff) / (1.0*self.img_size[1])
+        for i in range(self.rot90 % 4):
+            fx, fy = fy, 1-fx
+        if self.fliph:
+            fx = 1-fx
+        if self.flipv:
+            fy = 1-fy
+        return fx, fy
+
     def OnLeftDown(self, event=None):
-        if self.cursor_mode in ('zoom', 'profile'):
-            self.zoom_box = None
-            self.prof_line = None
+        if self.cursor_mode in ('zoom', 'profile', 'roi'):
+            self.clearDynamicBox()
             self.xy_init = (event.GetX(), event.GetY())
-            self.Refresh()
 
         #  elif self.cursor_mode == 'show':
-        xoff = (self.win_size[0] - self.img_size[0])/2.0
-        yoff = (self.win_size[1] - self.img_size[1])/2.0
-        x = (event.GetX() - xoff)/ (1.0*self.img_size[0])
-        y = (event.GetY() - yoff)/ (1.0*self.img_size[1])
+        x, y = self.display_to_frame(event.GetX(), event.GetY())
         if hasattr(self.onshow, '__call__'):
             self.onshow(x, y)
 
     def OnLeftUp(self, event=None):
         """action on left up -- send fractional coordinates of image
-        to onzoom or onprofile method"""
-        # get offset of image within window and image size as floating point
-        xoff  = (self.win_size[0] - self.img_size[0])/2.0
-        yoff  = (self.win_size[1] - self.img_size[1])/2.0
-        xsize = 1.0*self.img_size[0]
-        ysize = 1.0*self.img_size[1]
-
-        # make sure rot90 is either 0 or 1, adjusting flipv/fliph if needed
-        self.rot90 = self.rot90 % 4
-        if self.rot90 > 1:
-            self.flipv, self.fliph = not self.flipv, not self.fliph
-            self.rot90 = self.rot90 - 2
-
-        if self.cursor_mode == 'zoom':
-            if hasattr(self.onzoom, '__call__') and self.zoom_box is not None:
-                x0  = (self.zoom_box[0] - xoff)/ xsize
-                xw  =  self.zoom_box[2] / xsize
-                y0  = (self.zoom_box[1] - yoff)/ ysize
-                yw  =  self.zoom_box[3] / ysize
-                if self.flipv:
-                    y0 = 1-y0-yw
-                if self.fliph:
-                    x0 = 1-x0-xw
-                if self.rot90 == 1:
-                    x0, xw, y0, yw = y0, yw, 1-x0-xw, xw
-                x1, y1 = x0+xw, y0+yw
-                x0, y0 = max(0, min(1, x0)), max(0, min(1, y0))
-                x1, y1 = max(0, min(1, x1)), max(0, min(1, y1))
-                xw, yw = x1-x0, y1-y0
-                self.onzoom(x0, y0, xw, yw)
-
-        elif self.cursor_mode == 'profile':
-            if hasattr(self.onprofile, '__call__') and self.prof_line is not None:
-                x0  = (self.prof_line[0] - xoff) / xsize
-                y0  = (self.prof_line[1] - yoff) / ysize
-                x1  = (self.prof_line[2] - xoff) / xsize
-                y1  = (self.prof_line[3] - yoff) / ysize
-                if self.flipv:
-                    y0, y1 = (1-y1), (1-y0)
-                if self.fliph:
-                    x0, x1 = (1-x1), (1-x0)
-                if self.rot90 == 1:
-                    x0, x1, y0, y1 = y0, y1, (1-x0), (1-x1)
-                x0, y0 = max(0, min(1, x0)), max(0, min(1, y0))
-                x1, y1 = max(0, min(1, x1)), max(0, min(1, y1))
-                self.onprofile(x0, y0, x1, y1)
-        self.zoom_box = None
-        self.prof_line = None
+        to onzoom, onroi or onprofile method"""
+        def clip(x):
+            return max(0, min(1, x))
+
+        if self.cursor_mode in ('zoom', 'roi') and self.zoom_box is not None:
+            x, y, w, h = self.zoom_box
+            x0, y0 = self.display_to_frame(x, y)
+            x1, y1 = self.display_to_frame(x+w, y+h)
+            x0, x1 = clip(min(x0, x1)), clip(max(x0, x1))
+            y0, y1 = clip(min(y0, y1)), clip(max(y0, y1))
+            action = self.onzoom
+            if self.cursor_mode == 'roi':
+                action = self.onroi
+            if hasattr(action, '__call__'):
+                action(x0, y0, x1-x0, y1-y0)
+
+        elif self.cursor_mode == 'profile' and self.prof_line is not None:
+            if hasattr(self.onprofile, '__call__'):
+                x0, y0 = self.display_to_frame(*self.prof_line[:2])
+                x1, y1 = self.display_to_frame(*self.prof_line[2:])
+                self.onprofile(clip(x0), clip(y0), clip(x1), clip(y1))
+        self.clearDynamicBox()
         self.xy_init = None
 
     def OnMotion(self, event=None):
@@ -105,44 +92,88 @@ class ImageView(wx.Window):
         xe, ye = (event.GetX(), event.GetY())
         if self.cursor_mode == 'profile':
             self.updateDynamicBox((xi, yi, xe, ye))
-        elif self.cursor_mode == 'zoom':
+        elif self.cursor_mode in ('zoom', 'roi'):
             x, w = min(xe, xi), abs(xe-xi)
             y, h = min(ye, yi), abs(ye-yi)
             self.updateDynamicBox((x, y, w, h))
 
+    def getOverlayRect(self):
+        "return rectangle covering zoom box and profile line, or None"
+        rect = None
+        if self.zoom_box is not None:
+            x, y, w, h = self.zoom_box
+            rect = wx.Rect(x, y, w+1, h+1)
+        if self.prof_line is not None:
+            x0, y0, x1, y1 = self.prof_line
+            prect = wx.Rect(min(x0, x1), min(y0, y1),
+                            abs(x1-x0)+1, abs(y1-y0)+1)
+            if rect is None:
+                rect = prect
+            else:
+                rect = rect.Union(prect)
+        if rect is not None:
+            rect.Inflate(4, 4)
+        return rect
+
+    def refreshOverlay(self, oldrect):
+        "repaint only the region covered by the old and new overlays"
+        rect = self.getOverlayRect()
+        if oldrect is not None:
+            if rect is None:
+                rect = oldrect
+            else:
+                rect = rect.Union(oldrect)
+        if rect is not None:
+            self.RefreshRect(rect, eraseBackground=False)
+
     def updateDynamicBox(self, bbox, erase=False):
         "common dynamic update of zoom box or profile line"
-        zdc = wx.ClientDC(self)
-        zdc.SetLogicalFunction(wx.XOR)
-        zdc.SetBrush(wx.TRANSPARENT_BRUSH)
-        zdc.SetPen(wx.Pen('White', 2, wx.SOLID))
-        zdc.ResetBoundingBox()
-        zdc.BeginDrawing()
+        oldrect = self.getOverlayRect()
+        if erase:
+            bbox = None
         if self.cursor_mode == 'profile':
-            if self.prof_line is not None:
-                zdc.DrawLine(*self.prof_line)
-            if not erase:
-                self.prof_line = bbox
-                zdc.DrawLine(*self.prof_line)
-        elif self.cursor_mode == 'zoom':
+            self.prof_line = bbox
+        elif self.cursor_mode in ('zoom', 'roi'):
+            self.zoom_box = bbox
+        self.refreshOverlay(oldrect)
+
+    def clearDynamicBox(self):
+        "remove zoom box and profile line"
+        oldrect = self.getOverlayRect()
+        self.zoom_box = None
+        self.prof_line = None
+        self.refreshOverlay(oldrect)
+
+    def drawOverlays(self, dc):
+        "draw zoom box and profile line on top of the image"
+        if self.zoom_box is None and self.prof_line is None:
+            return
+        dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        for pen in (wx.Pen('Black', 3, wx.SOLID), wx.Pen('White', 1, wx.SOLID)):
+            dc.SetPen(pen)
             if self.zoom_box is not None:
-                zdc.DrawRectangle(*self.zoom_box)
-            if not erase:
-                self.zoom_box = bbox
-                zdc.DrawRectangle(*self.zoom_box)
-        zdc.EndDrawing()
+                dc.DrawRectangle(*self.zoom_box)
+            if self.prof_line is not None:
+                dc.DrawLine(*self.prof_line)
 
     def SetValue(self, image):
+        "set new image, invalidating the cached bitmap"
         self.image = image
+        self.bmp = None
         self.Refresh()
 
     def OnSize(self, event):
         if self.can_resize:
-            self.DrawImage(size=event.GetSize())
-            self.Refresh()
+            if hasattr(self.onresize, '__call__'):
+                # image is rendered for the window size: re-render it
+                self.onresize(size=event.GetSize())
+            else:
+                self.DrawImage(size=event.GetSize())
+                self.Refresh()
         event.Skip()
 
     def DrawImage(self, event=None, isize=None, size=None):
+        "paint cached bitmap, re-making it only for a new image or size"
         if event is None: 
             return
         if not hasattr(self, 'image') or self.image is None:
@@ -153,16 +184,27 @@ class ImageView(wx.Window):
             w_win, h_win = size
         except:
             return
-
+        if self.bmp is None or self.win_size != (w_win, h_win):
+            if not self.make_bitmap(w_win, h_win, isize=isize):
+                return
+
+        # overlays are drawn over the cached bitmap, so moving them
+        # only needs a repaint of the dirty region, not a new bitmap
+        dc = wx.BufferedPaintDC(self)
+        dc.DrawBitmap(self.bmp, 0, 0)
+        self.drawOverlays(dc)
+
+    def make_bitmap(self, w_win, h_win, isize=None):
+        """make window-sized bitmap of image, scaled to fit and centered.
+        Flips and rotations are already applied to the image."""
         img = self.image
-
         if isize is not None:
             w_img, h_img = isize
         elif img.IsOk():
             w_img = img.GetWidth()
             h_img = img.GetHeight()
         else:
-            return
+            return False
 
         xscale = float(w_win) / w_img
         yscale = float(h_win) / h_img
@@ -173,24 +215,20 @@ class ImageView(wx.Window):
 
         w_scaled = int(scale * w_img)
         h_scaled = int(scale * h_img)
-        w_pad    = (w_win - w_scaled)/2
-        h_pad    = (h_win - h_scaled)/2
+        # image already rendered at window size: do not rescale
+        if abs(w_scaled - w_img) <= 1 and abs(h_scaled - h_img) <= 1:
+            w_scaled, h_scaled = w_img, h_img
+        w_pad    = int((w_win - w_scaled)/2)
+        h_pad    = int((h_win - h_scaled)/2)
         self.img_size = w_scaled, h_scaled
         self.win_size = w_win, h_win
-        if self.flipv:
-            img = img.Mirror(False)
-        if self.fliph:
-            img = img.Mirror(True)
-        if self.rot90 != 0:
-            for i in range(self.rot90):
-                img = img.Rotate90(True)
 
         if w_scaled != w_img or h_scaled!=h_img:
             img = img.Scale(w_scaled, h_scaled)
-        #dc = wx.PaintDC(self)
-        #dc.DrawBitmap(wx.BitmapFromImage(img), w_pad, h_pad, useMask=True)
-        dc = wx.BufferedPaintDC(self, wx.BitmapFromImage(img))
-        if self.zoom_box is not None:
-            self.updateDynamicBox(self.zoom_box, erase=True)
-        elif self.prof_line is not None:
-            self.updateDynamicBox(self.prof_line, erase=True)
+        self.bmp = wx.EmptyBitmap(w_win, h_win)
+        mdc = wx.MemoryDC(self.bmp)
+        mdc.SetBackground(wx.Brush(self.GetBackgroundColour()))
+        mdc.Clear()
+        mdc.DrawBitmap(wx.BitmapFromImage(img), w_pad, h_pad)
+        mdc.SelectObject(wx.NullBitmap)
+        return True
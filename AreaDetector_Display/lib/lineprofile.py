@@ -0,0 +1,69 @@
+"""
+Line profiles of AreaDetector frames
+"""
+import numpy as np
+
+PROFILE_MODES = ('nearest', 'bilinear')
+
+def line_coords(x0, y0, x1, y1, width=1):
+    """return (xcoords, ycoords) of shape (width, npts) for points along
+    the line from (x0, y0) to (x1, y1), one point per pixel along the
+    line, with width parallel lines spaced by one pixel perpendicular
+    to the line, centered on it."""
+    dx, dy = float(x1 - x0), float(y1 - y0)
+    length = max(abs(dx), abs(dy))
+    npts = int(length) + 1
+    frac = np.linspace(0, 1, npts)
+    xs = x0 + dx*frac
+    ys = y0 + dy*frac
+    width = max(1, int(width))
+    offsets = (np.arange(width) - (width-1)/2.0)[:, np.newaxis]
+    norm = np.sqrt(dx*dx + dy*dy)
+    if norm > 0:
+        xs = xs - offsets*dy/norm
+        ys = ys + offsets*dx/norm
+    else:
+        xs = np.tile(xs, (width, 1))
+        ys = np.tile(ys, (width, 1))
+    return xs, ys
+
+def sample_nearest(frame, xs, ys):
+    "sample 2d or 3d frame at nearest pixels to coordinates xs, ys"
+    ix = np.clip(np.rint(xs), 0, frame.shape[1]-1).astype(int)
+    iy = np.clip(np.rint(ys), 0, frame.shape[0]-1).astype(int)
+    return frame[iy, ix].astype('f8')
+
+def sample_bilinear(frame, xs, ys):
+    "sample 2d or 3d frame at coordinates xs, ys with bilinear interpolation"
+    nrow, ncol = frame.shape[0], frame.shape[1]
+    xs = np.clip(xs, 0, ncol-1)
+    ys = np.clip(ys, 0, nrow-1)
+    ix = np.clip(np.floor(xs).astype(int), 0, max(0, ncol-2))
+    iy = np.clip(np.floor(ys).astype(int), 0, max(0, nrow-2))
+    ix1 = np.minimum(ix+1, ncol-1)
+    iy1 = np.minimum(iy+1, nrow-1)
+    fx = xs - ix
+    fy = ys - iy
+    if frame.ndim == 3:
+        fx = fx[..., np.newaxis]
+        fy = fy[..., np.newaxis]
+    return ((1-fy)*((1-fx)*frame[iy, ix]  + fx*frame[iy, ix1]) +
+            fy    *((1-fx)*frame[iy1, ix] + fx*frame[iy1, ix1]))
+
+def line_profile(frame, x0, y0, x1, y1, width=1, mode='nearest'):
+    """return line profile of a 2d mono or 3d (rows, cols, 3) RGB frame
+    from pixel (x0, y0) to (x1, y1), averaging width pixels
+    perpendicular to the line.
+
+    returns (xpix, ypix, values), where xpix and ypix are the pixel
+    coordinates along the center of the line, and values has shape
+    (npts,) for mono or (npts, 3) for RGB frames.
+    """
+    xs, ys = line_coords(x0, y0, x1, y1, width=width)
+    if mode == 'bilinear':
+        vals = sample_bilinear(frame, xs, ys)
+    else:
+        vals = sample_nearest(frame, xs, ys)
+    xpix = xs.mean(axis=0)
+    ypix = ys.mean(axis=0)
+    return xpix, ypix, vals.mean(axis=0)
@@ -0,0 +1,216 @@
+"""
+Recording AreaDetector frames to disk, and replaying recordings
+
+A recording is an append-only binary file: a fixed-size text header
+giving the frame layout, followed by fixed-size records of
+   uid        int64    UniqueId_RBV of frame
+   timestamp  float64  time frame was fetched
+   data       dtype    frame data, flat
+
+so that a recording can be opened as a numpy memmap of records.  If
+the frame size, dtype or color mode changes during a recording, a new
+segment file is started (name_002.adr, name_003.adr, ...).
+"""
+import os
+import time
+import threading
+import Queue
+import numpy as np
+import wx
+
+from framefetch import Frame, FrameSource
+
+MAGIC = '# AD_Display Recording 1.0'
+HEADER_SIZE = 512
+
+def record_dtype(dtype, count):
+    "numpy dtype for one record of a recording"
+    return np.dtype([('uid', '<i8'), ('timestamp', '<f8'),
+                     ('data', np.dtype(dtype), (count,))])
+
+def make_header(arrsize, colormode, dtype, count):
+    "return header text for a recording, padded to HEADER_SIZE"
+    lines = [MAGIC,
+             'arrsize = %i %i %i' % tuple(arrsize),
+             'colormode = %i' % colormode,
+             'dtype = %s' % np.dtype(dtype).str,
+             'count = %i' % count,
+             'created = %.3f' % time.time(),
+             '']
+    out = '\n'.join(lines)
+    return out + ' '*(HEADER_SIZE - len(out))
+
+def read_header(fname):
+    "read header of a recording, returning dict"
+    fh = open(fname, 'rb')
+    text = fh.read(HEADER_SIZE)
+    fh.close()
+    lines = text.strip().split('\n')
+    if lines[0] != MAGIC:
+        raise ValueError("'%s' is not an AD_Display recording" % fname)
+    out = {}
+    for line in lines[1:]:
+        key, val = [w.strip() for w in line.split('=', 1)]
+        out[key] = val
+    out['arrsize'] = [int(w) for w in out['arrsize'].split()]
+    out['colormode'] = int(out['colormode'])
+    out['count'] = int(out['count'])
+    out['dtype'] = np.dtype(out['dtype'])
+    return out
+
+def segment_name(fname, segment):
+    "file name for segment number (1, 2, ...) of a recording"
+    if segment < 2:
+        return fname
+    base, ext = os.path.splitext(fname)
+    return '%s_%3.3i%s' % (base, segment, ext)
+
+class FrameRecorder(threading.Thread):
+    """write frames to a recording in a background thread.
+
+    add(frame) copies the frame and queues it, and never blocks: if the
+    writer falls more than maxqueue frames behind, frames are dropped
+    and counted in n_dropped.  Queued frames are written in batches.
+    """
+    def __init__(self, fname, maxqueue=64):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fname = fname
+        self.queue = Queue.Queue(maxsize=maxqueue)
+        self.running = True
+        self.segment = 0
+        self.layout = None
+        self.fh = None
+        self.n_written = 0
+        self.n_dropped = 0
+        self.nbytes = 0
+
+    def add(self, frame):
+        "queue a copy of frame for writing"
+        try:
+            self.queue.put_nowait(Frame(data=frame.data.copy(),
+                                        arrsize=frame.arrsize,
+                                        colormode=frame.colormode,
+                                        uid=frame.uid,
+                                        timestamp=frame.timestamp))
+        except Queue.Full:
+            self.n_dropped += 1
+
+    def stop(self):
+        "finish writing queued frames and close the recording"
+        self.running = False
+
+    def run(self):
+        while self.running or not self.queue.empty():
+            try:
+                frames = [self.queue.get(timeout=0.25)]
+            except Queue.Empty:
+                continue
+            while True:
+                try:
+                    frames.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            self.write(frames)
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def write(self, frames):
+        "write a batch of frames"
+        for frame in frames:
+            data = frame.data.ravel()
+            layout = (tuple(frame.arrsize), frame.colormode,
+                      data.dtype.str, data.size)
+            if layout != self.layout:
+                self.open_segment(layout)
+            np.array([frame.uid], dtype='<i8').tofile(self.fh)
+            np.array([frame.timestamp], dtype='<f8').tofile(self.fh)
+            data.tofile(self.fh)
+            self.n_written += 1
+            self.nbytes += self.rec_dtype.itemsize
+        self.fh.flush()
+
+    def open_segment(self, layout):
+        "start a new segment file for a new frame layout"
+        if self.fh is not None:
+            self.fh.close()
+        self.segment += 1
+        self.layout = layout
+        arrsize, colormode, dtype, count = layout
+        self.rec_dtype = record_dtype(dtype, count)
+        self.fh = open(segment_name(self.fname, self.segment), 'wb')
+        self.fh.write(make_header(arrsize, colormode, dtype, count))
+
+class RecordingReader(object):
+    """read a recording (one segment file) as a numpy memmap of records.
+    Frames are returned as views of the memmap, without copying."""
+    def __init__(self, fname):
+        self.fname = fname
+        self.header = read_header(fname)
+        self.rec_dtype = record_dtype(self.header['dtype'],
+                                      self.header['count'])
+        nbytes = os.stat(fname).st_size - HEADER_SIZE
+        self.nframes = max(0, nbytes // self.rec_dtype.itemsize)
+        self.records = None
+        if self.nframes > 0:
+            self.records = np.memmap(fname, dtype=self.rec_dtype, mode='r',
+                                     offset=HEADER_SIZE,
+                                     shape=(self.nframes,))
+
+    def __len__(self):
+        return self.nframes
+
+    def get_frame(self, i):
+        "return Frame for record i"
+        rec = self.records[i]
+        return Frame(data=rec['data'], arrsize=self.header['arrsize'],
+                     colormode=self.header['colormode'],
+                     uid=int(rec['uid']), timestamp=float(rec['timestamp']))
+
+class ReplayPlayer(FrameSource):
+    """frame source replaying a recording at speed times the recorded
+    frame rate (or as fast as frames are shown for speed <= 0).  As for
+    other FrameSources, onframe() is called with wx.CallAfter and should
+    get the frame with ring.take().  ondone(player), with this player,
+    is called (with wx.CallAfter) at the end of the replay.  Frames keep
+    their recorded timestamp, with the time replayed in replay_time."""
+    def __init__(self, reader, onframe, ondone=None, speed=1.0, loop=False):
+        FrameSource.__init__(self, onframe)
+        self.reader = reader
+        self.ondone = ondone
+        self.speed = speed
+        self.loop = loop
+
+    def run(self):
+        reader = self.reader
+        while self.running and len(reader) > 0:
+            t0 = time.time()
+            ts0 = float(reader.records[0]['timestamp'])
+            for i in range(len(reader)):
+                if not self.running:
+                    break
+                frame = reader.get_frame(i)
+                if self.speed > 0:
+                    wait = t0 + (frame.timestamp - ts0)/self.speed - time.time()
+                    if wait > 0:
+                        time.sleep(wait)
+                else:
+                    while self.running and self.ring.latest is not None:
+                        time.sleep(0.002)
+                t1 = time.time()
+                slot, buff = self.ring.get_buffer(frame.data.size,
+                                                  frame.data.dtype)
+                buff[:] = frame.data
+                frame.data = buff
+                frame.replay_time = time.time()
+                frame.fetch_time = frame.replay_time - t1
+                self.n_fetched += 1
+                self.fetch_time += frame.fetch_time
+                if self.ring.publish(slot, frame):
+                    wx.CallAfter(self.onframe)
+            if not self.loop:
+                break
+        self.running = False
+        if self.ondone is not None:
+            wx.CallAfter(self.ondone, self)
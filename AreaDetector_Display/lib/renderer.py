@@ -0,0 +1,155 @@
+"""
+Frame rendering for the AreaDetector Display:
+converts raw detector arrays to an RGB display buffer with numpy.
+"""
+import numpy as np
+from debugtime import stagetimer
+from colormap import DisplayMap
+
+DECIMATIONS = ('stride', 'bin')
+
+def fit_size(im_size, win_size, scale=1.0):
+    """return display (width, height) for an image of im_size fit
+    inside a window of win_size, keeping the aspect ratio.  If the
+    window size is not yet known, the image size times scale is used."""
+    w_img, h_img = im_size
+    w_win, h_win = win_size
+    if w_win < 2 or h_win < 2:
+        return (max(1, int(w_img*scale)), max(1, int(h_img*scale)))
+    fscale = min(float(w_win) / w_img, float(h_win) / h_img)
+    return (max(1, int(fscale*w_img)), max(1, int(fscale*h_img)))
+
+def get_orientation(flipv=False, fliph=False, rot90=0):
+    """reduce flip up/down, then flip left/right, then rot90 clockwise
+    quarter turns to a single (transpose, flip_rows, flip_cols) tuple"""
+    transpose, frows, fcols = False, bool(flipv), bool(fliph)
+    for i in range(rot90 % 4):
+        # A[::r, ::c] rotated clockwise is A.T[::c, ::-r]
+        transpose, frows, fcols = not transpose, fcols, not frows
+    return (transpose, frows, fcols)
+
+def orient_frame(frame, orientation):
+    "return oriented view (no copy) of 2d or 3d frame"
+    transpose, frows, fcols = orientation
+    if transpose:
+        frame = frame.swapaxes(0, 1)
+    if frows or fcols:
+        frame = frame[::(-1 if frows else 1), ::(-1 if fcols else 1)]
+    return frame
+
+def oriented_size(im_size, orientation):
+    "return (width, height) of image after orientation"
+    if orientation[0]:
+        return (im_size[1], im_size[0])
+    return tuple(im_size)
+
+class FrameRenderer(object):
+    """convert raw AreaDetector frames to an RGB display buffer
+
+    A single (height, width, 3) uint8 buffer is kept for the current
+    display size and is re-written in place for each new frame, so that
+    it can be shared with a wx.Image (wx.ImageFromBuffer) without any
+    intermediate PIL images or string copies.
+
+    Frames are decimated to the display size before anything else is
+    done with them, either by taking strided pixels ('stride') or by
+    averaging blocks of pixels ('bin'), so that the cost per frame
+    scales with the display size, not the detector size.
+
+    Flips and rotations (self.orientation, see get_orientation) are
+    applied as a single numpy view of the frame, before decimation.
+
+    Intensities are mapped to RGB with a DisplayMap (self.dmap), with
+    autoscale limits taken from the full frame before it is scaled.
+
+    Stage times for each frame are accumulated in self.timer, a
+    stagetimer.  The caller is expected to call self.timer.start()
+    before render() and self.timer.finish() when done with the frame.
+    """
+    def __init__(self):
+        self.rgb = None
+        self.dsize = None
+        self.index = None
+        self.binbuff = None
+        self.decimation = 'stride'
+        self.orientation = (False, False, False)
+        self.dmap = DisplayMap()
+        self.timer = stagetimer()
+
+    def get_buffer(self, dsize):
+        """return RGB buffer for display size (width, height),
+        allocating a new buffer only when the size changes"""
+        if self.rgb is None or self.dsize != dsize:
+            self.rgb = np.zeros((dsize[1], dsize[0], 3), dtype=np.uint8)
+            self.dsize = dsize
+        return self.rgb
+
+    def get_index(self, shape, dsize):
+        """return (rows, cols) index arrays mapping display pixels to
+        frame pixels, cached for the last (frame shape, display size)"""
+        key = (shape[0], shape[1], dsize)
+        if self.index is None or self.index[0] != key:
+            rows = (np.arange(dsize[1]) * shape[0]) // dsize[1]
+            cols = (np.arange(dsize[0]) * shape[1]) // dsize[0]
+            self.index = (key, rows[:, np.newaxis], cols)
+        return self.index[1], self.index[2]
+
+    def bin_frame(self, frame, factor):
+        """return block-mean of frame over factor x factor pixel blocks,
+        summing strided views into a re-used float32 accumulator so that
+        no frame-sized temporary is made.  Result has dtype of frame."""
+        nrow, ncol = frame.shape[0]//factor, frame.shape[1]//factor
+        shape = (nrow, ncol) + frame.shape[2:]
+        if self.binbuff is None or self.binbuff.shape != shape:
+            self.binbuff = np.empty(shape, dtype=np.float32)
+        acc = self.binbuff
+        acc[:] = 0
+        rlim, clim = nrow*factor, ncol*factor
+        for i in range(factor):
+            for j in range(factor):
+                acc += frame[i:rlim:factor, j:clim:factor]
+        acc *= 1.0/(factor*factor)
+        if frame.dtype.kind in 'iu':
+            return acc.astype(frame.dtype)
+        return acc
+
+    def decimate(self, frame, dsize):
+        "return frame decimated (or expanded) to display size (width, height)"
+        height, width = frame.shape[:2]
+        if (width, height) == tuple(dsize):
+            return frame
+        if self.decimation == 'bin':
+            factor = min(height // dsize[1], width // dsize[0])
+            if factor > 1:
+                frame = self.bin_frame(frame, factor)
+                if frame.shape[:2] == (dsize[1], dsize[0]):
+                    return frame
+        rows, cols = self.get_index(frame.shape, dsize)
+        return frame[rows, cols]
+
+    def render(self, data, im_size, colormode, dsize):
+        """render frame into the RGB display buffer, returning the buffer
+
+        data       array of frame data (flat, as read from ArrayData, or 2d/3d)
+        im_size    (width, height) of frame
+        colormode  AreaDetector ColorMode (2 for RGB1, others as mono)
+        dsize      (width, height) of displayed image, after orientation
+        """
+        width, height = im_size
+        if colormode == 2:
+            frame = data.reshape((height, width, 3))
+        else:
+            frame = data.reshape((height, width))
+        frame = orient_frame(frame, self.orientation)
+        rgb = self.get_buffer(dsize)
+        self.timer.add('shape and orient frame')
+
+        limits = self.dmap.get_limits(frame)
+        self.timer.add('autoscale')
+
+        frame = self.decimate(frame, dsize)
+        self.timer.add('decimate')
+
+        self.dmap.apply(frame, rgb, limits=limits)
+        self.timer.add('color lookup')
+        return rgb
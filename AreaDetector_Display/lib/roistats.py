@@ -0,0 +1,120 @@
+"""
+Live statistics for regions of interest of AreaDetector frames
+"""
+import time
+import numpy as np
+
+STAT_NAMES = ('sum', 'mean', 'max', 'cen_x', 'cen_y', 'sig_x', 'sig_y')
+
+def roi_stats(frame):
+    """return (sum, mean, max, cen_x, cen_y, sig_x, sig_y) for a 2d frame
+    or 3d (rows, cols, 3) RGB frame, for which intensity is the sum of
+    the color channels.  Centroid and sigma are in pixels of frame."""
+    if frame.ndim == 3:
+        frame = frame.sum(axis=2, dtype='f8')
+    if frame.size == 0:
+        return (np.nan,)*len(STAT_NAMES)
+    xproj = frame.sum(axis=0, dtype='f8')
+    yproj = frame.sum(axis=1, dtype='f8')
+    total = xproj.sum()
+    fmax = float(frame.max())
+    if total == 0:
+        return (0.0, 0.0, fmax) + (np.nan,)*4
+    xpix = np.arange(len(xproj))
+    ypix = np.arange(len(yproj))
+    xcen = (xproj*xpix).sum() / total
+    ycen = (yproj*ypix).sum() / total
+    xsig = np.sqrt(abs((xproj*(xpix-xcen)**2).sum() / total))
+    ysig = np.sqrt(abs((yproj*(ypix-ycen)**2).sum() / total))
+    return (total, total/frame.size, fmax, xcen, ycen, xsig, ysig)
+
+class ROIStats(object):
+    """statistics for several rectangular ROIs, kept in ring buffers
+    of npts frames.  ROIs are given in pixels of the full frame, and
+    centroids are reported in pixels of the full frame.
+    """
+    def __init__(self, npts=4096):
+        self.npts = npts
+        self.clear()
+
+    def clear(self):
+        "remove all ROIs and stored statistics"
+        self.rois = []
+        self.times = np.zeros(self.npts)
+        self.data = []
+        self.index = 0
+        self.count = 0
+
+    def add_roi(self, x0, y0, x1, y1, name=None):
+        "add ROI from (x0, y0) to (x1, y1) pixels, excluding (x1, y1)"
+        if name is None:
+            name = 'ROI%i' % (len(self.rois)+1)
+        x0, x1 = int(min(x0, x1)), int(max(x0, x1))
+        y0, y1 = int(min(y0, y1)), int(max(y0, y1))
+        self.rois.append((name, x0, y0, max(x1, x0+1), max(y1, y0+1)))
+        self.data.append(np.nan*np.ones((self.npts, len(STAT_NAMES))))
+        return name
+
+    def update(self, frame, timestamp=None):
+        "compute statistics of all ROIs for a 2d or 3d frame"
+        if len(self.rois) < 1:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        i = self.index
+        self.times[i] = timestamp
+        for (name, x0, y0, x1, y1), data in zip(self.rois, self.data):
+            x0c, y0c = max(0, x0), max(0, y0)
+            stats = list(roi_stats(frame[y0c:y1, x0c:x1]))
+            stats[3] += x0c
+            stats[4] += y0c
+            data[i, :] = stats
+        self.index = (i + 1) % self.npts
+        self.count = min(self.count + 1, self.npts)
+
+    def _order(self):
+        "indices of stored points, oldest first"
+        if self.count < self.npts:
+            return slice(0, self.count)
+        return np.roll(np.arange(self.npts), -self.index)
+
+    def get_latest(self, iroi):
+        "return dict of most recent statistics for ROI number iroi"
+        if self.count < 1:
+            return None
+        return dict(zip(STAT_NAMES, self.data[iroi][self.index-1]))
+
+    def get_series(self, iroi, stat='sum'):
+        "return (times, values) arrays for one statistic of ROI number iroi"
+        order = self._order()
+        col = STAT_NAMES.index(stat)
+        return self.times[order], self.data[iroi][order, col]
+
+    def as_arrays(self):
+        """return (times, data, labels) with data of shape
+        (npts, nrois*nstats) and a label for each column of data"""
+        order = self._order()
+        labels = []
+        for name, x0, y0, x1, y1 in self.rois:
+            labels.extend(['%s_%s' % (name, s) for s in STAT_NAMES])
+        if len(self.rois) < 1:
+            return self.times[order], np.zeros((self.count, 0)), labels
+        data = np.concatenate([d[order] for d in self.data], axis=1)
+        return self.times[order], data, labels
+
+    def save(self, fname):
+        "save statistics as columns of text"
+        times, data, labels = self.as_arrays()
+        header = ['# Epics AreaDetector ROI Statistics',
+                  '# Saved: %s' % time.ctime()]
+        for name, x0, y0, x1, y1 in self.rois:
+            header.append('# %s: x = [%i, %i), y = [%i, %i)' %
+                          (name, x0, x1, y0, y1))
+        header.append('#------------------------------')
+        header.append('#  timestamp  ' + '  '.join(labels))
+        fout = open(fname, 'w')
+        fout.write('\n'.join(header))
+        fout.write('\n')
+        fmt = ['%.3f'] + ['%.6g']*data.shape[1]
+        np.savetxt(fout, np.column_stack((times, data)), fmt=fmt)
+        fout.close()
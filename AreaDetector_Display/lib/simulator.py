@@ -0,0 +1,152 @@
+"""
+Simulated AreaDetector frames, for running, testing and benchmarking
+the AreaDetector Display without a camera or IOC
+"""
+import time
+import threading
+import numpy as np
+
+from framefetch import Frame, FrameSource
+
+SIM_DTYPES = ('uint8', 'uint16', 'uint32', 'int16', 'float32')
+SIM_COLORMODES = {'Mono': 0, 'RGB': 2}
+
+def full_scale(dtype):
+    "return typical full-scale intensity for simulated frames of dtype"
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        return min(0.8*np.iinfo(dtype).max, 1.e6)
+    return 1.e4
+
+class FrameSimulator(object):
+    """generate synthetic detector frames: a fixed noisy background
+    with a gaussian spot moving around a circle, one turn every
+    period frames.  For colormode 2 (RGB1), frames have shape
+    (height, width, 3), otherwise (height, width).
+
+    The background and spot are computed once, so that making a frame
+    costs about as much as copying one frame.
+    """
+    def __init__(self, width=1024, height=1024, dtype='uint16', colormode=0,
+                 period=200, seed=0):
+        self.width = int(width)
+        self.height = int(height)
+        self.dtype = np.dtype(dtype)
+        self.colormode = colormode
+        self.period = period
+        if colormode == 2:
+            self.shape = (self.height, self.width, 3)
+            self.arrsize = [3, self.width, self.height]
+        else:
+            self.shape = (self.height, self.width)
+            self.arrsize = [self.width, self.height, 0]
+        self.count = int(np.prod(self.shape))
+
+        scale = full_scale(self.dtype)
+        rng = np.random.RandomState(seed)
+        yy, xx = np.mgrid[0:self.height, 0:self.width]
+        bgnd = 0.05*scale*(1 + (xx + yy)/float(self.width + self.height))
+        if colormode == 2:
+            bgnd = bgnd[..., np.newaxis] * np.array([1.0, 0.8, 0.6])
+        bgnd = bgnd + 0.02*scale*rng.random_sample(self.shape)
+        self.background = bgnd.astype(self.dtype)
+
+        size = max(3, min(self.width, self.height)//8)
+        pix = np.arange(size) - (size-1)/2.0
+        spot = np.exp(-(pix[:, np.newaxis]**2 + pix**2)/(0.08*size*size))
+        if colormode == 2:
+            spot = spot[..., np.newaxis] * np.array([0.6, 0.8, 1.0])
+        self.spot = (0.75*scale*spot).astype(self.dtype)
+
+    def spot_position(self, uid):
+        "return (x, y) of upper left corner of spot for frame uid"
+        size = self.spot.shape[0]
+        phase = 2*np.pi*(uid % self.period)/float(self.period)
+        x = int((0.5 + 0.4*np.cos(phase)) * max(0, self.width - size))
+        y = int((0.5 + 0.4*np.sin(phase)) * max(0, self.height - size))
+        return x, y
+
+    def fill(self, out, uid):
+        "fill out (flat array of self.count values) with frame number uid"
+        frame = out.reshape(self.shape)
+        frame[:] = self.background
+        x, y = self.spot_position(uid)
+        size = self.spot.shape[0]
+        region = frame[y:y+size, x:x+size]
+        region += self.spot[:region.shape[0], :region.shape[1]]
+        return out
+
+    def make_frame(self, uid=1):
+        "return a new Frame for frame number uid"
+        data = self.fill(np.empty(self.count, dtype=self.dtype), uid)
+        return Frame(data=data, arrsize=self.arrsize,
+                     colormode=self.colormode, uid=uid)
+
+class SimulatedSource(FrameSource):
+    """frame source with simulated frames, standing in for a camera.
+
+    A second thread acts as the detector, making a new frame (advancing
+    uid) rate times per second while acquiring is True, and calling
+    onnew() as for the ArrayCounter_RBV callback of a camera (or
+    trigger() if onnew is None).  For rate <= 0, a new frame is made as
+    soon as the previous one has been taken.  As for a camera, frames
+    made but never fetched are counted as skipped.
+    """
+    def __init__(self, onframe, width=1024, height=1024, dtype='uint16',
+                 colormode=0, rate=10.0, onnew=None, nbuffers=3, pool=None):
+        FrameSource.__init__(self, onframe, nbuffers=nbuffers, pool=pool)
+        self.sim = FrameSimulator(width=width, height=height, dtype=dtype,
+                                  colormode=colormode)
+        self.rate = rate
+        self.onnew = onnew
+        self.acquiring = True
+        self.uid = 0
+        self.last_uid = 0
+        self.detector = threading.Thread(target=self.run_detector)
+        self.detector.daemon = True
+
+    def start(self):
+        FrameSource.start(self)
+        self.detector.start()
+
+    def run_detector(self):
+        t0, nframes = time.time(), 0
+        while self.running:
+            if self.rate > 0:
+                wait = t0 + nframes/float(self.rate) - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+            else:
+                while self.running and (self.ring.latest is not None or
+                                        self.uid > self.last_uid):
+                    time.sleep(0.001)
+            nframes += 1
+            if not self.acquiring:
+                t0, nframes = time.time(), 0
+                time.sleep(0.05)
+                continue
+            self.uid += 1
+            if self.onnew is not None:
+                self.onnew()
+            else:
+                self.trigger()
+
+    def fetch(self):
+        """make the current frame in a ring buffer,
+        returning (slot, frame) or None if there is no new frame"""
+        uid = self.uid
+        if uid == self.last_uid:
+            return None
+        sim = self.sim
+        t0 = time.time()
+        slot, buff = self.ring.get_buffer(sim.count, sim.dtype)
+        sim.fill(buff, uid)
+        fetch_time = time.time() - t0
+        if uid > self.last_uid + 1:
+            self.n_skipped += uid - self.last_uid - 1
+        self.last_uid = uid
+        self.n_fetched += 1
+        self.fetch_time += fetch_time
+        return slot, Frame(data=buff, arrsize=sim.arrsize,
+                           colormode=sim.colormode, uid=uid,
+                           fetch_time=fetch_time)
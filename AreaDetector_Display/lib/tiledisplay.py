@@ -0,0 +1,229 @@
+"""
+Tiled display of several Epics AreaDetector cameras
+"""
+import time
+import math
+import wx
+import epics
+from epics.wx import EpicsFunction
+from epics.wx.utils import add_menu
+
+from imageview import ImageView
+from renderer import FrameRenderer, fit_size
+from governor import FrameGovernor
+from framefetch import FrameFetcher, FetchPool, IMG_ATTRS
+from simulator import SimulatedSource
+
+class CameraTile(wx.Panel):
+    """one camera of a tiled display: name, image and frame rate.
+
+    prefix is the AreaDetector prefix of the camera, or a dict of
+    options for a simulator.SimulatedSource.  Frames are fetched by the
+    shared FetchPool, and each tile has its own FrameGovernor, so that
+    the display rate of each camera adapts to its own costs.
+    """
+    def __init__(self, parent, name, prefix, pool, target_fps=10.0,
+                 max_load=0.25, size=(400, 300), onselect=None, **kws):
+        wx.Panel.__init__(self, parent, -1, **kws)
+        self.name = name
+        self.prefix = prefix
+        self.pool = pool
+        self.onselect = onselect
+        self.source = None
+        self.ad_img = None
+        self.renderer = FrameRenderer()
+        self.governor = FrameGovernor(target_fps=target_fps, max_load=max_load)
+        self.wximage = wx.EmptyImage(1, 1)
+        self.wxbuffer = None
+        self.reset_counters()
+
+        self.label = wx.StaticText(self, -1, name, size=(200, -1))
+        self.stats = wx.StaticText(self, -1, '', size=(200, -1),
+                                   style=wx.ALIGN_RIGHT)
+        self.image = ImageView(self, size=size, onresize=self.onResize)
+        self.image.cursor_mode = 'show'
+        self.image.Bind(wx.EVT_LEFT_DCLICK, self.onDoubleClick)
+
+        tsizer = wx.BoxSizer(wx.HORIZONTAL)
+        tsizer.Add(self.label, 1, wx.ALIGN_LEFT|wx.ALL, 2)
+        tsizer.Add(self.stats, 1, wx.ALIGN_RIGHT|wx.ALL, 2)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(tsizer, 0, wx.EXPAND, 0)
+        sizer.Add(self.image, 1, wx.EXPAND, 0)
+        self.SetSizer(sizer)
+
+    def reset_counters(self):
+        self.n_drawn = 0
+        self.starttime = time.time()
+        self.last_stats = 0.0
+        self.frame = None
+
+    @EpicsFunction
+    def connect(self):
+        "connect to camera (or start simulator), fetching with the pool"
+        if isinstance(self.prefix, dict):
+            self.source = SimulatedSource(self.onFrameReady, pool=self.pool,
+                                          onnew=self.onNewImage, **self.prefix)
+        else:
+            prefix = self.prefix
+            for suffix in (':', ':image1', ':cam1'):
+                if prefix.endswith(suffix):
+                    prefix = prefix[:-len(suffix)]
+            self.prefix = prefix
+            self.ad_img = epics.Device(prefix + ':image1:', delim='',
+                                       attrs=IMG_ATTRS)
+            epics.caput("%s:cam1:ArrayCallbacks" % prefix, 1)
+            epics.caput("%s:image1:EnableCallbacks" % prefix, 1)
+            self.source = FrameFetcher(self.ad_img, self.onFrameReady,
+                                       pool=self.pool)
+            self.ad_img.add_callback('ArrayCounter_RBV', self.onNewImage)
+        self.source.governor = self.governor
+        self.reset_counters()
+        self.source.start()
+        self.source.trigger()
+
+    def disconnect(self):
+        if self.source is not None:
+            self.source.stop()
+            self.source = None
+        if self.ad_img is not None:
+            self.ad_img.remove_callbacks('ArrayCounter_RBV')
+            self.ad_img = None
+
+    def onNewImage(self, pvname=None, value=None, **kws):
+        "new image callback: request a fetch (runs in CA thread)"
+        if self.source is not None:
+            self.source.trigger()
+
+    def onFrameReady(self):
+        "pool has a new frame for this tile: show the newest one"
+        if self.source is None:
+            return
+        frame = self.source.ring.take()
+        if frame is not None:
+            self.ShowFrame(frame)
+
+    def onResize(self, size=None):
+        if self.frame is not None:
+            self.ShowFrame(self.frame, count=False)
+
+    def onDoubleClick(self, event=None):
+        if hasattr(self.onselect, '__call__'):
+            self.onselect(self.name, self.prefix)
+
+    def ShowFrame(self, frame, count=True):
+        "render frame into the tile"
+        t0 = time.time()
+        self.frame = frame
+        self.renderer.decimation = self.governor.choose_decimation()
+        d_size = fit_size(frame.im_size, self.image.GetClientSize())
+        self.renderer.timer.start()
+        try:
+            rgb = self.renderer.render(frame.data, frame.im_size,
+                                       frame.colormode, d_size)
+        except ValueError:
+            return
+        if self.wximage.GetSize() != d_size or self.wxbuffer is not rgb:
+            self.wximage = wx.ImageFromBuffer(d_size[0], d_size[1], rgb)
+            self.wxbuffer = rgb
+        self.image.SetValue(self.wximage)
+        if not count:
+            return
+        self.governor.add_render(time.time() - t0, self.renderer.decimation)
+        self.n_drawn += 1
+        now = time.time()
+        if now > self.last_stats + 0.5 and self.source is not None:
+            self.last_stats = now
+            fps = self.n_drawn / max(1.e-3, now - self.starttime)
+            self.stats.SetLabel('%.1f fps, shown %i of %i' %
+                                (fps, self.n_drawn,
+                                 max(self.n_drawn, self.source.n_total)))
+
+class TiledDisplay(wx.Frame):
+    """show several AreaDetector cameras in tiles, all fetched by one
+    small pool of threads.
+
+    cameras is a dict or list of (name, prefix) pairs, as for the
+    known_cameras of AD_Display.  The total CPU load allowed for
+    fetching and rendering (max_load) is split between the tiles, each
+    of which adapts its own display rate, up to target_fps.
+    Double-clicking a tile opens a full AD_Display for that camera.
+    """
+    def __init__(self, cameras, ncols=None, nworkers=2, target_fps=10.0,
+                 max_load=0.5, app=None, tile_size=(400, 300)):
+        self.app = app
+        if isinstance(cameras, dict):
+            cameras = sorted(cameras.items())
+        self.cameras = list(cameras)
+        self.max_load = max_load
+        self.pool = FetchPool(nworkers=nworkers)
+
+        wx.Frame.__init__(self, None, -1, "Epics Area Detector Tiled Display",
+                          style=wx.DEFAULT_FRAME_STYLE)
+        self.SetFont(wx.Font(9, wx.SWISS, wx.NORMAL, wx.BOLD, False))
+        self.Bind(wx.EVT_CLOSE, self.onExit)
+
+        fmenu = wx.Menu()
+        add_menu(self, fmenu, "E&xit\tCtrl+Q", "Exit Program", self.onExit)
+        omenu = wx.Menu()
+        add_menu(self, omenu, "Set Max Rate per Camera ...",
+                 "Set maximum display rate (fps) of each camera", self.onMaxRate)
+        add_menu(self, omenu, "Set Max CPU Load ...",
+                 "Set maximum CPU load (%) for all cameras", self.onMaxLoad)
+        mbar = wx.MenuBar()
+        mbar.Append(fmenu, "&File")
+        mbar.Append(omenu, "&Options")
+        self.SetMenuBar(mbar)
+
+        ntiles = max(1, len(self.cameras))
+        if ncols is None:
+            ncols = int(math.ceil(math.sqrt(ntiles)))
+        nrows = int(math.ceil(ntiles/float(ncols)))
+        panel = wx.Panel(self)
+        sizer = wx.GridSizer(nrows, ncols, 3, 3)
+        self.tiles = []
+        for name, prefix in self.cameras:
+            tile = CameraTile(panel, name, prefix, self.pool,
+                              target_fps=target_fps,
+                              max_load=max_load/ntiles, size=tile_size,
+                              onselect=self.onSelectCamera)
+            self.tiles.append(tile)
+            sizer.Add(tile, 1, wx.EXPAND|wx.ALL, 1)
+        panel.SetSizer(sizer)
+        sizer.Fit(self)
+
+        self.pool.start()
+        for tile in self.tiles:
+            tile.connect()
+
+    def onMaxRate(self, event=None):
+        fps = self.tiles[0].governor.target_fps if self.tiles else 10
+        val = wx.GetNumberFromUser('Maximum display rate for each camera',
+                                   'Frames/sec:', 'Max Rate per Camera',
+                                   int(fps), 1, 100, self)
+        if val > 0:
+            for tile in self.tiles:
+                tile.governor.set(target_fps=val)
+
+    def onMaxLoad(self, event=None):
+        val = wx.GetNumberFromUser('Maximum CPU load for all cameras',
+                                   'Percent:', 'Max CPU Load',
+                                   int(100*self.max_load), 1, 100, self)
+        if val > 0:
+            self.max_load = val/100.0
+            for tile in self.tiles:
+                tile.governor.set(max_load=self.max_load/len(self.tiles))
+
+    def onSelectCamera(self, name, prefix):
+        "open a full display for one camera"
+        if isinstance(prefix, dict):
+            return
+        from ad_display import AD_Display
+        frame = AD_Display(prefix=prefix, app=self.app)
+        frame.Show()
+
+    def onExit(self, event=None):
+        for tile in self.tiles:
+            tile.disconnect()
+        self.pool.stop()
+        self.Destroy()
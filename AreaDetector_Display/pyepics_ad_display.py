@@ -16,8 +16,13 @@ if __name__ == '__main__':
     prefix = None
     if len(sys.argv) > 1:
         prefix = sys.argv[1]
-    
+
+    # use --sim option for a simulated camera
+    simulate = None
+    if '--sim' in sys.argv:
+        prefix, simulate = None, {}
+
     app = wx.App()
-    frame = AD_Display(prefix=prefix, app=app)
+    frame = AD_Display(prefix=prefix, app=app, simulate=simulate)
     frame.Show()
     app.MainLoop()
@@ -1 +1,6 @@
-from stripchart import StripChart
+from logger import PVLogger
+try:
+    from stripchart import StripChart
+except ImportError:
+    # without wx, only the headless PVLogger is available
+    pass
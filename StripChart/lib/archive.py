@@ -0,0 +1,261 @@
+"""
+Persistent archive of Strip Chart PV values
+
+Values for each PV are appended to segment files of fixed-width
+binary records (float64 timestamp and value, little-endian), named
+PVNAME_CRC.NNNNNN.pva in the archive directory, where PVNAME has
+characters not allowed in file names replaced, CRC distinguishes PV
+names that would give the same file name, and NNNNNN counts segments.
+The names of the PVs shown are kept in the file pvlist.txt.
+Recent values are read back with memory mapping, so that only the
+records needed are read.
+
+Only one process may write to an archive directory: a writer holds an
+exclusive lock on its lock file, and other processes (such as a Strip
+Chart showing the PVs of a running pyepics_pvlogger.py) open it
+read-only.
+"""
+import os
+import glob
+import time
+import zlib
+import Queue
+import threading
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from exporter import fix_filename
+
+RECORD_DTYPE = np.dtype([('t', '<f8'), ('y', '<f8')])
+
+ARCHIVE_DIR = os.path.join(os.path.expanduser('~'), '.pvstripchart')
+
+# records per segment file (16 MB), and number of segments kept per PV
+SEGMENT_RECORDS = 1000000
+NSEGMENTS = 20
+
+# seconds of data loaded back for each PV
+RECOVER_TIME = 4*3600.0
+
+LOCK_FILE = 'lock'
+
+def segment_prefix(directory, pvname):
+    "path prefix of segment files for a PV"
+    crc = zlib.crc32(pvname) & 0xffffffff
+    return os.path.join(directory, '%s_%08x' % (fix_filename(pvname), crc))
+
+def list_segments(directory, pvname):
+    "sorted list of segment files for a PV"
+    return sorted(glob.glob('%s.[0-9]*.pva' % segment_prefix(directory, pvname)))
+
+def read_segment(fname):
+    "memory-map records of a segment file, ignoring any partial record"
+    nrec = os.stat(fname).st_size // RECORD_DTYPE.itemsize
+    if nrec < 1:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(fname, dtype=RECORD_DTYPE, mode='r', shape=(nrec,))
+
+def load(directory, pvname, tmin=None):
+    """return (times, values) arrays of archived values of a PV since
+    tmin (all values if None), with the last value before tmin"""
+    chunks = []
+    for fname in reversed(list_segments(directory, pvname)):
+        records = read_segment(fname)
+        if len(records) < 1:
+            continue
+        i0 = 0
+        if tmin is not None:
+            i0 = max(0, np.searchsorted(records['t'], tmin, side='right') - 1)
+        chunks.insert(0, np.array(records[i0:]))
+        if tmin is not None and records['t'][0] <= tmin:
+            break
+    if len(chunks) < 1:
+        return np.zeros(0), np.zeros(0)
+    records = np.concatenate(chunks)
+    return records['t'], records['y']
+
+class Segment(object):
+    "the segment file being written for one PV"
+    def __init__(self, directory, pvname, maxrecords=SEGMENT_RECORDS,
+                 nsegments=NSEGMENTS):
+        self.prefix = segment_prefix(directory, pvname)
+        self.pvname = pvname
+        self.directory = directory
+        self.maxrecords = maxrecords
+        self.nsegments = nsegments
+        self.fh = None
+        self.open()
+
+    def open(self, new=False):
+        "open the last segment (or a new one) for appending"
+        if self.fh is not None:
+            self.fh.close()
+        segments = list_segments(self.directory, self.pvname)
+        iseg = 0
+        if len(segments) > 0:
+            iseg = int(segments[-1].split('.')[-2])
+            if new:
+                iseg += 1
+        fname = '%s.%6.6i.pva' % (self.prefix, iseg)
+        self.fh = open(fname, 'ab')
+        # drop a partial record left by a crash
+        size = os.fstat(self.fh.fileno()).st_size
+        self.nrecords = size // RECORD_DTYPE.itemsize
+        if size % RECORD_DTYPE.itemsize:
+            self.fh.truncate(self.nrecords*RECORD_DTYPE.itemsize)
+        if new:
+            # keep nsegments, including the new one
+            for fname in segments[:max(0, len(segments)+1-self.nsegments)]:
+                os.unlink(fname)
+
+    def write(self, records):
+        "write records, starting new segments at maxrecords records"
+        while len(records) > 0:
+            if self.nrecords >= self.maxrecords:
+                self.open(new=True)
+            nwrite = self.maxrecords - self.nrecords
+            self.fh.write(records[:nwrite].tostring())
+            self.nrecords += len(records[:nwrite])
+            records = records[nwrite:]
+
+    def sync(self):
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+    def close(self):
+        if self.fh is not None:
+            self.sync()
+            self.fh.close()
+            self.fh = None
+
+class PVArchive(threading.Thread):
+    """append PV values to the archive from a separate thread.
+
+    add() queues a value (from any thread), and the values are written
+    in batches, with the files flushed to disk every sync_time seconds.
+
+    Unless readonly, the archive directory is locked (see lock()), and
+    IOError is raised if another process holds the lock.  A readonly
+    archive can be loaded from, but add() and save_pvnames() do nothing.
+    """
+    def __init__(self, directory=ARCHIVE_DIR, sync_time=5.0,
+                 maxrecords=SEGMENT_RECORDS, nsegments=NSEGMENTS,
+                 readonly=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.directory = directory
+        self.sync_time = sync_time
+        self.maxrecords = maxrecords
+        self.nsegments = nsegments
+        self.queue = Queue.Queue()
+        self.segments = {}
+        self.running = False
+        self.n_written = 0
+        self.readonly = readonly
+        self.lockfh = None
+        if not readonly:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.lock()
+
+    def lock(self):
+        """take an exclusive lock on the archive directory, raising
+        IOError if another process holds it"""
+        if fcntl is None:
+            return
+        fh = open(os.path.join(self.directory, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX|fcntl.LOCK_NB)
+        except IOError:
+            fh.close()
+            raise IOError("archive '%s' is in use by another process" %
+                          self.directory)
+        self.lockfh = fh
+
+    def unlock(self):
+        if self.lockfh is not None:
+            self.lockfh.close()
+            self.lockfh = None
+
+    def add(self, pvname, timestamp, value):
+        "queue a value, or arrays of timestamps and values, for writing"
+        if self.readonly:
+            return
+        records = np.zeros(np.size(timestamp), dtype=RECORD_DTYPE)
+        records['t'] = timestamp
+        records['y'] = value
+        self.queue.put((pvname, records))
+
+    def get_pvnames(self):
+        "return list of PV names saved with save_pvnames()"
+        fname = os.path.join(self.directory, 'pvlist.txt')
+        if not os.path.exists(fname):
+            return []
+        fh = open(fname, 'r')
+        pvnames = [line.strip() for line in fh.readlines()]
+        fh.close()
+        return [name for name in pvnames if len(name) > 0]
+
+    def save_pvnames(self, pvnames):
+        "save list of PV names, to be shown on restart"
+        if self.readonly:
+            return
+        fh = open(os.path.join(self.directory, 'pvlist.txt'), 'w')
+        fh.write('%s\n' % '\n'.join(pvnames))
+        fh.close()
+
+    def load(self, pvname, tmin=None):
+        "return (times, values) of archived values since tmin"
+        return load(self.directory, pvname, tmin=tmin)
+
+    def start(self):
+        if self.readonly:
+            return
+        self.running = True
+        threading.Thread.start(self)
+
+    def stop(self):
+        "write all queued values, close files, stop and unlock"
+        self.running = False
+        if self.isAlive():
+            self.join()
+        self.unlock()
+
+    def get_batch(self):
+        "wait for values, returning dict of records for each PV"
+        batch = {}
+        try:
+            item = self.queue.get(timeout=0.5)
+            while True:
+                pvname, records = item
+                if pvname not in batch:
+                    batch[pvname] = []
+                batch[pvname].append(records)
+                item = self.queue.get_nowait()
+        except Queue.Empty:
+            pass
+        return batch
+
+    def write_batch(self, batch):
+        for pvname, records in batch.items():
+            if pvname not in self.segments:
+                self.segments[pvname] = Segment(self.directory, pvname,
+                                                maxrecords=self.maxrecords,
+                                                nsegments=self.nsegments)
+            records = np.concatenate(records)
+            self.segments[pvname].write(records)
+            self.n_written += len(records)
+
+    def run(self):
+        last_sync = time.time()
+        while self.running or not self.queue.empty():
+            self.write_batch(self.get_batch())
+            if time.time() > last_sync + self.sync_time:
+                last_sync = time.time()
+                for segment in self.segments.values():
+                    segment.sync()
+        for segment in self.segments.values():
+            segment.close()
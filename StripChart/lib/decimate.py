@@ -0,0 +1,48 @@
+"""
+Decimation of Strip Chart traces for plotting
+"""
+import numpy as np
+
+def segment_extremes(values, starts):
+    """return (imin, imax), the indices of the first minimum and maximum
+    of values in each segment, where segments start at indices starts
+    (sorted, starting with 0, and not empty).  A segment with NaNs may
+    give len(values) for its index."""
+    npts = len(values)
+    sizes = np.diff(np.append(starts, npts))
+    segid = np.repeat(np.arange(len(starts)), sizes)
+    index = np.arange(npts)
+    out = []
+    for ufunc in (np.minimum, np.maximum):
+        extreme = ufunc.reduceat(values, starts)
+        out.append(np.minimum.reduceat(np.where(values == extreme[segid],
+                                                index, npts), starts))
+    return out
+
+def minmax_decimate(tdat, ydat, nbins, tmin=None, tmax=None):
+    """reduce time-ordered trace (tdat, ydat) to the minimum and maximum
+    value in each of nbins equal time bins from tmin to tmax (default:
+    the first and last time), in the order they occur.
+
+    This keeps every spike of the trace while giving at most 2*nbins+2
+    points, so that with nbins the number of pixels across the plot,
+    the plot looks the same as the full trace.  The first and last
+    points are always kept.  Returns (tdat, ydat), which are the inputs
+    if they have no more than 2*nbins points.
+    """
+    npts = len(tdat)
+    nbins = max(1, int(nbins))
+    if npts <= 2*nbins:
+        return tdat, ydat
+    if tmin is None:
+        tmin = tdat[0]
+    if tmax is None:
+        tmax = tdat[-1]
+    edges = np.searchsorted(tdat, np.linspace(tmin, tmax, nbins+1)[:-1])
+    # start index of each non-empty bin, with points before tmin in
+    # the first bin
+    starts = np.unique(np.append(0, edges[edges < npts]))
+    imin, imax = segment_extremes(ydat, starts)
+    keep = np.unique(np.concatenate(([0, npts-1], imin, imax)))
+    keep = keep[keep < npts]
+    return tdat[keep], ydat[keep]
@@ -0,0 +1,140 @@
+"""
+Export of Strip Chart PV histories to text or NumPy (.npz) files
+"""
+import os
+import time
+import zipfile
+import tempfile
+import threading
+import numpy as np
+
+FILECHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_'
+
+# number of points formatted and written at a time
+CHUNKSIZE = 50000
+
+EXPORT_FORMATS = ('text', 'npz')
+
+def fix_filename(pvname):
+    "PV name with characters not allowed in file names replaced by '_'"
+    return ''.join([s if s in FILECHARS else '_' for s in pvname])
+
+def snapshot(pvdata):
+    """return list of (pvname, times, values) with copies of the history
+    arrays of a dict of PVHistory, sorted by PV name"""
+    out = []
+    for pvname in sorted(pvdata.keys()):
+        hist = pvdata[pvname]
+        if len(hist) > 0:
+            out.append((pvname, hist.times.copy(), hist.values.copy()))
+    return out
+
+def write_text(fname, pvname, times, values, tnow=None,
+               chunksize=CHUNKSIZE, progress=None):
+    """write times and values of one PV to a text file, chunksize points
+    at a time, calling progress(npts) after each chunk"""
+    if tnow is None:
+        tnow = time.time()
+    fout = open(fname, 'w')
+    fout.write("# Epics PV Strip Chart Data for PV: %s \n" % pvname)
+    fout.write("# Current Time  = %s \n" % time.ctime(tnow))
+    fout.write("# Earliest Time = %s \n" % time.ctime(times[0]))
+    fout.write("#------------------------------\n")
+    fout.write("#  Timestamp         Value       Time-Current_Time(s)\n")
+    for i0 in range(0, len(times), chunksize):
+        tdat = times[i0:i0+chunksize]
+        np.savetxt(fout, np.column_stack((tdat, values[i0:i0+chunksize],
+                                          tdat - tnow)),
+                   fmt="  %.3f %16g     %.3f")
+        if progress is not None:
+            progress(len(tdat))
+    fout.close()
+
+def align(times, values, tindex):
+    """values of a PV (as a step function of time) at each time of
+    tindex, with NaN before its first time"""
+    index = np.searchsorted(times, tindex, side='right') - 1
+    out = values[np.maximum(index, 0)]
+    out[index < 0] = np.nan
+    return out
+
+def write_npz(fname, traces, tnow=None, progress=None):
+    """write PV histories (as from snapshot()) to a NumPy .npz file, with
+    all PVs aligned on a shared time index (all of their timestamps).
+
+    The file holds arrays 'time', 'pvnames', and 'pv0', 'pv1', ... with
+    the values of each PV.  Arrays are written one at a time, so that
+    only one aligned PV array is in memory at a time."""
+    if tnow is None:
+        tnow = time.time()
+    tindex = np.unique(np.concatenate([t for name, t, v in traces]))
+    arrays = [('time', lambda: tindex),
+              ('pvnames', lambda: np.array([name for name, t, v in traces]))]
+    for i, (name, times, values) in enumerate(traces):
+        arrays.append(('pv%i' % i, lambda t=times, v=values: align(t, v, tindex)))
+
+    fd, tmpname = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    zfile = zipfile.ZipFile(fname, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    try:
+        for i, (key, get_array) in enumerate(arrays):
+            np.save(tmpname, get_array())
+            zfile.write(tmpname, arcname='%s.npy' % key)
+            if progress is not None and i > 1:
+                progress(len(traces[i-2][1]))
+    finally:
+        zfile.close()
+        os.unlink(tmpname)
+
+class DataExporter(threading.Thread):
+    """write PV histories to files in a separate thread.
+
+    traces is a list of (pvname, times, values), as from snapshot().
+    With format 'text', each PV is written to basename_PVNAME.ext, and
+    with 'npz' all PVs are written to path.  onprogress(fraction) is
+    called after each chunk is written, and ondone(filenames, error)
+    when finished, both from this thread.
+    """
+    def __init__(self, traces, path, format='text', onprogress=None,
+                 ondone=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        if format not in EXPORT_FORMATS:
+            raise ValueError("unknown export format '%s'" % format)
+        self.traces = traces
+        self.path = path
+        self.format = format
+        self.onprogress = onprogress
+        self.ondone = ondone
+        self.npts = sum([len(t) for name, t, v in traces])
+        self.nwritten = 0
+        self.filenames = []
+
+    def progress(self, npts):
+        self.nwritten += npts
+        if hasattr(self.onprogress, '__call__'):
+            self.onprogress(self.nwritten/max(1.0, self.npts))
+
+    def run(self):
+        error = None
+        tnow = time.time()
+        try:
+            if self.format == 'npz':
+                write_npz(self.path, self.traces, tnow=tnow,
+                          progress=self.progress)
+                self.filenames.append(self.path)
+            else:
+                basename, ext = os.path.splitext(self.path)
+                if len(ext) < 2:
+                    ext = '.dat'
+                for pvname, times, values in self.traces:
+                    fname = "%s_%s%s" % (basename, fix_filename(pvname), ext)
+                    write_text(fname, pvname, times, values, tnow=tnow,
+                               progress=self.progress)
+                    self.filenames.append(fname)
+        except Exception, exc:
+            # any error, such as MemoryError for very large data, is
+            # reported through ondone, which must always be called
+            error = str(exc) or exc.__class__.__name__
+        if hasattr(self.ondone, '__call__'):
+            self.ondone(self.filenames, error)
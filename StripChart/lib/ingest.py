@@ -0,0 +1,82 @@
+"""
+Staging of PV updates from Channel Access callbacks for the Strip Chart
+and PV logger
+"""
+import time
+from collections import deque
+import numpy as np
+
+from pvhistory import PVHistory, MAXPOINTS, TIERS
+from archive import RECOVER_TIME
+
+# largest number of updates staged for a PV between drains
+MAXSTAGED = 100000
+
+class StagingBuffers(object):
+    """per-PV buffers of (timestamp, value) from PV callbacks.
+
+    put() is called from the Channel Access thread and drain() from the
+    GUI (or logger) thread.  Each buffer is a deque, whose append() and popleft()
+    are atomic, so no lock is needed, and a callback costs one float
+    conversion and one append instead of a GUI event.  If a buffer is
+    not drained, the oldest updates are dropped past maxstaged.
+    """
+    def __init__(self, maxstaged=MAXSTAGED):
+        self.maxstaged = maxstaged
+        self.buffers = {}
+
+    def add_pv(self, pvname):
+        "add buffer for a PV (before callbacks can put to it)"
+        if pvname not in self.buffers:
+            self.buffers[pvname] = deque(maxlen=self.maxstaged)
+
+    def put(self, pvname, timestamp, value):
+        "stage an update, returning whether it was staged"
+        buff = self.buffers.get(pvname, None)
+        if buff is None:
+            return False
+        try:
+            buff.append((timestamp, float(value)))
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def drain(self):
+        """return dict of (times, values) arrays of all staged updates
+        for each PV with updates"""
+        out = {}
+        for pvname, buff in self.buffers.items():
+            npts = len(buff)
+            if npts < 1:
+                continue
+            data = np.array([buff.popleft() for i in range(npts)],
+                            dtype=np.float64)
+            out[pvname] = data[:, 0], data[:, 1]
+        return out
+
+def make_history(pvname, maxpoints=MAXPOINTS, archive=None,
+                 recover_time=RECOVER_TIME, tiers=TIERS):
+    """return new PVHistory for a PV, with rollup tiers (see
+    pvhistory.TIERS), and the last recover_time seconds of values read
+    back from archive (a PVArchive), if given"""
+    history = PVHistory(maxpoints=maxpoints, tiers=tiers)
+    if archive is not None and recover_time > 0:
+        history.extend(*archive.load(pvname, tmin=time.time()-recover_time))
+    return history
+
+def add_staged(staging, pvdata, archive=None):
+    """add all staged values to the PVHistory for each PV in the dict
+    pvdata, and to archive, if given.  Returns dict of the number of
+    values added for each PV."""
+    counts = {}
+    for pvname, (times, values) in staging.drain().items():
+        history = pvdata.get(pvname, None)
+        if history is None:
+            continue
+        history.extend(times, values)
+        counts[pvname] = len(times)
+        if archive is not None:
+            # timestamps as stored, put in order
+            npts = min(len(times), len(history))
+            archive.add(pvname, history.times[-npts:], history.values[-npts:])
+    return counts
@@ -0,0 +1,169 @@
+"""
+Headless logging of Epics PVs to the Strip Chart archive
+
+The PVs and their values are handled as for the Strip Chart: Channel
+Access callbacks stage values (see ingest.StagingBuffers), and every
+interval seconds all staged values are added to the PV histories and
+to the archive (see archive.PVArchive) in one batch per PV, so that
+the cost per update stays small for hundreds of PVs and thousands of
+updates per second.
+
+The archive directory is locked while logging, so that a Strip Chart
+showing it only reads from it.
+"""
+import os
+import sys
+import time
+import json
+import signal
+
+from epics import PV
+
+from archive import PVArchive, ARCHIVE_DIR, SEGMENT_RECORDS, NSEGMENTS
+from ingest import StagingBuffers, make_history, add_staged
+
+# number of points kept in memory for each PV
+MAXPOINTS = 10000
+
+def read_pvlist(fname):
+    "read list of PV names, one per line, with '#' for comments"
+    fh = open(fname, 'r')
+    lines = fh.readlines()
+    fh.close()
+    pvnames = []
+    for line in lines:
+        name = line.split('#', 1)[0].strip()
+        if len(name) > 0 and name not in pvnames:
+            pvnames.append(name)
+    return pvnames
+
+class PVLogger(object):
+    """log PVs to an archive directory, with no GUI.
+
+    Stats (see get_stats()) are written as JSON to stats_file (if given)
+    every stats_time seconds.  run() logs until stop() is called, as
+    from a SIGINT or SIGTERM signal handler.
+    """
+    def __init__(self, pvnames=None, archive=ARCHIVE_DIR, interval=0.5,
+                 maxpoints=MAXPOINTS, stats_file=None, stats_time=10.0,
+                 maxrecords=SEGMENT_RECORDS, nsegments=NSEGMENTS):
+        self.interval = interval
+        self.maxpoints = maxpoints
+        self.stats_file = stats_file
+        self.stats_time = stats_time
+        self.archive = PVArchive(archive, maxrecords=maxrecords,
+                                 nsegments=nsegments)
+        self.staging = StagingBuffers()
+        self.pvs = {}
+        self.pvdata = {}
+        self.connected = {}
+        self.counts = {}
+        self.running = False
+        self.starttime = time.time()
+        self.last_stats = None
+        if pvnames is None:
+            pvnames = self.archive.get_pvnames()
+        for name in pvnames:
+            self.add_pv(name, save=False)
+        self.archive.save_pvnames(sorted(self.pvs.keys()))
+
+    def add_pv(self, name, save=True):
+        """add a PV to log (without waiting for it to connect), saving
+        the list of PVs in the archive"""
+        name = str(name)
+        if name in self.pvs:
+            return
+        self.staging.add_pv(name)
+        # no rollup tiers: only the last values are used, for stats
+        self.pvdata[name] = make_history(name, maxpoints=self.maxpoints,
+                                         tiers=())
+        self.connected[name] = False
+        self.counts[name] = 0
+        self.pvs[name] = PV(name, callback=self.onPVChange,
+                            connection_callback=self.onConnect)
+        if save:
+            self.archive.save_pvnames(sorted(self.pvs.keys()))
+
+    def onConnect(self, pvname=None, conn=None, **kws):
+        self.connected[pvname] = conn
+
+    def onPVChange(self, pvname=None, value=None, timestamp=None, **kws):
+        "PV callback (in CA thread): stage value"
+        if timestamp is None:
+            timestamp = time.time()
+        self.staging.put(pvname, timestamp, value)
+
+    def add_staged(self):
+        "add staged values to histories and archive"
+        for pvname, npts in add_staged(self.staging, self.pvdata,
+                                       self.archive).items():
+            self.counts[pvname] += npts
+
+    def get_stats(self):
+        """return dict of stats: totals, update rate since the last call,
+        and for each PV, whether connected, number of updates, and the
+        last timestamp and value"""
+        now = time.time()
+        total = sum(self.counts.values())
+        rate = 0.0
+        if self.last_stats is not None:
+            tlast, nlast = self.last_stats
+            rate = (total - nlast)/max(1.e-3, now - tlast)
+        self.last_stats = (now, total)
+        pvs = {}
+        for name, history in self.pvdata.items():
+            pvs[name] = {'connected': bool(self.connected[name]),
+                         'updates': self.counts[name],
+                         'last': None}
+            last = history.last()
+            if last is not None:
+                pvs[name]['last'] = [float(last[0]), float(last[1])]
+        return {'time': now, 'uptime': now - self.starttime,
+                'npvs': len(self.pvs),
+                'nconnected': len([c for c in self.connected.values() if c]),
+                'updates': total, 'rate': rate,
+                'archived': self.archive.n_written,
+                'queued': self.archive.queue.qsize(),
+                'pvs': pvs}
+
+    def write_stats(self):
+        stats = self.get_stats()
+        if self.stats_file is not None:
+            tmpname = '%s.tmp' % self.stats_file
+            fh = open(tmpname, 'w')
+            json.dump(stats, fh, indent=1, sort_keys=True)
+            fh.close()
+            os.rename(tmpname, self.stats_file)
+        sys.stdout.write('%s: %i of %i PVs connected, %i updates (%.1f/s), %i archived\n' %
+                         (time.ctime(stats['time']), stats['nconnected'],
+                          stats['npvs'], stats['updates'], stats['rate'],
+                          stats['archived']))
+        sys.stdout.flush()
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self, duration=None):
+        "log PVs until stop() is called, or for duration seconds"
+        self.running = True
+        self.archive.start()
+        tstart = next_stats = time.time()
+        while self.running:
+            time.sleep(self.interval)
+            self.add_staged()
+            now = time.time()
+            if now >= next_stats:
+                next_stats = now + self.stats_time
+                self.write_stats()
+            if duration is not None and now > tstart + duration:
+                self.running = False
+        for pv in self.pvs.values():
+            pv.clear_callbacks()
+        self.add_staged()
+        self.archive.stop()
+        self.write_stats()
+
+    def handle_signals(self):
+        "stop logging on SIGINT or SIGTERM"
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
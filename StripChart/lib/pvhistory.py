@@ -0,0 +1,285 @@
+"""
+Time-series history of PV values for the Epics Strip Chart
+"""
+import numpy as np
+
+from decimate import segment_extremes
+
+# default number of points kept for each PV
+MAXPOINTS = 1000000
+
+# rollup tiers kept for each PV: (bucket width in seconds, number of
+# buckets), for 1 day of 1 s, 1 week of 10 s and 10 weeks of 1 minute
+TIERS = ((1.0, 86400), (10.0, 60480), (60.0, 100800))
+
+class TimeSeries(object):
+    """time-ordered columns of float64 values, the first ('t') holding
+    timestamps.
+
+    The arrays start small and double in size as needed, up to room for
+    2*maxpoints rows.  Once full, the newest maxpoints rows are moved to
+    the start of the arrays, so adding rows stays O(1) (amortized), at
+    most maxpoints rows are kept, and the rows are always a contiguous
+    slice of the arrays that can be searched with np.searchsorted and
+    returned as views, without copying.
+    """
+    columns = ('t',)
+
+    def __init__(self, maxpoints=MAXPOINTS, size=1024):
+        self.maxpoints = max(2, int(maxpoints))
+        size = min(max(2, size), 2*self.maxpoints)
+        self.arrays = {}
+        for name in self.columns:
+            self.arrays[name] = np.zeros(size, dtype=np.float64)
+        self.start = self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        self.start = self.end = 0
+
+    def column(self, name):
+        "column values, oldest first (a view)"
+        return self.arrays[name][self.start:self.end]
+
+    @property
+    def times(self):
+        "timestamps, oldest first (a view)"
+        return self.arrays['t'][self.start:self.end]
+
+    def first_time(self):
+        "timestamp of oldest row"
+        return self.arrays['t'][self.start]
+
+    def make_room(self):
+        "make room for more rows at the end of the arrays"
+        npts = self.end - self.start
+        size = len(self.arrays['t'])
+        for name in self.columns:
+            old = self.arrays[name]
+            if size < 2*self.maxpoints:
+                arr = np.zeros(min(2*size, 2*self.maxpoints), dtype=np.float64)
+                arr[:npts] = old[self.start:self.end]
+                self.arrays[name] = arr
+            else:
+                # with npts <= maxpoints, the source and destination
+                # slices do not overlap
+                old[:npts] = old[self.start:self.end]
+        self.start, self.end = 0, npts
+
+    def add_row(self, *values):
+        "add a row of values, one per column"
+        if self.end == len(self.arrays['t']):
+            self.make_room()
+        for name, val in zip(self.columns, values):
+            self.arrays[name][self.end] = val
+        self.end += 1
+        if self.end - self.start > self.maxpoints:
+            self.start += 1
+
+    def add_rows(self, *columns):
+        "add many rows, as one array per column"
+        npts = len(columns[0])
+        if npts > self.maxpoints:
+            columns = [col[-self.maxpoints:] for col in columns]
+            npts = self.maxpoints
+        while len(self.arrays['t']) - self.end < npts:
+            self.make_room()
+        for name, col in zip(self.columns, columns):
+            self.arrays[name][self.end:self.end+npts] = col
+        self.end += npts
+        self.start = max(self.start, self.end - self.maxpoints)
+
+    def search(self, tmin, tmax=None):
+        """return (i0, i1) for rows from tmin to tmax, as indices into
+        column() arrays, including the last row before tmin"""
+        times = self.times
+        i0 = max(0, np.searchsorted(times, tmin, side='right') - 1)
+        i1 = len(times)
+        if tmax is not None:
+            i1 = np.searchsorted(times, tmax, side='right')
+        return i0, i1
+
+class RollupTier(TimeSeries):
+    """minimum, mean and maximum of values in time buckets of width
+    seconds, updated as each value is added.  The times of the minimum
+    and maximum in each bucket are kept too, so that the envelope can be
+    drawn in the order the values occurred.  NaN values (as for a
+    disconnected PV) are not included."""
+    columns = ('t', 'min', 'tmin', 'max', 'tmax', 'sum', 'n')
+
+    def __init__(self, width, maxpoints, size=256):
+        TimeSeries.__init__(self, maxpoints=maxpoints, size=size)
+        self.width = float(width)
+        self.tfirst = None
+
+    def clear(self):
+        TimeSeries.clear(self)
+        self.tfirst = None
+
+    def add(self, timestamp, value):
+        "add a value (timestamps must not decrease)"
+        if np.isnan(value):
+            return
+        if self.tfirst is None:
+            self.tfirst = timestamp
+        tbucket = self.width*np.floor(timestamp/self.width)
+        i = self.end - 1
+        arrays = self.arrays
+        if i < self.start or arrays['t'][i] != tbucket:
+            self.add_row(tbucket, value, timestamp, value, timestamp, value, 1)
+            return
+        if value < arrays['min'][i]:
+            arrays['min'][i] = value
+            arrays['tmin'][i] = timestamp
+        if value > arrays['max'][i]:
+            arrays['max'][i] = value
+            arrays['tmax'][i] = timestamp
+        arrays['sum'][i] += value
+        arrays['n'][i] += 1
+
+    def extend(self, times, values):
+        "add arrays of values (timestamps must not decrease)"
+        valid = ~np.isnan(values)
+        if not valid.all():
+            times, values = times[valid], values[valid]
+        if len(times) < 1:
+            return
+        if self.tfirst is None:
+            self.tfirst = times[0]
+        tbuckets = self.width*np.floor(times/self.width)
+        # values for the current bucket
+        nlast = 0
+        if self.end > self.start:
+            nlast = np.searchsorted(tbuckets, self.arrays['t'][self.end-1],
+                                    side='right')
+            for i in range(nlast):
+                self.add(times[i], values[i])
+        times, values, tbuckets = times[nlast:], values[nlast:], tbuckets[nlast:]
+        if len(times) < 1:
+            return
+        starts = np.flatnonzero(np.append(True, tbuckets[1:] != tbuckets[:-1]))
+        imin, imax = segment_extremes(values, starts)
+        imin = np.minimum(imin, len(values)-1)
+        imax = np.minimum(imax, len(values)-1)
+        self.add_rows(tbuckets[starts], values[imin], times[imin],
+                      values[imax], times[imax],
+                      np.add.reduceat(values, starts),
+                      np.diff(np.append(starts, len(values))))
+
+    def first_time(self):
+        """timestamp of the first value added, or the start of the
+        oldest bucket once the first bucket has been dropped"""
+        tbucket = self.arrays['t'][self.start]
+        if self.tfirst is not None and self.tfirst >= tbucket:
+            return self.tfirst
+        return tbucket
+
+    @property
+    def mean(self):
+        "mean value of each bucket, oldest first"
+        return self.column('sum') / np.maximum(1, self.column('n'))
+
+    def envelope(self, tmin, tmax=None):
+        """return (times, values) of the minimum and maximum of each
+        bucket from tmin to tmax, in time order"""
+        i0, i1 = self.search(tmin, tmax)
+        cols = [self.column(name)[i0:i1]
+                for name in ('tmin', 'min', 'tmax', 'max')]
+        tlo, ylo, thi, yhi = cols
+        minfirst = tlo <= thi
+        times = np.column_stack((np.where(minfirst, tlo, thi),
+                                 np.where(minfirst, thi, tlo))).ravel()
+        values = np.column_stack((np.where(minfirst, ylo, yhi),
+                                  np.where(minfirst, yhi, ylo))).ravel()
+        return times, values
+
+class PVHistory(TimeSeries):
+    """history of (timestamp, value) for one PV, with rollup tiers
+    (see RollupTier) for long time ranges.
+
+    Timestamps are kept in order: a timestamp earlier than the last one
+    is stored as the last one.  Values that cannot be converted to
+    float are not stored.
+    """
+    columns = ('t', 'y')
+
+    def __init__(self, maxpoints=MAXPOINTS, size=1024, tiers=TIERS):
+        TimeSeries.__init__(self, maxpoints=maxpoints, size=size)
+        self.tiers = [RollupTier(width, nbuckets) for width, nbuckets in tiers]
+
+    def clear(self):
+        TimeSeries.clear(self)
+        for tier in self.tiers:
+            tier.clear()
+
+    @property
+    def values(self):
+        "values, oldest first (a view)"
+        return self.arrays['y'][self.start:self.end]
+
+    def last(self):
+        "return (timestamp, value) of newest point, or None"
+        if self.end == self.start:
+            return None
+        return self.arrays['t'][self.end-1], self.arrays['y'][self.end-1]
+
+    def append(self, timestamp, value):
+        "add a point, returning whether it was added"
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        if self.end > self.start:
+            timestamp = max(timestamp, self.arrays['t'][self.end-1])
+        self.add_row(timestamp, value)
+        for tier in self.tiers:
+            tier.add(timestamp, value)
+        return True
+
+    def extend(self, times, values):
+        """add arrays of timestamps and values, as for values read back
+        from an archive"""
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(times) < 1:
+            return
+        if self.end > self.start:
+            times = np.maximum(times, self.arrays['t'][self.end-1])
+        times = np.maximum.accumulate(times)
+        self.add_rows(times, values)
+        for tier in self.tiers:
+            tier.extend(times, values)
+
+    def window(self, tmin, tmax=None):
+        """return (times, values) views for timestamps from tmin to tmax,
+        with the last point before tmin (where a step plot starts)"""
+        i0, i1 = self.search(tmin, tmax)
+        return self.times[i0:i1], self.values[i0:i1]
+
+    def select(self, tmin, tmax=None, npts=2000):
+        """return (times, values) for timestamps from tmin to tmax, with
+        about npts points or fewer if possible.
+
+        Raw points are used if there are at most 4*npts of them,
+        otherwise the finest rollup tier with at most npts buckets (as
+        the min/max envelope of each bucket).  Raw points or tiers that
+        do not go back to tmin are used only if none does."""
+        series = [self] + self.tiers
+        tfirst = min([s.first_time() for s in series if len(s) > 0] or [tmin])
+        tneed = max(tmin, tfirst)
+        choice = None
+        for s in series:
+            if len(s) < 1 or s.first_time() > tneed:
+                continue
+            i0, i1 = s.search(tmin, tmax)
+            nmax = npts
+            if s is self:
+                nmax = 4*npts
+            choice = s
+            if i1 - i0 <= nmax:
+                break
+        if choice is None or choice is self:
+            return self.window(tmin, tmax)
+        return choice.envelope(tmin, tmax)
@@ -4,21 +4,28 @@ Epics Strip Chart application
 """
 import os
 import time
-from numpy import array, where
+import numpy as np
 
 import wx
 import wx.lib.colourselect  as csel
 
 from epics import PV
-from epics.wx import EpicsFunction, DelayedEpicsCallback
+from epics.wx import EpicsFunction
 from epics.wx.utils import  SimpleText, Closure, FloatCtrl
 
 from wxmplot.plotpanel import PlotPanel
 from wxmplot.colors import hexcolor
 from wxmplot.utils import LabelEntry
 
+from pvhistory import MAXPOINTS
+from decimate import minmax_decimate
+from exporter import DataExporter, snapshot
+from archive import PVArchive
+from ingest import StagingBuffers, make_history, add_staged
+from traces import TraceManager
+
 ICON_FILE = 'stripchart.ico'
-FILECHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_'
+DATA_WILDCARDS = 'Text Data Files (*.dat)|*.dat|NumPy Data File (*.npz)|*.npz'
 
 BGCOL  = (250, 250, 240)
 
@@ -42,6 +49,9 @@ MENU_PREVIEW = wx.NewId()
 MENU_CLIPB  = wx.NewId()
 MENU_SELECT_COLOR = wx.NewId()
 MENU_SELECT_SMOOTH = wx.NewId()
+MENU_DECIMATE = wx.NewId()
+MENU_BLIT = wx.NewId()
+MENU_ADDROW = wx.NewId()
 
 
 def get_bound(val):
@@ -105,8 +115,11 @@ Also, these key bindings can be used
 Matt Newville <newville@cars.uchicago.edu>
 """
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, maxpoints=MAXPOINTS, archive=None,
+                 pvnames=None):
         self.pvdata = {}
+        self.staging = StagingBuffers()
+        self.maxpoints = maxpoints
         self.pvlist = [' -- ']
         self.pvwids = [None]
         self.pvchoices = [None]
@@ -114,6 +127,14 @@ Matt Newville <newville@cars.uchicago.edu>
         self.plots_drawn = [False]*10
         self.needs_refresh = False
         self.paused = False
+        self.decimate = True
+        self.blit = True
+        self.background = None
+        self.background_key = None
+        self.ntraces = 0
+        self.exporter = None
+        self.tracemgr = TraceManager(self.read_trace_config)
+        self.draw_time = None
 
         self.tmin = -60.0
         self.timelabel = 'seconds'
@@ -124,6 +145,22 @@ Matt Newville <newville@cars.uchicago.edu>
         self.Bind(wx.EVT_TIMER, self.onUpdatePlot, self.timer)
         self.timer.Start(POLLTIME)
 
+        # with an archive directory, PV values are saved to disk and
+        # the recent values (and PVs, if not given) are loaded back.
+        # An archive in use (as by pyepics_pvlogger.py) is only read.
+        self.archive = None
+        if archive is not None:
+            try:
+                self.archive = PVArchive(archive)
+            except IOError, e:
+                self.archive = PVArchive(archive, readonly=True)
+                self.write_message('%s: showing it, but not saving to it' % e)
+            self.archive.start()
+            if pvnames is None:
+                pvnames = self.archive.get_pvnames()
+        for name in (pvnames or []):
+            self.addPV(name)
+
     def create_frame(self, parent, size=(750, 450), **kwds):
         self.parent = parent
 
@@ -136,6 +173,7 @@ Matt Newville <newville@cars.uchicago.edu>
         self.plotpanel = PlotPanel(self, trace_color_callback=self.onTraceColor)
         self.plotpanel.BuildPanel()
         self.plotpanel.messenger = self.write_message
+        self.plotpanel.canvas.mpl_connect('draw_event', self.onCanvasDraw)
 
         self.build_pvpanel()
         self.build_btnpanel()
@@ -269,6 +307,19 @@ Matt Newville <newville@cars.uchicago.edu>
         mopt.AppendSeparator()
         mopt.Append(MENU_UNZOOM, "Zoom Out\tCtrl+Z",
                  "Zoom out to full data range")
+        mopt.AppendSeparator()
+        mopt.Append(MENU_DECIMATE, "Decimate Traces",
+                    "Plot only min/max values for each pixel of long traces",
+                    wx.ITEM_CHECK)
+        mopt.Check(MENU_DECIMATE, self.decimate)
+        mopt.Append(MENU_BLIT, "Fast Redraw",
+                    "Redraw only the traces, unless the axes change",
+                    wx.ITEM_CHECK)
+        mopt.Check(MENU_BLIT, self.blit)
+        mopt.AppendSeparator()
+        mopt.Append(MENU_ADDROW, "Add PV Row",
+                    "Add a row for another PV to show")
+        self.optmenu = mopt
 
         mhelp = wx.Menu()
         mhelp.Append(MENU_HELP, "Quick Reference",  "Quick Reference for MPlot")
@@ -283,6 +334,9 @@ Matt Newville <newville@cars.uchicago.edu>
         self.Bind(wx.EVT_MENU, self.onHelp,     id=MENU_HELP)
         self.Bind(wx.EVT_MENU, self.onAbout,    id=MENU_ABOUT)
         self.Bind(wx.EVT_MENU, self.onExit,     id=MENU_EXIT)
+        self.Bind(wx.EVT_MENU, self.onDecimate, id=MENU_DECIMATE)
+        self.Bind(wx.EVT_MENU, self.onBlit,     id=MENU_BLIT)
+        self.Bind(wx.EVT_MENU, self.onAddRow,   id=MENU_ADDROW)
         self.Bind(wx.EVT_CLOSE, self.onExit)
 
         pp = self.plotpanel
@@ -303,16 +357,16 @@ Matt Newville <newville@cars.uchicago.edu>
         pvchoice.SetSelection(0)
         logs = MyChoice(panel)
         logs.SetSelection(0)
-        ymin = wx.TextCtrl(panel, -1, '', size=(75, -1))
-        ymax = wx.TextCtrl(panel, -1, '', size=(75, -1))
+        ymin = wx.TextCtrl(panel, -1, '', size=(75, -1),
+                           style=wx.TE_PROCESS_ENTER)
+        ymax = wx.TextCtrl(panel, -1, '', size=(75, -1),
+                           style=wx.TE_PROCESS_ENTER)
         if i > 2:
             logs.Disable()
             ymin.Disable()
             ymax.Disable()
 
-        colval = (0, 0, 0)
-        if i < len(self.default_colors):
-            colval = self.default_colors[i]
+        colval = self.default_colors[i % len(self.default_colors)]
         colr = csel.ColourSelect(panel, -1, '', colval)
         self.colorsels.append(colr)
 
@@ -327,13 +381,23 @@ Matt Newville <newville@cars.uchicago.edu>
         logs.Bind(wx.EVT_CHOICE,         self.onPVwid)
         ymin.Bind(wx.EVT_TEXT_ENTER,     self.onPVwid)
         ymax.Bind(wx.EVT_TEXT_ENTER,     self.onPVwid)
+        ymin.Bind(wx.EVT_KILL_FOCUS,     self.onPVwid)
+        ymax.Bind(wx.EVT_KILL_FOCUS,     self.onPVwid)
 
         self.pvchoices.append(pvchoice)
         self.pvwids.append((logs, colr, ymin, ymax))
 
+    def onAddRow(self, event=None):
+        "add a PV row: traces past the second are scaled to the left axis"
+        self.AddPV_row()
+        self.pvsizer.Fit(self.pvpanel)
+        self.GetSizer().Layout()
+        self.Fit()
+
     def onTraceColor(self, trace, color, **kws):
         irow = self.get_current_traces()[trace][0] - 1
         self.colorsels[irow].SetColour(color)
+        self.tracemgr.invalidate()
 
     def onPVshow(self, event=None, row=0):
         if not event.IsChecked():
@@ -367,7 +431,13 @@ Matt Newville <newville@cars.uchicago.edu>
             if not conn:
                 return
             self.pvlist.append(name)
-            self.pvdata[name] = [(time.time(), pv.get())]
+            self.staging.add_pv(name)
+            self.tracemgr.set_units(name, getattr(pv, 'units', None))
+            self.pvdata[name] = make_history(name, maxpoints=self.maxpoints,
+                                             archive=self.archive)
+            if self.archive is not None:
+                self.archive.save_pvnames(self.pvlist[1:])
+            self.staging.put(name, time.time(), pv.get())
 
             i_new = len(self.pvdata)
             new_shown = False
@@ -381,16 +451,22 @@ Matt Newville <newville@cars.uchicago.edu>
                 if cur == 0 and not new_shown:
                     choice.SetSelection(i_new)
                     new_shown = True
+            self.tracemgr.invalidate()
             self.needs_refresh = True
 
-    @DelayedEpicsCallback
     def onPVChange(self, pvname=None, value=None, timestamp=None, **kw):
+        "PV callback (in CA thread): stage value, to be added in onUpdatePlot"
         if timestamp is None:
             timestamp = time.time()
-        self.pvdata[pvname].append((timestamp, value))
-        self.needs_refresh = True
+        self.staging.put(pvname, timestamp, value)
+
+    def add_staged(self):
+        "add all staged PV values to the PV histories and archive"
+        if len(add_staged(self.staging, self.pvdata, self.archive)) > 0:
+            self.needs_refresh = True
 
     def onPVchoice(self, event=None, row=None, **kws):
+        self.tracemgr.invalidate()
         self.needs_refresh = True
         for i in range(len(self.pvlist)+1):
             try:
@@ -405,10 +481,15 @@ Matt Newville <newville@cars.uchicago.edu>
     def onPVcolor(self, event=None, row=None, **kws):
         self.plotpanel.conf.set_trace_color(hexcolor(event.GetValue()),
                                             trace=row-1)
+        self.tracemgr.invalidate()
         self.needs_refresh = True
 
     def onPVwid(self, event=None, row=None, **kws):
+        self.tracemgr.invalidate()
         self.needs_refresh = True
+        if event is not None:
+            # let the text control handle losing focus, too
+            event.Skip()
 
     def onDisplayTimeVal(self, event=None, value=None, **kws):
         new  = -abs(value)
@@ -447,6 +528,18 @@ Matt Newville <newville@cars.uchicago.edu>
         self.needs_refresh = True
         
 
+    def onDecimate(self, event=None):
+        self.decimate = self.optmenu.IsChecked(MENU_DECIMATE)
+        self.needs_refresh = True
+
+    def onBlit(self, event=None):
+        self.blit = self.optmenu.IsChecked(MENU_BLIT)
+        for line in self.get_lines():
+            line.set_animated(self.blit)
+        self.background = None
+        self.draw_time = None
+        self.needs_refresh = True
+
     def onPause(self, event=None):
         if self.paused:
             self.pause_btn.Enable()
@@ -461,45 +554,41 @@ Matt Newville <newville@cars.uchicago.edu>
         self.SetStatusText(s, panel)
 
     def onSaveData(self, event=None):
+        if self.exporter is not None and self.exporter.isAlive():
+            self.write_message('Still saving data to %s' % self.exporter.path)
+            return
         dlg = wx.FileDialog(self, message='Save Data to File...',
                             defaultDir = os.getcwd(),
                             defaultFile='PVStripChart.dat',
+                            wildcard=DATA_WILDCARDS,
                             style=wx.SAVE|wx.CHANGE_DIR)
         if dlg.ShowModal() == wx.ID_OK:
             path = dlg.GetPath()
-            self.SaveDataFiles(path)
-            self.write_message('Saved data to %s' % path)
+            format = 'text'
+            if dlg.GetFilterIndex() == 1 or path.endswith('.npz'):
+                format = 'npz'
+            self.SaveDataFiles(path, format=format)
         dlg.Destroy()
 
-    def SaveDataFiles(self, path):
-        basename, ext = os.path.splitext(path)
-        if len(ext) < 2:
-            ext = '.dat'
-        if ext.startswith('.'):
-            ext = ext[1:]
-
-        for pvname, data in self.pvdata.items():
-            tnow = time.time()
-            tmin = data[0][0]
-            fname = []
-            for s in pvname:
-                if s not in FILECHARS:
-                    s = '_'
-                fname.append(s)
-            fname = os.path.join("%s_%s.%s" % (basename, ''.join(fname), ext))
-
-            buff = ["# Epics PV Strip Chart Data for PV: %s " % pvname]
-            buff.append("# Current Time  = %s " % time.ctime(tnow))
-            buff.append("# Earliest Time = %s " % time.ctime(tmin))
-            buff.append("#------------------------------")
-            buff.append("#  Timestamp         Value       Time-Current_Time(s)")
-            for tx, yval in data:
-                buff.append("  %.3f %16g     %.3f"  % (tx, yval, tx-tnow))
-
-            fout = open(fname, 'w')
-            fout.write("\n".join(buff))
-            fout.close()
-            #dat = tnow, func(tnow)
+    def SaveDataFiles(self, path, format='text'):
+        """save data for all PVs in a separate thread, as text files
+        (one per PV) or as one .npz file (format='npz')"""
+        self.exporter = DataExporter(snapshot(self.pvdata), path,
+                                     format=format,
+                                     onprogress=self.onSaveProgress,
+                                     ondone=self.onSaveDone)
+        self.exporter.start()
+
+    def onSaveProgress(self, fraction):
+        wx.CallAfter(self.write_message,
+                     'Saving data to %s: %.0f%%' % (self.exporter.path,
+                                                   100*fraction))
+
+    def onSaveDone(self, filenames, error):
+        msg = 'Saved data to %s' % (', '.join(filenames))
+        if error is not None:
+            msg = 'Could not save data: %s' % error
+        wx.CallAfter(self.write_message, msg)
 
     def onAbout(self, event=None):
         dlg = wx.MessageDialog(self, self.about_msg,
@@ -520,11 +609,71 @@ Matt Newville <newville@cars.uchicago.edu>
             self.plotpanel.win_config.Destroy()
         except:
             pass
-
+        if self.archive is not None:
+            self.archive.stop()
         self.Destroy()
 
-    def get_current_traces(self):
-        "return list of current traces"
+    def get_lines(self):
+        "return list of matplotlib lines for drawn traces"
+        conf = self.plotpanel.conf
+        return [conf.get_mpl_line(i) for i in range(self.ntraces)
+                if self.plots_drawn[i]]
+
+    def get_background_key(self):
+        "return everything that, if changed, needs a full redraw"
+        key = [tuple(self.plotpanel.canvas.GetSize())]
+        for axes in self.plotpanel.fig.get_axes():
+            key.append((axes.get_xlim(), axes.get_ylim(), axes.get_yscale()))
+        return key
+
+    def onCanvasDraw(self, event=None):
+        """after a full redraw of the canvas (from here or from the plot
+        panel, as for zooming), save the background without the traces
+        (which are animated) and draw the traces on it"""
+        if not self.blit:
+            return
+        canvas = self.plotpanel.canvas
+        self.background = canvas.copy_from_bbox(self.plotpanel.fig.bbox)
+        self.background_key = self.get_background_key()
+        self.draw_lines()
+
+    def draw_lines(self):
+        "draw traces on saved background"
+        canvas = self.plotpanel.canvas
+        canvas.restore_region(self.background)
+        for line in self.get_lines():
+            line.axes.draw_artist(line)
+        canvas.blit(self.plotpanel.fig.bbox)
+
+    def redraw(self):
+        """redraw plot, only drawing the traces if the saved background
+        is still good, and showing the redraw time"""
+        t0 = time.time()
+        tstamp = time.strftime("%Y-%b-%d %H:%M:%S", time.localtime())
+        mode = 'draw'
+        if not self.blit:
+            self.plotpanel.set_title(tstamp)
+            self.plotpanel.canvas.draw()
+        else:
+            # new traces are not yet animated, and are in the background
+            stale = self.background is None
+            for line in self.get_lines():
+                stale = stale or not line.get_animated()
+                line.set_animated(True)
+            if stale or self.background_key != self.get_background_key():
+                self.plotpanel.canvas.draw()
+            else:
+                self.draw_lines()
+                mode = 'blit'
+        dt = time.time() - t0
+        if self.draw_time is None:
+            self.draw_time = dt
+        self.draw_time = 0.9*self.draw_time + 0.1*dt
+        self.write_message('%s  %s %.1f ms (avg %.1f ms)' %
+                           (tstamp, mode, 1000*dt, 1000*self.draw_time), panel=1)
+
+    def read_trace_config(self):
+        "read list of traces to show from PV rows"
         traces = []   # to be shown
         for irow, s in enumerate(self.pvchoices):
             if s is not None:
@@ -538,7 +687,29 @@ Matt Newville <newville@cars.uchicago.edu>
                     traces.append((irow, name, logs, color, ymin, ymax))
         return traces
 
+    def get_current_traces(self):
+        "return list of current traces"
+        return self.tracemgr.get_traces()
+
+    def get_trace_data(self, history, tstart, tnow, npixels):
+        """return (times, values) of a PV history to plot from tstart
+        to tnow, extended to tnow and decimated to npixels"""
+        if self.decimate:
+            # raw points, or rollup buckets for long time ranges
+            tdat, ydat = history.select(tstart, npts=npixels)
+        else:
+            tdat, ydat = history.window(tstart)
+        if len(tdat) > 0 and tnow > tdat[-1]:
+            # extend the last value to the current time
+            tdat = np.append(tdat, tnow)
+            ydat = np.append(ydat, history.last()[1])
+        if self.decimate and len(tdat) > 1:
+            tdat, ydat = minmax_decimate(tdat, ydat, npixels,
+                                         tmin=tstart, tmax=tnow)
+        return tdat, ydat
+
     def onUpdatePlot(self, event=None):
+        self.add_staged()
         if self.paused or not self.needs_refresh:
             return
 
@@ -549,104 +720,92 @@ Matt Newville <newville@cars.uchicago.edu>
             timescale  = 1./60
         elif self.time_choice.GetSelection() == 2:
             timescale = 1./3600
+        tstart = tnow + self.tmin/timescale
 
-        ylabelset, y2labelset = False, False
         xlabel = 'Elapsed Time (%s)' % self.timelabel
-        itrace = -1
         update_failed = False
-        hasplot = False
-        span1 = (1, 0)
         did_update = False
         left_axes = self.plotpanel.axes
         right_axes = self.plotpanel.get_right_axes()
+        # number of min/max bins for decimated traces: one per pixel
+        npixels = max(100, self.plotpanel.canvas.GetSize()[0])
 
+        traces = []
         for irow, pname, uselog, color, ymin, ymax in self.get_current_traces():
             if pname not in self.pvdata:
                 continue
-            itrace += 1
-            if len(self.plots_drawn) < itrace:
-                self.plots_drawn.extend([False]*3)
-            side = 'left'
-            if itrace == 1:
-                side = 'right'
-            data = self.pvdata[pname][:]
-            if len(data)  < 2:
-                update_failed = True
-                continue
-            tdat = timescale * (array([i[0] for i in data]) - tnow)
-            mask = where(tdat > self.tmin)
-            if (len(mask[0]) < 2 or
-                ((abs(min(tdat)) / abs(1 -self.tmin)) > 0.1)):
-                data.append((time.time(), data[0][-1]))
-                tdat = timescale*(array([i[0] for i in data]) - tnow)
-                mask = where(tdat > self.tmin)
-
-            i0 = mask[0][0]
-            if i0 > 0:
-                i0 = i0-1
-            i1 = mask[0][-1] + 1
-            tdat = timescale*(array([i[0] for i in data[i0:i1]]) - tnow)
-            ydat = array([i[1] for i in data[i0:i1]])
-
-            if len(ydat)  < 2:
+            itrace = len(traces)
+            tdat, ydat = self.get_trace_data(self.pvdata[pname], tstart,
+                                             tnow, npixels)
+            if len(tdat) < 2:
                 update_failed = True
                 continue
+            traces.append([itrace, pname, uselog, color, ymin, ymax,
+                           timescale*(tdat - tnow), ydat])
+        if len(self.plots_drawn) < len(traces):
+            self.plots_drawn.extend([False]*(len(traces)-len(self.plots_drawn)))
+
+        # traces past the first two are scaled to the left hand axis
+        if len(traces) > 0:
+            ydat, ymin, ymax = traces[0][7], traces[0][4], traces[0][5]
             if ymin is None:
-                ymin = min(ydat)
+                ymin = ydat.min()
             if ymax is None:
-                ymax = max(ydat)
-
-            # for more that 2 plots, scale to left hand axis
-            if itrace ==  0:
-                span1 = (ymax-ymin, ymin)
-                if span1[0]*ymax < 1.e-6:
-                    update_failed = True
-                    continue
-            elif itrace > 1:  
-                yr = abs(ymax-ymin)
-                if yr > 1.e-9:
-                    ydat = span1[1] + 0.99*(ydat - ymin)*span1[0]/yr
-                ymin, ymax = min(ydat), max(ydat)
-            
-            if self.needs_refresh:
+                ymax = ydat.max()
+            if ymax - ymin < 1.e-9:
+                # flat (or inverted) first trace: scale to a unit range
+                ymax = ymin + 1.0
+        if len(traces) > 2:
+            extra = traces[2:]
+            scaled = self.tracemgr.normalize([t[1] for t in extra],
+                                             [t[7] for t in extra],
+                                             [(t[4], t[5]) for t in extra],
+                                             (ymin, ymax))
+            for trace, ydat in zip(extra, scaled):
+                trace[7] = ydat
+
+        for itrace, pname, uselog, color, ymin, ymax, tdat, ydat in traces:
+            side = 'left'
+            if itrace == 1:
+                side = 'right'
+            if itrace == 0:
+                self.plotpanel.set_ylabel(pname)
+            elif itrace == 1:
+                self.plotpanel.set_y2label(pname)
+            if not self.plots_drawn[itrace]:
+                plot = self.plotpanel.oplot
                 if itrace == 0:
-                    self.plotpanel.set_ylabel(pname)
-                elif itrace == 1:
-                    self.plotpanel.set_y2label(pname)
-                if not self.plots_drawn[itrace]:
-                    plot = self.plotpanel.oplot
-                    if itrace == 0:
-                        plot = self.plotpanel.plot
-                    try:
-                        plot(tdat, ydat,
-                             drawstyle='steps-post', side=side,
-                             ylog_scale=uselog, color=color,
-                             xmin=self.tmin, xmax=0,
-                             xlabel=xlabel, label=pname, autoscale=False)
-                        self.plots_drawn[itrace] = True
-                    except:
-                        update_failed = True
-                else:
-                    try:
-                        self.plotpanel.update_line(itrace, tdat, ydat, draw=False, update_limits=True)
-                        # self.plotpanel.plot(tdat, ydat, draw=False, update_limits=True)                        
-                        #self.plotpanel.set_xylims((self.tmin, 0, ymin, ymax),
-                        #                          side=side, autoscale=False)
-                        did_update = True
-                    except:
-                        update_failed = True
+                    plot = self.plotpanel.plot
+                try:
+                    plot(tdat, ydat,
+                         drawstyle='steps-post', side=side,
+                         ylog_scale=uselog, color=color,
+                         xmin=self.tmin, xmax=0,
+                         xlabel=xlabel, label=pname, autoscale=False)
+                    self.plots_drawn[itrace] = True
+                except:
+                    update_failed = True
+            else:
+                try:
+                    # limits are updated once, for all traces, below
+                    self.plotpanel.update_line(itrace, tdat, ydat, side=side,
+                                               draw=False, update_limits=False)
+                    did_update = True
+                except:
+                    update_failed = True
+            if itrace < 2:
                 axes = left_axes
                 if itrace == 1:
                     axes = right_axes
-                if uselog and min(ydat) > 0:
+                if uselog and ydat.min() > 0:
                     axes.set_yscale('log', basey=10)
                 else:
                     axes.set_yscale('linear')
-                    
-                    
-        self.plotpanel.set_title(time.strftime("%Y-%b-%d %H:%M:%S", time.localtime()))
+
+        self.ntraces = len(traces)
         if did_update:
-            self.plotpanel.canvas.draw()
+            self.plotpanel.set_viewlimits()
+            self.redraw()
         self.needs_refresh = update_failed
         return
 
@@ -0,0 +1,79 @@
+"""
+Trace configuration and scaling of traces for the Strip Chart
+"""
+import numpy as np
+
+class TraceManager(object):
+    """cache of the configuration of the traces shown, as a list of
+    (row, pvname, logscale, color, ymin, ymax), read with read_config()
+    only after invalidate() is called, as when a PV row is changed.
+
+    Traces past the first two (which have their own axes) are drawn on
+    the left axes, scaled with normalize().  Traces whose PVs have the
+    same units (set with set_units()) are in the same group, and are
+    scaled together, so that they can be compared.
+    """
+    def __init__(self, read_config):
+        self.read_config = read_config
+        self.units = {}
+        self.traces = None
+
+    def invalidate(self):
+        self.traces = None
+
+    def get_traces(self):
+        "return list of traces"
+        if self.traces is None:
+            self.traces = self.read_config()
+        return self.traces
+
+    def set_units(self, pvname, units):
+        "set units of a PV, used to group traces"
+        if units is not None and len(units.strip()) > 0:
+            self.units[pvname] = units.strip()
+
+    def group(self, pvname):
+        "scaling group of a PV: its units, or else its name"
+        return self.units.get(pvname, ' %s' % pvname)
+
+    def normalize(self, pvnames, ydats, bounds, target):
+        """scale each array of ydats so that the range of its group
+        covers 99% of target (low, high).  The range of a group is from
+        the smallest to largest value of its arrays, unless given as
+        (ymin, ymax) in bounds (None for either to use the data).
+
+        All arrays are scaled together, in one pass over one array, so
+        the cost does not grow with the number of traces.  Returns a
+        list of arrays (views into one array)."""
+        if len(ydats) < 1:
+            return []
+        lengths = np.array([len(y) for y in ydats])
+        starts = np.append(0, np.cumsum(lengths)[:-1])
+        ycat = np.concatenate(ydats)
+        # fmin/fmax ignore NaNs
+        tmin = np.fmin.reduceat(ycat, starts)
+        tmax = np.fmax.reduceat(ycat, starts)
+        for i, (ymin, ymax) in enumerate(bounds):
+            if ymin is not None:
+                tmin[i] = ymin
+            if ymax is not None:
+                tmax[i] = ymax
+
+        groups = {}
+        index = np.array([groups.setdefault(self.group(name), len(groups))
+                          for name in pvnames])
+        gmin = np.empty(len(groups))
+        gmax = np.empty(len(groups))
+        gmin.fill(np.inf)
+        gmax.fill(-np.inf)
+        np.minimum.at(gmin, index, tmin)
+        np.maximum.at(gmax, index, tmax)
+        grange = gmax - gmin
+        grange[~(grange > 1.e-9)] = 1.0
+
+        low, high = target
+        scale = 0.99*(high - low)/grange[index]
+        offset = low - gmin[index]*scale
+        ycat *= np.repeat(scale, lengths)
+        ycat += np.repeat(offset, lengths)
+        return np.split(ycat, starts[1:])
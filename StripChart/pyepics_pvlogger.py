@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Log Epics PVs to the Strip Chart archive, with no display:
+
+   pyepics_pvlogger.py [options] PVLIST_FILE
+
+PVLIST_FILE lists PV names, one per line.  The archive can be shown
+with 'pyepics_stripchart.py --archive=DIR': while the logger runs, it
+holds a lock on the archive directory, and the Strip Chart only reads
+from it.  Only one logger can write to an archive directory.
+"""
+import sys
+from optparse import OptionParser
+
+if (len(sys.argv) > 1 and sys.argv[1].startswith('-d')):
+    sys.argv.pop(1)
+    from lib.logger import PVLogger, read_pvlist
+    from lib.archive import ARCHIVE_DIR, SEGMENT_RECORDS, NSEGMENTS
+else:
+    from epicsapps.stripchart.logger import PVLogger, read_pvlist
+    from epicsapps.stripchart.archive import ARCHIVE_DIR, SEGMENT_RECORDS, NSEGMENTS
+
+if __name__ == '__main__':
+    usage = 'usage: %prog [options] PVLIST_FILE'
+    parser = OptionParser(usage=usage, prog='pyepics_pvlogger')
+    parser.add_option('-a', '--archive', default=ARCHIVE_DIR,
+                      help='archive directory [%default]')
+    parser.add_option('-i', '--interval', type='float', default=0.5,
+                      help='seconds between writes to archive [%default]')
+    parser.add_option('-s', '--stats', default=None,
+                      help='file to write JSON stats to')
+    parser.add_option('-t', '--stats-time', type='float', default=10.0,
+                      help='seconds between stats [%default]')
+    parser.add_option('-r', '--segment-records', type='int',
+                      default=SEGMENT_RECORDS,
+                      help='records per archive file for each PV [%default]')
+    parser.add_option('-n', '--nsegments', type='int', default=NSEGMENTS,
+                      help='archive files kept for each PV [%default]')
+    (opts, args) = parser.parse_args()
+    if len(args) < 1:
+        parser.error('need a file of PV names')
+
+    try:
+        logger = PVLogger(read_pvlist(args[0]), archive=opts.archive,
+                          interval=opts.interval, stats_file=opts.stats,
+                          stats_time=opts.stats_time,
+                          maxrecords=opts.segment_records,
+                          nsegments=opts.nsegments)
+    except IOError, e:
+        parser.error(str(e))
+    logger.handle_signals()
+    logger.run()
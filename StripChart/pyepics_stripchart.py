@@ -5,10 +5,25 @@ import sys
 
 if (len(sys.argv) > 1 and sys.argv[1].startswith('-d')):
     from lib import StripChart
+    from lib.archive import ARCHIVE_DIR
 else:
     from epicsapps.stripchart import StripChart
+    from epicsapps.stripchart.archive import ARCHIVE_DIR
 
 if __name__ == '__main__':
+    # use --archive or --archive=DIR to save PV values to disk, and to
+    # show the PVs and recent values of the last run.  An archive in use
+    # by pyepics_pvlogger.py is shown, but not written to.
+    archive = None
+    pvnames = []
+    for arg in sys.argv[1:]:
+        if arg == '--archive':
+            archive = ARCHIVE_DIR
+        elif arg.startswith('--archive='):
+            archive = arg[len('--archive='):]
+        elif not arg.startswith('-'):
+            pvnames.append(arg)
+
     app = wx.PySimpleApp()
-    StripChart().Show(True)
+    StripChart(archive=archive, pvnames=pvnames or None).Show(True)
     app.MainLoop()
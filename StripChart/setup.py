@@ -13,7 +13,8 @@ setup(name = 'epicsapp_stripchart',
       package_dir = {'epicsapps.stripchart': 'lib',
                      'epicsapps': 'base'},
       packages = ['epicsapps', 'epicsapps.stripchart'],
-      data_files  = [('bin', ['pyepics_stripchart.py'])])
+      data_files  = [('bin', ['pyepics_stripchart.py',
+                               'pyepics_pvlogger.py'])])
 
 
 errmsg = 'WARNING: pyepics_stripchart requires Python module "%s"'